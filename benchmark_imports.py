@@ -0,0 +1,182 @@
+"""Import-time benchmark of the entry point scripts.
+
+Each script is imported (not run) in a fresh interpreter with
+python -X importtime, repeated to smooth out disk caching, and the
+median cold-start time is reported along with the slowest packages
+it pulls in.
+
+Example
+-------
+Benchmark every run_*.py script::
+
+    $ python benchmark_imports.py
+
+Or only some scripts, appending the results to a csv to track them::
+
+    $ python benchmark_imports.py run_kalatsky.py segment_scan.py --repeats 10 --output imports.csv
+
+Attributes
+----------
+- scripts: Scripts to benchmark, defaults to run_*.py.
+- --repeats: Fresh interpreters per script (default 5).
+- --top: Slowest packages listed per script (default 5).
+- --output: csv the median times are appended to.
+"""
+import os
+import sys
+import csv
+import glob
+import time
+import argparse
+import subprocess
+import statistics
+from datetime import datetime
+from rich.table import Table
+from rich.console import Console
+
+# time a single import of the script in a fresh interpreter
+def time_import(script):
+
+    module = os.path.splitext(os.path.basename(script))[0]
+
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=os.path.dirname(os.path.abspath(script)),
+                            capture_output=True,
+                            text=True)
+    seconds = time.perf_counter() - start
+
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {script} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    return seconds, parse_importtime(result.stderr, module)
+
+# cumulative microseconds of each package the script imports, from the -X importtime output
+def parse_importtime(output, module):
+
+    imports = []
+
+    for line in output.splitlines():
+
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name.rstrip()
+
+        # nesting is shown by indenting the name, the width per level is left to the interpreter
+        imports.append((len(name) - len(name.lstrip(" ")), name.strip(), int(cumulative)))
+
+    # a module is listed after everything it imported, so the script's imports are the lines
+    # just above its own that are indented further than it
+    lines = [i for i, (_, name, _) in enumerate(imports) if name == module]
+
+    if not lines:
+        return {}
+
+    depth = imports[lines[-1]][0]
+    nested = []
+
+    for indent, name, cumulative in reversed(imports[:lines[-1]]):
+
+        if indent <= depth:
+            break
+
+        nested.append((indent, name, cumulative))
+
+    packages = {}
+
+    # imports made directly by the script are the least indented, their time includes everything below them
+    if nested:
+
+        direct = min(indent for indent, _, _ in nested)
+
+        for indent, name, cumulative in nested:
+            if indent == direct:
+                package = name.split(".")[0]
+                packages[package] = packages.get(package, 0) + cumulative
+
+    return packages
+
+# median wall-clock time and the slowest packages over several fresh interpreters
+def benchmark(script, repeats=5, top=5):
+
+    times = []
+    packages = {}
+
+    for _ in range(repeats):
+
+        seconds, imported = time_import(script)
+        times.append(seconds)
+
+        for package, microseconds in imported.items():
+            packages.setdefault(package, []).append(microseconds)
+
+    slowest = sorted(((statistics.median(values)/1e6, package) for package, values in packages.items()), reverse=True)[:top]
+
+    return {"script": os.path.basename(script),
+            "median": statistics.median(times),
+            "min": min(times),
+            "slowest": slowest}
+
+def print_results(results):
+
+    table = Table(title="Import Times")
+
+    table.add_column("script", style="cyan")
+    table.add_column("median (s)", justify="right", style="magenta")
+    table.add_column("min (s)", justify="right", style="magenta")
+    table.add_column("slowest imports", style="yellow")
+
+    for result in results:
+        table.add_row(result["script"],
+                      "{:.3f}".format(result["median"]),
+                      "{:.3f}".format(result["min"]),
+                      ", ".join("{} {:.3f}".format(package, seconds) for seconds, package in result["slowest"]))
+
+    console = Console()
+    console.print(table)
+
+# append the median times so cold-start time can be tracked over commits
+def write_results(results, filename):
+
+    exists = os.path.exists(filename)
+
+    with open(filename, mode="a", newline="") as file:
+
+        writer = csv.writer(file)
+
+        if not exists:
+            writer.writerow(["Time", "Script", "Median", "Min"])
+
+        timestamp = datetime.now().isoformat(timespec="seconds")
+
+        for result in results:
+            writer.writerow([timestamp, result["script"], "{:.4f}".format(result["median"]), "{:.4f}".format(result["min"])])
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Benchmark the import time of the entry point scripts.")
+
+    parser.add_argument("scripts", nargs="*", help="Scripts to benchmark, defaults to run_*.py.")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per script.")
+    parser.add_argument("--top", type=int, default=5, help="Slowest packages listed per script.")
+    parser.add_argument("--output", help="csv the median times are appended to.")
+
+    return parser.parse_args()
+
+def run():
+
+    args = parse_args()
+
+    scripts = args.scripts or sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_*.py")))
+
+    results = [benchmark(script, args.repeats, args.top) for script in scripts]
+
+    print_results(results)
+
+    if args.output:
+        write_results(results, args.output)
+
+if __name__ == '__main__':
+    run()
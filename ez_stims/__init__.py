@@ -1,7 +1,38 @@
-from ez_stims.stims.grat_stim import GratStim
-from ez_stims.stims.kalatsky_stim import KalatskyStim
-from ez_stims.stims.dots_stim import DotsStim
-from ez_stims.stims.single_dot_stim import SingleDotStim
+"""
+Stimulus classes, logging and segmenting, each loaded on first use.
 
-from ez_stims.utils.log import Log
-from ez_stims.utils import setup, segmenting
\ No newline at end of file
+Names are resolved through the module __getattr__ below, so an entry point
+only imports the modules (and the psychopy, tifffile, etc. they depend on)
+it actually uses, e.g. segmenting never pulls in psychopy.
+"""
+import importlib
+
+_ATTRIBUTES = {"GratStim": ("ez_stims.stims.grat_stim", "GratStim"),
+               "KalatskyStim": ("ez_stims.stims.kalatsky_stim", "KalatskyStim"),
+               "DotsStim": ("ez_stims.stims.dots_stim", "DotsStim"),
+               "SingleDotStim": ("ez_stims.stims.single_dot_stim", "SingleDotStim"),
+               "Log": ("ez_stims.utils.log", "Log"),
+               "setup": ("ez_stims.utils.setup", None),
+               "segmenting": ("ez_stims.utils.segmenting", None)}
+
+__all__ = list(_ATTRIBUTES)
+
+def __getattr__(name):
+
+    if name not in _ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    module_name, attribute = _ATTRIBUTES[name]
+    value = importlib.import_module(module_name)
+
+    if attribute is not None:
+        value = getattr(value, attribute)
+
+    # cache on the package so later lookups skip __getattr__
+    globals()[name] = value
+
+    return value
+
+def __dir__():
+
+    return sorted(set(globals()) | set(__all__))
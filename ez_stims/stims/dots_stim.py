@@ -1,55 +1,42 @@
-from psychopy import event, core, visual
 import time
 import sys
 import numpy as np
-import math
 import random
 from rich.table import Table
 from rich.console import Console
-import gc
 
 from ez_stims.utils.util_funcs import *
-from ez_stims.visual.geometry import tangent_linspace
+from ez_stims.utils.allocation import AllocationPolicy
+from ez_stims.utils.frame_timing import FrameTimer
+from ez_stims.utils.idle import IdleScheduler
+from ez_stims.visual.dot_field import DotField
 
 class DotsStim():
 
-    def __init__(self, config, monitor_config):
+    def __init__(self, config, monitor_config, log=None):
         
-        # assign config as attributes
-        for name, value in monitor_config.items():
-            setattr(self, name, value)
-            
-        for name, value in config.items():
-            setattr(self, name, value)
+        # validated configs, settings and derived values are read from these and never modified
+        self.config = config
+        self.monitor_config = monitor_config
 
         self.dots = []
-
-        # calculate viewing angle and resolution ratio
-        self.viewing_angle = get_viewing_angle(self.screen_width, self.viewing_distance)
-        self.resolution_ratio = self.resolution[1]/self.resolution[0]
-        self.screen_diagonal = math.hypot(self.resolution[0], self.resolution[1])
-        
-        # calculate time varaibles
-        self.phase_advance = -(self.resolution_ratio * self.dot_velocity * 100)/self.frame_rate
-        self.spawn_period = 1/self.spawn_frequency 
+        self.field = None
+        self.background_rect = None
+        self.prepared = False
         
-        self.max_dots = 50*(self.spawn_frequency/self.dot_velocity)
-        print(self.max_dots)
+        # return ends the dots stimulus itself, so it never stops a session
+        self.stopped = False
+        self.allocation = AllocationPolicy()
+        self.frame_timer = FrameTimer(monitor_config.frame_rate)
+        self.idle = IdleScheduler(self.get_keypress)
+        self.log = log
         
-        self.angle_rad = math.radians(self.angle)
-        self.x_increment = np.cos(self.angle_rad) * self.phase_advance
-        self.y_increment = np.sin(self.angle_rad) * self.phase_advance
+        print(config.max_dots)
         
-        self.screen_circle_radius = self.screen_diagonal*0.55
-        self.spawn_exclusion_width = int(round(self.num_spawn_loc*self.dot_radius_pix/self.screen_diagonal))
-        self.possible_spawn = range(self.num_spawn_loc)
+        self.possible_spawn = np.arange(config.num_spawn_loc)
         
-        genx, geny = tangent_linspace(theta=self.angle_rad, 
-                                      radius=self.screen_circle_radius, 
-                                      length=self.screen_diagonal, 
-                                      N=self.num_spawn_loc)
-        
-        self.spawn_linspace = list(zip(genx, geny))
+        # private generator, seeded by the headless renderer for reproducible frames
+        self.random = random.Random()
         
     # methods
     def add_window(self, window):
@@ -60,6 +47,8 @@ class DotsStim():
     def start_timer(self):
         """ Start timer for runtime of stimulus presentation """
 
+        from psychopy import core
+
         self.timer = core.Clock()
 
     def get_timestamp(self):
@@ -73,6 +62,8 @@ class DotsStim():
     def get_keypress(self):
         """ Listen for key press """
 
+        from psychopy import event
+
         keys = event.getKeys()
         if keys:
             return keys[0]
@@ -82,96 +73,168 @@ class DotsStim():
     def wait(self):
         """ Wait for keypress before kalatsky presentation """
 
-        waiting = True
+        self.idle.wait_for_key("space")
 
-        while waiting:
+    def prepare(self):
+        """ Create the background and, for the ELEMENTS engine, the dot field up front, nothing is drawn until presented """
+        
+        if self.prepared:
+            return
+        
+        # psychopy is only imported once draw objects are created, so stimuli can be rendered headless without it
+        from psychopy import visual
+        
+        self.background_rect = visual.Rect(self.window, 
+                                           size=3, 
+                                           fillColor=self.config.background_color, 
+                                           colorSpace='rgb',
+                                           autoDraw=False)
+        
+        # CIRCLES dots are only created as they spawn
+        if self.config.engine.name == "ELEMENTS":
             
-            key = self.get_keypress()
-            if key == "space":
-                waiting = False
-
+            self.field = DotField(self.window, 
+                                  capacity=self.config.max_dots, 
+                                  radius=self.config.dot_radius_pix, 
+                                  color=self.config.color)
+            
+        self.prepared = True
+    
     def background(self):
         """ Display background colour to the screen """
         
-        self.background = visual.Rect(self.window, 
-                                      size=3, 
-                                      fillColor=self.background_color, 
-                                      colorSpace='rgb',
-                                      autoDraw=True)
+        self.prepare()
+        self.background_rect.autoDraw = True
         
         self.window.flip()
     
     def present(self):
         """ Prsent Kalatsky stimulus """
         
-        spawn_timer = core.CountdownTimer(self.spawn_period)
+        from psychopy import core
+        
+        self.prepare()
+        
+        spawn_timer = core.CountdownTimer(self.config.spawn_period)
         # kill_timer = core.CountdownTimer(self.kill_delay)
         
         # self.killing = False
 
-        # play kalatsky stimulus
-        while True:
-            
-            key = self.get_keypress()
-            
-            self.advance()
+        if self.field is not None:
+            self.field.set_auto_draw(True)
 
-            # when flip timer ends, reverse colours and reset timer
-            if spawn_timer.getTime() <= 0:
+        start_time = self.get_timestamp()
+        self.frame_timer.start()
+        
+        # play dots stimulus with the collector held off
+        self.allocation.attach()
+        
+        with self.allocation.epoch("dots"):
+            
+            while True:
                 
-                self.delete_dots()
-                spawn_timer.reset()
-                print("Dot count: " + str(len(self.dots)), end="\r")
+                key = self.get_keypress()
                 
-                if len(self.dots) < self.max_dots:
+                self.advance()
+
+                # when spawn timer ends, cull old dots and spawn a new one
+                if spawn_timer.getTime() <= 0:
+                    
+                    self.delete_dots()
+                    spawn_timer.reset()
+                    print("Dot count: " + str(self.dot_count()), end="\r")
+                    
+                    if self.dot_count() < self.config.max_dots:
+                    
+                        self.spawn_dot()
                 
-                    # self.flip_stim()
-                    gc.collect()
-                    self.spawn_dot()
-            
-            # end if return is pressed  
-            if key == "return":
-
-                print("Dot count: " + str(len(self.dots)))
-                self.window.close()
-                sys.exit()
+                # stop if return is pressed, handing control back to the caller
+                if key == "return":
+                    
+                    self.stopped = True
+                    break
+
+        print("Dot count: " + str(self.dot_count()))
+        self.allocation.detach()
+        self.allocation.print_report()
+        
+        # return is the only way the dots end, so the presentation is logged even though it stopped
+        if self.log is not None:
+            self.log.add_stim("dots", 1, start_time, self.get_timestamp(), self.frame_timer.summary())
+    
+    def clear(self):
+        """ Stop drawing the stimulus so the window can be used by the next one """
+        
+        if self.field is not None:
+            self.field.set_auto_draw(False)
+        
+        for component in [self.background_rect] + self.dots:
+            if component is not None:
+                component.autoDraw = False
+        
+    def dot_count(self):
+        
+        if self.field is not None:
+            return self.field.count()
+        
+        return len(self.dots)
         
     def advance(self):
 
+        if self.field is not None:
+            
+            # one array add moves the whole field
+            self.field.advance((self.config.x_increment, self.config.y_increment))
+            self.frame_timer.flip(self.window)
+            return
+
         for i in range(len(self.dots)):
             
             # advance position
-            self.dots[i].pos += (self.x_increment, self.y_increment)
+            self.dots[i].pos += (self.config.x_increment, self.config.y_increment)
             
-        self.window.flip()
+        self.frame_timer.flip(self.window)
     
     def delete_dots(self):
         
-        for i in range(len(self.dots)):
+        if self.field is not None:
             
-            # remove old dots
-            if (abs(self.dots[i].pos[0]) > self.screen_circle_radius*1.5) or (abs(self.dots[i].pos[1]) > self.screen_circle_radius*1.5):
-                self.dots.pop(i)
-                break
-    
-    def spawn_dot(self):
-        
-        i = random.choice(self.possible_spawn)
-        position = self.spawn_linspace[i]
+            self.field.cull(self.config.screen_circle_radius*1.5)
+            return
         
-        self.dots.append(visual.Circle(self.window, 
-                                        radius=self.dot_radius_pix, 
-                                        units="pix",
-                                        fillColor="white",
-                                        pos=position,
-                                        autoDraw=True))
+        limit = self.config.screen_circle_radius*1.5
+        live_dots = []
         
-        self.possible_spawn = list(range(self.num_spawn_loc))
+        # remove all old dots in one pass
+        for dot in self.dots:
+            
+            if (abs(dot.pos[0]) > limit) or (abs(dot.pos[1]) > limit):
+                dot.autoDraw = False
+            else:
+                live_dots.append(dot)
+                
+        self.dots = live_dots
+    
+    def spawn_dot(self):
         
-        bottom = i-self.spawn_exclusion_width if i > (self.spawn_exclusion_width/2) else 0
-        top = i-self.spawn_exclusion_width if i < self.num_spawn_loc - (self.spawn_exclusion_width/2) else self.num_spawn_loc
+        i = self.random.choice(self.possible_spawn)
+        position = self.config.spawn_linspace[i]
         
-        [self.possible_spawn.remove(x) for x in range(bottom, top)]
+        if self.field is not None:
+            self.field.spawn(position)
+        else:
+            
+            from psychopy import visual
+            
+            self.dots.append(visual.Circle(self.window, 
+                                           radius=self.config.dot_radius_pix, 
+                                           units="pix",
+                                           fillColor="white",
+                                           pos=position,
+                                           autoDraw=True))
+        
+        # block locations overlapping this dot for the next spawn
+        self.possible_spawn = self.config.spawn_candidates[i]
     
     def print_settings(self):
         
@@ -181,7 +244,7 @@ class DotsStim():
         table.add_column("units", style="yellow")
         table.add_column("value", justify="right", style="magenta")
         
-        table.add_row("viewing angle", "degrees", "{:.1f}".format(self.viewing_angle))
+        table.add_row("viewing angle", "degrees", "{:.1f}".format(self.monitor_config.viewing_angle))
         # table.add_row("stimulus width", "degrees", "{:.1f}".format(self.stim_width))
         # table.add_row("cycle period", "seconds", "{:.2f}".format(self.cycle_period))
         # table.add_row("number of cycles", "--", "{:d}".format(self.cycles))
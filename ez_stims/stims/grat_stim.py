@@ -1,36 +1,39 @@
-from psychopy import event, core, visual
 import random
 import time
-import sys
 from rich import print as rprint
 
 from ez_stims.utils.util_funcs import *
 from ez_stims.visual.stimulus import Stimulus
+from ez_stims.visual.timeline import Timeline
+from ez_stims.visual.grating_cache import GratingCache
+from ez_stims.visual.movie_cache import present_cached, prepare_cached
+from ez_stims.utils.allocation import AllocationPolicy
+from ez_stims.utils.frame_timing import FrameTimer
+from ez_stims.utils.idle import IdleScheduler
 from ez_stims.utils.util_funcs import *
 
 class GratStim():
 
     def __init__(self, config, monitor_config, log):
         
-        self.global_config = config["global"]
-        self.paradigm = config["paradigm"]
+        # validated configs, settings and derived values are read from these and never modified
+        self.config = config
         self.monitor_config = monitor_config
         self.log = log
         
-        self.stim_size = set_stimulus_size(self.monitor_config)
-        
-        # assign config as attributes
-        for name, value in self.monitor_config.items():
-            setattr(self, name, value)
-            
-        for name, value in self.global_config.items():
-            setattr(self, name, value)
+        # copied so shuffling leaves the config's order untouched
+        self.paradigm = list(config.paradigm)
             
-        if self.randomise:
+        if config.randomise:
             
             random.shuffle(self.paradigm)
             
         self.stimuli = []
+        self.prepared = False
+        self.allocation = AllocationPolicy()
+        self.frame_timer = FrameTimer(monitor_config.frame_rate)
+        self.idle = IdleScheduler(self.get_keypress)
+        self.stopped = False
             
     # methods
     def background(self):
@@ -42,13 +45,7 @@ class GratStim():
     def wait(self):
         """ Wait for keypress before kalatsky presentation """
 
-        waiting = True
-
-        while waiting:
-            
-            key = self.get_keypress()
-            if key == "space":
-                waiting = False
+        self.idle.wait_for_key("space")
 
     def add_window(self, window):
         """ Add a psychopy window for the stimulus to be presented on """
@@ -56,30 +53,78 @@ class GratStim():
         self.window = window
     
     def add_stimuli(self):
+        
+        from psychopy import visual
+        
         # A light green text
-        self.baseline = visual.Rect(self.window, size=3, fillColor=self.baseline_color, colorSpace='rgb')
+        self.baseline = visual.Rect(self.window, size=3, fillColor=self.config.baseline_color, colorSpace='rgb')
+        self.grating_cache = GratingCache(self.window)
+        
+        self.build_stimuli(self.grating_cache)
+        
+    def prepare(self):
+        """ Create the baseline and build every grating (or render the cached movie) up front, gratings are drawn explicitly """
+        
+        if self.prepared:
+            return
+        
+        if not self.stimuli:
+            self.add_stimuli()
+        
+        if self.config.cached:
+            prepare_cached(self)
+        else:
+            for stimulus in self.stimuli:
+                stimulus.prepare()
+                
+        self.prepared = True
+        
+    def build_stimuli(self, cache=None):
+        """ Create a Stimulus per paradigm entry, gratings are only built when first needed """
+        
+        window = getattr(self, "window", None)
+        self.stimuli = []
+        
         for i in range(len(self.paradigm)):
-            self.stimuli.append(Stimulus(self.window, self.monitor_config, self.paradigm[i], self.stim_size))
+            self.stimuli.append(Stimulus(window, self.paradigm[i], self.monitor_config.stim_size, cache))
             
         self.num_stimuli = len(self.stimuli)
 
     def start_timer(self):
         """ Start timer for runtime of stimulus presentation """
 
+        from psychopy import core
+
         self.timer = core.Clock()
         
     def present(self):
         
+        self.prepare()
+        
+        if self.config.cached:
+            
+            present_cached(self)
+            return
+        
+        if self.config.compiled_timeline:
+            
+            self.present_timeline()
+            return
+        
         exp_start_time = self.get_timestamp()
+        self.allocation.attach()
         
         if self.is_intro_active():
             self.intro(exp_start_time)
 
-        for i in range(1, self.iterations+1):
+        for i in range(1, self.config.iterations+1):
             for j in range(self.num_stimuli):
 
                 rprint(f"Baseline", end='\r')
-                self.present_baseline()
+                self.present_baseline(j)
+                
+                if self.stopped:
+                    break
                 
                 stim_name = self.stimuli[j].get_name()
                 stim_init_time = self.get_timestamp()
@@ -87,18 +132,122 @@ class GratStim():
                 
                 rprint(f"Iteration {i} - Stimulus {stim_name} [{stim_init_time_seconds}]", end='\r')
                 
-                self.present_stimulus(j)
+                timing = self.present_stimulus(j)
+                
+                if self.stopped:
+                    break
                 
                 stim_end_time = self.get_timestamp()
                 stim_end_time_seconds = round((stim_end_time-exp_start_time)/1000, 1)
                 
-                self.log.add_stim(stim_name, i, stim_init_time, stim_end_time)
+                self.log.add_stim(stim_name, i, stim_init_time, stim_end_time, timing)
                 
                 rprint(f"Iteration {i} - Stimulus {stim_name} [{stim_init_time_seconds}-{stim_end_time_seconds}]")
+                
+            if self.stopped:
+                break
         
-        if self.is_outro_active():
+        if self.is_outro_active() and not self.stopped:
             self.outro(exp_start_time)
+            
+        self.allocation.detach()
+        self.allocation.print_report()
+        self.idle.print_report()
 
+    def build_timeline(self):
+        """ Compile intro, baselines, paradigm and outro into an exact per-frame schedule """
+        
+        timeline = Timeline(self.monitor_config.frame_rate)
+        
+        if self.is_intro_active():
+            timeline.add_baseline(self.config.intro_duration)
+            
+        for i in range(1, self.config.iterations+1):
+            for j in range(self.num_stimuli):
+                
+                timeline.add_baseline(self.config.baseline_duration)
+                timeline.add_stimulus(j, i, self.stimuli[j].get_duration())
+                
+        if self.is_outro_active():
+            timeline.add_baseline(self.config.outro_duration)
+            
+        return timeline.compile(self.stimuli)
+    
+    def present_timeline(self):
+        """ Walk the compiled timeline, drawing and flipping once per frame """
+        
+        timeline = self.build_timeline()
+        stim_index = timeline.stim_index
+        phase = timeline.phase
+        entries = timeline.entries
+        
+        rprint(f"Timeline [{timeline.num_frames} frames, {timeline.get_duration():.1f} s]")
+        
+        if entries:
+            self.stimuli[entries[0]["index"]].prepare()
+        
+        exp_start_time = self.get_timestamp()
+        self.allocation.attach()
+        k = 0
+        
+        for frame in range(timeline.num_frames):
+            
+            index = stim_index[frame]
+            
+            # entering a stimulus
+            if k < len(entries) and frame == entries[k]["start_frame"]:
+                
+                self.frame_timer.start(self.stimuli[index].get_duration())
+                self.allocation.start_epoch(self.stimuli[index].get_name())
+            
+            if index == Timeline.BASELINE:
+                self.baseline.draw()
+            else:
+                self.stimuli[index].draw_at(phase[frame])
+                
+            self.frame_timer.flip(self.window)
+            
+            if k < len(entries) and frame == entries[k]["start_frame"]:
+                stim_init_time = self.get_timestamp()
+            
+            # leaving a stimulus, log it and collect before the next baseline
+            if k < len(entries) and frame == entries[k]["end_frame"] - 1:
+                
+                stim_end_time = self.get_timestamp()
+                self.allocation.end_epoch()
+                
+                entry = entries[k]
+                stim_name = self.stimuli[entry["index"]].get_name()
+                self.log.add_stim(stim_name, entry["iteration"], stim_init_time, stim_end_time, self.frame_timer.summary())
+                
+                stim_init_time_seconds = round((stim_init_time-exp_start_time)/1000, 1)
+                stim_end_time_seconds = round((stim_end_time-exp_start_time)/1000, 1)
+                rprint(f"Iteration {entry['iteration']} - Stimulus {stim_name} [{stim_init_time_seconds}-{stim_end_time_seconds}]")
+                
+                self.allocation.collect()
+                k += 1
+                
+                if k < len(entries):
+                    self.stimuli[entries[k]["index"]].prepare()
+                
+            # check for key press
+            key = self.get_keypress()
+
+            if key == "return":
+
+                # stop, handing control back to the caller
+                self.allocation.end_epoch()
+                self.stopped = True
+                break
+        
+        self.allocation.detach()
+        self.allocation.print_report()
+            
+    def clear(self):
+        """ Nothing is auto drawn, the baseline and gratings are drawn every frame """
+        
+        pass
+            
     def get_timestamp(self):
         
         time_unix = time.time()
@@ -110,11 +259,13 @@ class GratStim():
         
         current_stim = self.paradigm[j]
         
-        return current_stim["name"]
+        return current_stim.name
 
     def get_keypress(self):
         """ Listen for key press """
 
+        from psychopy import event
+
         keys = event.getKeys()
         if keys:
             return keys[0]
@@ -123,15 +274,13 @@ class GratStim():
 
     def intro(self, exp_start_time):
         
-        intro_timer = core.CountdownTimer(self.intro_duration)
+        intro_start = time.perf_counter()
         self.baseline.draw()
         self.window.flip()
         
         rprint(f"Intro [0.0]", end='\r')
 
-        while intro_timer.getTime() > 0:
-
-            pass
+        self.idle.wait(self.config.intro_duration, name="intro", start=intro_start)
         
         intro_end_time = self.get_timestamp()
         intro_end_time_seconds = round((intro_end_time-exp_start_time)/1000, 1)
@@ -140,7 +289,7 @@ class GratStim():
         
     def outro(self, exp_start_time):
         
-        outro_timer = core.CountdownTimer(self.outro_duration)
+        outro_start = time.perf_counter()
         self.baseline.draw()
         self.window.flip()
         
@@ -149,61 +298,64 @@ class GratStim():
         
         rprint(f"Outro [{outro_start_time_seconds}]", end='\r')
 
-        while outro_timer.getTime() > 0:
-
-            pass
+        self.idle.wait(self.config.outro_duration, name="outro", start=outro_start)
         
         exp_end_time = self.get_timestamp()
         exp_end_time_seconds = round((exp_end_time-exp_start_time)/1000, 1)
         
         rprint(f"Outro [{outro_start_time_seconds}-{exp_end_time_seconds}]")
 
-    def present_baseline(self):
+    def present_baseline(self, j=None):
         
-        baseline_timer = core.CountdownTimer(self.baseline_duration)
+        baseline_start = time.perf_counter()
         
         self.baseline.draw()
         self.window.flip()
-        # core.wait(self.baseline_duration)
         
-        # # advance phase of grating continuously until key press command
-        while baseline_timer.getTime() > 0:
-
-        # check for key press
-            key = self.get_keypress()
-
-            if key == "return":
+        # collect garbage and build the next grating now so neither lands inside the stimulus
+        self.allocation.collect()
+        
+        if j is not None:
+            self.stimuli[j].prepare()
+        
+        # idle until the baseline ends, still listening for the stop key
+        key = self.idle.wait(self.config.baseline_duration, name="baseline", stop_keys=("return",), start=baseline_start)
 
-                # stop
-                self.window.close()
-                sys.exit()
+        if key == "return":
 
-        #     # wait
-        #     continue
+            # stop, handing control back to the caller
+            self.stopped = True
             
     def present_stimulus(self, j):
         
+        from psychopy import core
+        
         # done = False
         # paused = False
         
         stimulus = self.stimuli[j]
 
         stimulus_timer = core.CountdownTimer(stimulus.get_duration())
+        self.frame_timer.start(stimulus.get_duration())
 
         # advance phase of grating continuously until key press command
-        while stimulus_timer.getTime() > 0:
-
-            stimulus.advance()
-            self.window.flip()
+        with self.allocation.epoch(stimulus.get_name()):
             
-            # check for key press
-            key = self.get_keypress()
+            while stimulus_timer.getTime() > 0:
 
-            if key == "return":
+                stimulus.advance()
+                self.frame_timer.flip(self.window)
+                
+                # check for key press
+                key = self.get_keypress()
+
+                if key == "return":
 
-                # stop
-                self.window.close()
-                sys.exit()
+                    # stop, handing control back to the caller
+                    self.stopped = True
+                    break
+                    
+        return self.frame_timer.summary()
 
             # elif key == "space":
 
@@ -212,15 +364,15 @@ class GratStim():
          
     def is_intro_active(self):
         
-        return self.intro_active
+        return self.config.intro_active
         
     def is_outro_active(self):
         
-        return self.outro_active
+        return self.config.outro_active
             
     def randomising_order(self):
         
-        return self.randomise
+        return self.config.randomise
 
     def shuffle(self):
         
@@ -228,7 +380,7 @@ class GratStim():
         
     def get_num_iterations(self):
         
-        return self.iterations
+        return self.config.iterations
         
     def get_num_stimuli(self):
         
@@ -1,61 +1,53 @@
-from psychopy import event, core, visual
 import time
-import sys
 import numpy as np
 from rich.table import Table
 from rich.console import Console
 
 from ez_stims.utils.util_funcs import *
-from ez_stims.utils.enums import StimType, EdgeBehavior
+from ez_stims.utils.allocation import AllocationPolicy
+from ez_stims.utils.frame_timing import FrameTimer
+from ez_stims.utils.idle import IdleScheduler
+from ez_stims.visual.movie_cache import present_cached, prepare_cached
+from ez_stims.visual.headless import to_rgb
+from ez_stims.visual.warp import WarpedBar, get_warp_maps
+from ez_stims.visual.gl_stims import WarpedBarShader
+
+TEXTURE_MIN_SIZE = 1024 # texels per side, keeps check edges within a pixel when number_of_checks is not a power of two
 
 class KalatskyStim():
 
-    def __init__(self, config, monitor_config):
+    def __init__(self, config, monitor_config, log=None):
         
-        # assign config as attributes
-        for name, value in monitor_config.items():
-            setattr(self, name, value)
-            
-        for name, value in config.items():
-            setattr(self, name, value)
-            
-        self.stimulus_type = StimType[self.stimulus_type]
-        self.behavior = EdgeBehavior[self.behavior]
+        # validated configs, settings and derived values are read from these and never modified
+        self.config = config
+        self.monitor_config = monitor_config
 
         # initialise variables and left and right check arrays
         self.flipped = False
         self.checks_left = []
         self.checks_right = []
+        self.texture = None
+        self.warped = None
+        self.background_rect = None
+        self.prepared = False
+        self.stopped = False
         self.cycles_complete = 0
+        self.allocation = AllocationPolicy()
+        self.frame_timer = FrameTimer(monitor_config.frame_rate)
+        self.idle = IdleScheduler(self.get_keypress)
+        self.log = log
 
-        # calculate viewing angle and resolution ratio
-        self.viewing_angle = get_viewing_angle(self.screen_width, self.viewing_distance)
-        self.resolution_ratio = self.resolution[1]/self.resolution[0]
-
-        # force direction if at an end location
-        if self.starting_position == 1:
-            self.direction = -1
-        elif self.starting_position == -1:
-            self.direction = 1
-        
-        # calculate time varaibles
-        self.cycle_period = self.viewing_angle/self.velocity
-        self.phase_advance = self.resolution_ratio * (2/(self.cycle_period*self.frame_rate)) * self.direction
-        self.flip_period = 1/self.flip_frequency 
+        # reversed on each bounce
+        self.phase_advance = config.phase_advance
         
-        # calculate size variables
-        self.check_height = 2/self.number_of_checks
-        self.check_width = self.check_height * self.resolution_ratio
-        self.stim_width = (self.check_width*self.viewing_angle)
-        self.loop_change = (2*self.check_width) + 2
-
-        # find true starting position (weighted to ensure 1/-1 is offscreen)
-        self.starting_position = self.starting_position * (1+self.check_width)/1
+        # frame schedule, all timing is counted in frames
+        self.lag_frames_remaining = 0
+        self.frame = 0
         
         # setup x coordinate variables
-        self.centre = self.starting_position
-        self.left_x = self.centre-(self.check_width/2)
-        self.right_x = self.centre+(self.check_width/2)
+        self.centre = config.start_centre
+        self.left_x = self.centre-(config.check_width/2)
+        self.right_x = self.centre+(config.check_width/2)
             
     # methods
     def add_window(self, window):
@@ -66,6 +58,8 @@ class KalatskyStim():
     def start_timer(self):
         """ Start timer for runtime of stimulus presentation """
 
+        from psychopy import core
+
         self.timer = core.Clock()
 
     def get_timestamp(self):
@@ -79,6 +73,8 @@ class KalatskyStim():
     def get_keypress(self):
         """ Listen for key press """
 
+        from psychopy import event
+
         keys = event.getKeys()
         if keys:
             return keys[0]
@@ -88,134 +84,295 @@ class KalatskyStim():
     def wait(self):
         """ Wait for keypress before kalatsky presentation """
 
-        waiting = True
+        self.idle.wait_for_key("space")
 
-        while waiting:
+    def prepare(self):
+        """ Create the background and the draw objects of the engine (or the cached movie) up front, nothing is drawn until presented """
+        
+        if self.prepared:
+            return
+        
+        # psychopy is only imported once draw objects are created, so stimuli can be rendered headless without it
+        from psychopy import visual
+        
+        self.background_rect = visual.Rect(self.window, 
+                                           size=3, 
+                                           fillColor=self.config.background_color, 
+                                           colorSpace='rgb',
+                                           autoDraw=False)
+        
+        if self.config.cached:
+            prepare_cached(self)
+        elif self.config.engine.name == "TEXTURE":
+            self.add_texture()
+        elif self.config.engine.name == "SPHERICAL":
+            self.add_warped()
+        else:
+            self.add_checks()
             
-            key = self.get_keypress()
-            if key == "space":
-                waiting = False
-
+        self.prepared = True
+    
     def background(self):
         """ Display background colour to the screen """
         
-        self.background = visual.Rect(self.window, 
-                                      size=3, 
-                                      fillColor=self.background_color, 
-                                      colorSpace='rgb',
-                                      autoDraw=True)
+        self.prepare()
+        self.background_rect.autoDraw = True
         
         self.window.flip()
     
     def present(self):
         """ Prsent Kalatsky stimulus """
         
-        flip_timer = core.CountdownTimer(self.flip_period)
-        colors = self.initial_colors
+        self.prepare()
+        
+        if self.config.cached:
+            
+            present_cached(self)
+            return
+        
+        self.set_auto_draw(True)
+        
+        # the warped bar is drawn before each flip, an autoDrawn background would be drawn over it
+        background_shown = self.background_rect.autoDraw
+        
+        if self.warped is not None:
+            self.background_rect.autoDraw = False
+        
+        self.draw_warped()
+        self.window.flip()
+        
+        start_time = self.get_timestamp()
+        self.frame_timer.start(self.config.cycles*(self.config.cycle_period+self.config.lag))
+        
+        # play stimulus with the collector held off
+        self.allocation.attach()
+        
+        with self.allocation.epoch("kalatsky"):
+            
+            while self.cycles_complete < self.config.cycles:
+            
+                key = self.get_keypress()
+                
+                # apply this frame's state changes, then flip exactly once
+                self.next_frame()
+                self.frame_timer.flip(self.window)
+                self.frame += 1
+            
+                # stop if return is pressed, handing control back to the caller
+                if key == "return":
+                    
+                    self.stopped = True
+                    break
+
+        if self.warped is not None:
+            self.background_rect.autoDraw = background_shown
+        
+        self.allocation.detach()
+        self.allocation.print_report()
+        
+        if self.log is not None and not self.stopped:
+            self.log.add_stim("kalatsky", 1, start_time, self.get_timestamp(), self.frame_timer.summary())
+    
+    def clear(self):
+        """ Stop drawing the stimulus so the window can be used by the next one """
+        
+        if self.background_rect is not None:
+            self.background_rect.autoDraw = False
+            
+        self.set_auto_draw(False)
+        
+        if self.warped is not None:
+            self.warped.release()
+            self.warped = None
+    
+    def set_auto_draw(self, value):
+        """ Turn drawing of the texture or checks on or off, the warped bar is drawn explicitly every frame """
+        
+        for component in [self.texture] + self.checks_left + self.checks_right:
+            if component is not None:
+                component.autoDraw = value
+    
+    def get_color_index(self, row):
+        """ Index into initial_colors of the left check in a row (from the bottom), the right check has the other """
+        
+        index = row % 2 if self.config.stimulus_type.name == "CHECK" else 0
         
-        # draw checkerboard or bars
-        for i in np.linspace(start=(self.check_height/2)-1, stop=1-(self.check_height/2), num=self.number_of_checks):
+        return index ^ int(self.flipped)
+    
+    def add_checks(self):
+        """ Draw the checkerboard or bars as one Rect per check """
+        
+        from psychopy import visual
+        
+        rows = np.linspace(start=(self.config.check_height/2)-1, stop=1-(self.config.check_height/2), num=self.config.number_of_checks)
+        
+        for row, y in enumerate(rows):
+            
+            index = self.get_color_index(row)
         
             self.checks_left.append(visual.Rect(self.window, 
-                                    size=(self.check_width, self.check_height), 
+                                    size=(self.config.check_width, self.config.check_height), 
                                     units="norm",
-                                    fillColor=colors[0],
-                                    pos=(self.left_x, i),
-                                    autoDraw=True))
+                                    fillColor=self.config.initial_colors[index],
+                                    pos=(self.left_x, y),
+                                    autoDraw=False))
             
             self.checks_right.append(visual.Rect(self.window, 
-                                    size=(self.check_width, self.check_height), 
+                                    size=(self.config.check_width, self.config.check_height), 
                                     units="norm",
-                                    fillColor=colors[1],
-                                    pos=(self.right_x, i),
-                                    autoDraw=True))
-            
-            if self.stimulus_type.name == "CHECK": colors.reverse()
+                                    fillColor=self.config.initial_colors[1-index],
+                                    pos=(self.right_x, y),
+                                    autoDraw=False))
+    
+    def get_texture(self):
+        """ Both columns of checks as one square power-of-two RGB texture, left checks in the left half, bottom row first """
         
-        self.window.flip()
+        from psychopy.colors import Color
         
-        # play kalatsky stimulus
-        while self.cycles_complete < self.cycles:
-            
-            key = self.get_keypress()
-            
+        size = max(2**int(np.ceil(np.log2(self.config.number_of_checks))), TEXTURE_MIN_SIZE)
+        palette = np.array([(Color(color) if isinstance(color, str) else Color(color, "rgb")).rgb for color in self.config.initial_colors])
+        
+        rows = np.arange(size) * self.config.number_of_checks // size
+        left_index = np.array([self.get_color_index(row) for row in rows])
+        
+        texture = np.empty((size, size, 3))
+        texture[:, :size//2] = palette[left_index][:, None, :]
+        texture[:, size//2:] = palette[1-left_index][:, None, :]
+        
+        return texture
+    
+    def add_texture(self):
+        """ Draw the checkerboard or bars as a single texture, moved by its position and reversed by its phase """
+        
+        from psychopy import visual
+        
+        # one texture cycle spans the stimulus (sf is in cycles per stimulus for norm units), half a cycle swaps the columns
+        self.texture = visual.GratingStim(self.window,
+                                          tex=self.get_texture(),
+                                          units="norm",
+                                          size=(2*self.config.check_width, 2),
+                                          sf=1,
+                                          pos=(self.centre, 0),
+                                          interpolate=False,
+                                          autoDraw=False)
+    
+    def get_azimuth(self):
+        """ Azimuth (degrees) of the bar centre, the norm sweep mapped onto the screen's azimuth range """
+        
+        return self.centre * self.monitor_config.viewing_angle/2
+    
+    def get_warped_bar(self, resolution):
+        """ Spherically corrected bar drawn from the cached warp maps of the monitor """
+        
+        azimuth, altitude = get_warp_maps(self.monitor_config, resolution)
+        
+        return WarpedBar(azimuth,
+                         altitude,
+                         self.config.check_size,
+                         np.stack([to_rgb(color) for color in self.config.initial_colors]),
+                         to_rgb(self.config.background_color),
+                         checkered=self.config.stimulus_type.name == "CHECK")
+    
+    def add_warped(self):
+        """ Draw the bar spherically corrected, the warp map lookup runs in a shader with position and flip as uniforms """
+        
+        azimuth, altitude = get_warp_maps(self.monitor_config)
+        
+        self.warped = WarpedBarShader(self.window,
+                                      azimuth,
+                                      altitude,
+                                      self.config.check_size,
+                                      np.stack([to_rgb(color) for color in self.config.initial_colors]),
+                                      to_rgb(self.config.background_color),
+                                      checkered=self.config.stimulus_type.name == "CHECK")
+    
+    def draw_warped(self):
+        """ Draw the warped bar at the current position and colours, it is not autoDrawn so this precedes every flip """
+        
+        if self.warped is not None:
+            self.warped.update(self.get_azimuth(), self.flipped)
+            self.warped.draw()
+    
+    def next_frame(self):
+        """ Update position and colours for the coming frame from the frame number """
+        
+        # hold still during the lag between cycles
+        if self.lag_frames_remaining > 0:
+            self.lag_frames_remaining -= 1
+        else:
             self.advance()
             
-            # when flip timer ends, reverse colours and reset timer
-            if flip_timer.getTime() <= 0: 
-                
-                self.flip_stim()
-                flip_timer.reset()
+        # reverse colours every flip period
+        if self.frame > 0 and self.frame % self.config.frames_per_flip == 0:
+            self.flip_stim()
             
-            # end if return is pressed  
-            if key == "return":
-
-                self.window.close()
-                sys.exit()
+        self.draw_warped()
         
     def flip_stim(self):
         """ Reverse the colours of checks or bars """
 
-        if self.flipped is True:
-            colors = self.initial_colors
-            colors.reverse()
-        else:
-            colors = self.initial_colors
+        self.flipped = not self.flipped
+        
+        if self.texture is not None:
+            self.texture.phase = (0.5 if self.flipped else 0, 0)
 
         for i in range(len(self.checks_left)):
             
-            self.checks_left[i].color = colors[1]
-            self.checks_right[i].color = colors[0]
-            if self.stimulus_type.name == "CHECK": colors.reverse()
-            
-        self.flipped = not self.flipped
-        self.window.flip()
+            index = self.get_color_index(i)
+            self.checks_left[i].color = self.config.initial_colors[index]
+            self.checks_right[i].color = self.config.initial_colors[1-index]
          
     def advance(self):
         """ Advance the moving checks or bars """
         
-        if self.behavior.name == "BOUNCE":
+        if self.config.behavior.name == "BOUNCE":
             
             self.check_reflect()
             
-        elif self.behavior.name == "LOOP":
+        elif self.config.behavior.name == "LOOP":
             
             self.check_repeat()
             
         self.centre += self.phase_advance
         self.update_pos(self.phase_advance)
-        self.window.flip()
                 
     def check_reflect(self):
         
-        if (self.centre < -self.check_width-1) or (self.centre > 1+self.check_width):
+        if (self.centre < -self.config.check_width-1) or (self.centre > 1+self.config.check_width):
                 
             self.phase_advance = -self.phase_advance
             self.new_cycle()
                 
     def check_repeat(self):
         
-        if (self.centre < -self.check_width-1):
+        if (self.centre < -self.config.check_width-1):
             
-            self.centre = self.centre + self.loop_change
-            self.update_pos(self.loop_change)
+            self.centre = self.centre + self.config.loop_change
+            self.update_pos(self.config.loop_change)
             self.new_cycle()
             
-        elif (self.centre > 1+self.check_width):
+        elif (self.centre > 1+self.config.check_width):
             
-            self.centre = self.centre - self.loop_change
-            self.update_pos(-self.loop_change)
+            self.centre = self.centre - self.config.loop_change
+            self.update_pos(-self.config.loop_change)
             self.new_cycle()
             
     def update_pos(self, increment):
         
+        if self.texture is not None:
+            self.texture.pos = (self.centre, 0)
+        
         for i in range(len(self.checks_left)):
             self.checks_left[i].pos += (increment, 0)
             self.checks_right[i].pos += (increment, 0)
             
     def new_cycle(self):
         
-        core.wait(self.lag)
+        # hold still for the lag, collecting garbage while nothing is moving
+        if self.config.lag_frames > 0:
+            self.allocation.collect()
+            self.lag_frames_remaining = self.config.lag_frames
+            
         self.cycles_complete += 1
     
     def print_settings(self):
@@ -226,10 +383,10 @@ class KalatskyStim():
         table.add_column("units", style="yellow")
         table.add_column("value", justify="right", style="magenta")
         
-        table.add_row("viewing angle", "degrees", "{:.1f}".format(self.viewing_angle))
-        table.add_row("stimulus width", "degrees", "{:.1f}".format(self.stim_width))
-        table.add_row("cycle period", "seconds", "{:.2f}".format(self.cycle_period))
-        table.add_row("number of cycles", "--", "{:d}".format(self.cycles))
+        table.add_row("viewing angle", "degrees", "{:.1f}".format(self.monitor_config.viewing_angle))
+        table.add_row("stimulus width", "degrees", "{:.1f}".format(self.config.stim_width))
+        table.add_row("cycle period", "seconds", "{:.2f}".format(self.config.cycle_period))
+        table.add_row("number of cycles", "--", "{:d}".format(self.config.cycles))
         
         console = Console()
         console.print(table)
\ No newline at end of file
@@ -1,51 +1,41 @@
-from psychopy import event, core, visual
 import time
-import sys
 from rich.table import Table
 from rich.console import Console
 
 from ez_stims.utils.util_funcs import *
-from ez_stims.utils.enums import EdgeBehavior
+from ez_stims.utils.allocation import AllocationPolicy
+from ez_stims.utils.frame_timing import FrameTimer
+from ez_stims.utils.idle import IdleScheduler
+from ez_stims.visual.movie_cache import present_cached, prepare_cached
 
 class SingleDotStim():
 
-    def __init__(self, config, monitor_config):
+    def __init__(self, config, monitor_config, log=None):
         
-        # assign config as attributes
-        for name, value in monitor_config.items():
-            setattr(self, name, value)
-            
-        for name, value in config.items():
-            setattr(self, name, value)
+        # validated configs, settings and derived values are read from these and never modified
+        self.config = config
+        self.monitor_config = monitor_config
 
-        # initialise variables and left and right check arrays
+        # initialise variables
         self.cycles_complete = 0
-
-        # calculate viewing angle and resolution ratio
-        self.viewing_angle = get_viewing_angle(self.screen_width, self.viewing_distance)
-        self.resolution_ratio = self.resolution[1]/self.resolution[0]
-        
-        self.behavior = EdgeBehavior[self.behavior]
-
-        # force direction if at an end location
-        if self.start_x == 1:
-            self.direction = -1
-        elif self.start_x == -1:
-            self.direction = 1
-            
-        self.dot_width = self.dot_radius
-        self.dot_height = self.dot_width/self.resolution_ratio
-        
-        # calculate time varaibles
-        self.cycle_period = self.viewing_angle/self.velocity
-        self.phase_advance = self.resolution_ratio * (2/(self.cycle_period*self.frame_rate)) * self.direction
-        self.loop_change = (2*self.dot_radius) + 2
-
-        # find true starting position (weighted to ensure 1/-1 is offscreen)
-        self.start_x = self.start_x * (1+self.dot_radius)/1
+        self.dot = None
+        self.background_rect = None
+        self.prepared = False
+        self.stopped = False
+        self.allocation = AllocationPolicy()
+        self.frame_timer = FrameTimer(monitor_config.frame_rate)
+        self.idle = IdleScheduler(self.get_keypress)
+        self.log = log
+        
+        # reversed on each bounce
+        self.phase_advance = config.phase_advance
+        
+        # frame schedule, all timing is counted in frames
+        self.lag_frames_remaining = 0
+        self.frame = 0
         
         # setup x coordinate variables
-        self.dot_x = self.start_x
+        self.dot_x = config.start_dot_x
             
     # methods
     def add_window(self, window):
@@ -56,6 +46,8 @@ class SingleDotStim():
     def start_timer(self):
         """ Start timer for runtime of stimulus presentation """
 
+        from psychopy import core
+
         self.timer = core.Clock()
 
     def get_timestamp(self):
@@ -69,6 +61,8 @@ class SingleDotStim():
     def get_keypress(self):
         """ Listen for key press """
 
+        from psychopy import event
+
         keys = event.getKeys()
         if keys:
             return keys[0]
@@ -78,93 +72,149 @@ class SingleDotStim():
     def wait(self):
         """ Wait for keypress before kalatsky presentation """
 
-        waiting = True
-
-        while waiting:
-            
-            key = self.get_keypress()
-            if key == "space":
-                waiting = False
+        self.idle.wait_for_key("space")
 
+    def prepare(self):
+        """ Create the background and dot (or the cached movie) up front, nothing is drawn until presented """
+        
+        if self.prepared:
+            return
+        
+        # psychopy is only imported once draw objects are created, so stimuli can be rendered headless without it
+        from psychopy import visual
+        
+        self.background_rect = visual.Rect(self.window, 
+                                           size=3, 
+                                           fillColor=self.config.background_color, 
+                                           colorSpace='rgb',
+                                           autoDraw=False)
+        
+        if self.config.cached:
+            prepare_cached(self)
+        else:
+            self.dot = visual.Circle(self.window, 
+                                    size=(self.config.dot_width, self.config.dot_height), 
+                                    units="norm",
+                                    fillColor=self.config.dot_color,
+                                    pos=(self.config.start_dot_x, self.config.path_y),
+                                    autoDraw=False)
+            
+        self.prepared = True
+    
     def background(self):
         """ Display background colour to the screen """
         
-        self.background = visual.Rect(self.window, 
-                                      size=3, 
-                                      fillColor=self.background_color, 
-                                      colorSpace='rgb',
-                                      autoDraw=True)
+        self.prepare()
+        self.background_rect.autoDraw = True
         
         self.window.flip()
     
     def present(self):
         """ Prsent Kalatsky stimulus """
         
-        self.dot = visual.Circle(self.window, 
-                                size=(self.dot_width, self.dot_height), 
-                                units="norm",
-                                fillColor=self.dot_color,
-                                pos=(self.start_x, self.path_y),
-                                autoDraw=True)
+        self.prepare()
+        
+        if self.config.cached:
+            
+            present_cached(self)
+            return
+        
+        self.dot.autoDraw = True
         
         self.window.flip()
         
-        # play kalatsky stimulus
-        while self.cycles_complete < self.cycles:
+        start_time = self.get_timestamp()
+        self.frame_timer.start(self.config.cycles*(self.config.cycle_period+self.config.lag))
+        
+        # play stimulus with the collector held off
+        self.allocation.attach()
+        
+        with self.allocation.epoch("single_dot"):
             
-            key = self.get_keypress()
+            while self.cycles_complete < self.config.cycles:
             
+                key = self.get_keypress()
+                
+                # apply this frame's state changes, then flip exactly once
+                self.next_frame()
+                self.frame_timer.flip(self.window)
+                self.frame += 1
+            
+                # stop if return is pressed, handing control back to the caller
+                if key == "return":
+                    
+                    self.stopped = True
+                    break
+
+        self.allocation.detach()
+        self.allocation.print_report()
+        
+        if self.log is not None and not self.stopped:
+            self.log.add_stim("single_dot", 1, start_time, self.get_timestamp(), self.frame_timer.summary())
+    
+    def clear(self):
+        """ Stop drawing the stimulus so the window can be used by the next one """
+        
+        for component in [self.background_rect, self.dot]:
+            if component is not None:
+                component.autoDraw = False
+    
+    def next_frame(self):
+        """ Update position for the coming frame from the frame number """
+        
+        # hold still during the lag between cycles
+        if self.lag_frames_remaining > 0:
+            self.lag_frames_remaining -= 1
+        else:
             self.advance()
-            
-            # end if return is pressed  
-            if key == "return":
-
-                self.window.close()
-                sys.exit()
          
     def advance(self):
         """ Advance the moving checks or bars """
         
-        if self.behavior.name == "BOUNCE":
+        if self.config.behavior.name == "BOUNCE":
             
             self.check_reflect()
             
-        elif self.behavior.name == "LOOP":
+        elif self.config.behavior.name == "LOOP":
             
             self.check_repeat()
             
         self.dot_x += self.phase_advance
         self.update_pos(self.phase_advance)
-        self.window.flip()
                 
     def check_reflect(self):
         
-        if (self.dot_x < -self.dot_radius-1) or (self.dot_x > 1+self.dot_radius):
+        if (self.dot_x < -self.config.dot_radius-1) or (self.dot_x > 1+self.config.dot_radius):
                 
             self.phase_advance = -self.phase_advance
             self.new_cycle()
                 
     def check_repeat(self):
         
-        if (self.dot_x < -self.dot_radius-1):
+        if (self.dot_x < -self.config.dot_radius-1):
             
-            self.dot_x = self.dot_x + self.loop_change
-            self.update_pos(self.loop_change)
+            self.dot_x = self.dot_x + self.config.loop_change
+            self.update_pos(self.config.loop_change)
             self.new_cycle()
             
-        elif (self.dot_x > 1+self.dot_radius):
+        elif (self.dot_x > 1+self.config.dot_radius):
             
-            self.dot_x = self.dot_x - self.loop_change
-            self.update_pos(-self.loop_change)
+            self.dot_x = self.dot_x - self.config.loop_change
+            self.update_pos(-self.config.loop_change)
             self.new_cycle()
             
     def update_pos(self, increment):
 
-        self.dot.pos += (increment, 0)
+        if self.dot is not None:
+            self.dot.pos += (increment, 0)
             
     def new_cycle(self):
         
-        core.wait(self.lag)
+        # hold still for the lag, collecting garbage while nothing is moving
+        if self.config.lag_frames > 0:
+            self.allocation.collect()
+            self.lag_frames_remaining = self.config.lag_frames
+            
         self.cycles_complete += 1
     
     def print_settings(self):
@@ -175,9 +225,9 @@ class SingleDotStim():
         table.add_column("units", style="yellow")
         table.add_column("value", justify="right", style="magenta")
         
-        table.add_row("viewing angle", "degrees", "{:.1f}".format(self.viewing_angle))
-        table.add_row("cycle period", "seconds", "{:.2f}".format(self.cycle_period))
-        table.add_row("number of cycles", "--", "{:d}".format(self.cycles))
+        table.add_row("viewing angle", "degrees", "{:.1f}".format(self.monitor_config.viewing_angle))
+        table.add_row("cycle period", "seconds", "{:.2f}".format(self.config.cycle_period))
+        table.add_row("number of cycles", "--", "{:d}".format(self.config.cycles))
         
         console = Console()
         console.print(table)
\ No newline at end of file
@@ -0,0 +1,153 @@
+"""
+Garbage collection policy for stimulus presentation.
+
+The collector is frozen and disabled while a stimulus epoch is being drawn, and only
+run explicitly during baselines and inter-cycle lags. Every collection that still
+lands inside an epoch is counted and timed so it can be reported afterwards, and
+collections between epochs (baselines, intro, outro) are counted under "idle".
+The collector callback is only registered while a presentation runs, from attach
+until detach, so policies used outside a presentation (e.g. headless rendering or
+movie caching) leave the collector's callbacks untouched.
+
+Classes:
+- AllocationPolicy: Manages the garbage collector around stimulus epochs and reports pauses.
+"""
+import gc
+import time
+from contextlib import contextmanager
+from rich.table import Table
+from rich.console import Console
+
+class AllocationPolicy():
+
+    def __init__(self):
+
+        self.epochs = []
+        self.current = None
+        self.idle = self.new_epoch("idle")
+        self.scheduled = False
+        self.gc_start = None
+        self.gc_was_enabled = gc.isenabled()
+        self.attached = False
+
+    def new_epoch(self, name):
+
+        return {"name": name,
+                "collections": 0,
+                "pause": 0.0,
+                "scheduled_collections": 0,
+                "scheduled_pause": 0.0}
+
+    def attach(self):
+        """ Start timing collections, call when a presentation starts """
+
+        if not self.attached:
+
+            gc.callbacks.append(self.on_gc)
+            self.attached = True
+
+    def detach(self):
+        """ Stop timing collections and close any open epoch, call when a presentation ends """
+
+        self.end_epoch()
+
+        if self.on_gc in gc.callbacks:
+            gc.callbacks.remove(self.on_gc)
+
+        self.attached = False
+
+    def on_gc(self, phase, info):
+        """ Collector callback, times every unscheduled collection, between epochs under idle """
+
+        if phase == "start":
+
+            self.gc_start = time.perf_counter()
+
+        elif phase == "stop" and self.gc_start is not None:
+
+            pause = time.perf_counter() - self.gc_start
+            self.gc_start = None
+
+            if not self.scheduled:
+
+                epoch = self.current if self.current is not None else self.idle
+                epoch["collections"] += 1
+                epoch["pause"] += pause
+
+    def start_epoch(self, name):
+        """ Freeze existing objects and disable the collector for time-critical drawing """
+
+        self.current = self.new_epoch(name)
+
+        self.gc_was_enabled = gc.isenabled()
+
+        # move everything allocated so far out of the collector's reach
+        gc.freeze()
+        gc.disable()
+
+    def end_epoch(self):
+        """ Restore the collector and store the epoch report """
+
+        if self.current is None:
+            return
+
+        gc.unfreeze()
+
+        if self.gc_was_enabled:
+            gc.enable()
+
+        self.epochs.append(self.current)
+        self.current = None
+
+    @contextmanager
+    def epoch(self, name):
+        """ Context manager wrapping a stimulus epoch, restores the collector on any exit """
+
+        self.start_epoch(name)
+
+        try:
+            yield self
+        finally:
+            self.end_epoch()
+
+    def collect(self):
+        """ Run a collection, only call during baselines or lags when nothing is moving """
+
+        self.scheduled = True
+        start = time.perf_counter()
+
+        gc.collect()
+
+        pause = time.perf_counter() - start
+        self.scheduled = False
+
+        epoch = self.current if self.current is not None else self.idle
+        epoch["scheduled_collections"] += 1
+        epoch["scheduled_pause"] += pause
+
+        return pause
+
+    def get_report(self):
+
+        return self.epochs + [self.idle]
+
+    def print_report(self):
+
+        table = Table(title="Garbage Collection")
+
+        table.add_column("epoch", style="cyan")
+        table.add_column("collections", justify="right", style="magenta")
+        table.add_column("pause (ms)", justify="right", style="magenta")
+        table.add_column("scheduled", justify="right", style="yellow")
+        table.add_column("scheduled pause (ms)", justify="right", style="yellow")
+
+        for epoch in self.get_report():
+
+            table.add_row(str(epoch["name"]),
+                          "{:d}".format(epoch["collections"]),
+                          "{:.2f}".format(epoch["pause"]*1000),
+                          "{:d}".format(epoch["scheduled_collections"]),
+                          "{:.2f}".format(epoch["scheduled_pause"]*1000))
+
+        console = Console()
+        console.print(table)
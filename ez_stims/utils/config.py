@@ -0,0 +1,418 @@
+"""
+Typed, validated configs built once from the YAML files.
+
+Each config checks its keys, types and ranges when it is built, so a typo or
+bad value fails at load with the file and key named instead of mid-session,
+and precomputes every quantity derived from it (and from the monitor) that
+the stimuli used to work out in their constructors. Configs use __slots__ and
+are read-only once built: lists are stored as tuples, arrays are made
+read-only and assigning an attribute raises AttributeError, so stimuli copy
+anything they change.
+
+Classes:
+- ConfigError: Raised for a missing, unknown or invalid setting.
+- Config: Base class, validates the settings listed in FIELDS and stores them as attributes.
+- MonitorConfig: Monitor geometry and timing, from monitor.yaml.
+- KalatskyConfig: Kalatsky bar or checkerboard, from kalatsky.yaml.
+- SingleDotConfig: Single moving dot, from single_dot.yaml.
+- DotsConfig: Field of moving dots, from dots.yaml.
+- ParadigmConfig: One grating in the paradigm of grating.yaml.
+- GratingConfig: Grating global settings and paradigm, from grating.yaml.
+"""
+import copy
+import math
+import difflib
+import numpy as np
+from enum import Enum
+
+from ez_stims.utils.enums import StimType, EdgeBehavior, KalatskyEngine, DotEngine, GratBehavior
+from ez_stims.utils.util_funcs import get_viewing_angle
+from ez_stims.visual.geometry import tangent_linspace
+
+class ConfigError(ValueError):
+    pass
+
+# checks, each returns an error message or None
+def positive(value):
+
+    return None if value > 0 else "must be greater than 0"
+
+def non_negative(value):
+
+    return None if value >= 0 else "must be 0 or greater"
+
+def between(low, high):
+
+    def check(value):
+        return None if low <= value <= high else f"must be between {low} and {high}"
+
+    return check
+
+def one_of(*choices):
+
+    def check(value):
+        return None if value in choices else f"must be one of {', '.join(str(choice) for choice in choices)}"
+
+    return check
+
+def is_color(value):
+    """ A psychopy colour name or an rgb triplet in the range -1 to 1 """
+
+    if isinstance(value, str):
+        return None
+
+    if isinstance(value, list) and len(value) == 3 and all(isinstance(v, (int, float)) and not isinstance(v, bool) and -1 <= v <= 1 for v in value):
+        return None
+
+    return "must be a colour name or a list of three rgb values between -1 and 1"
+
+def is_size(value):
+    """ A (width, height) pair of positive integers """
+
+    if isinstance(value, list) and len(value) == 2 and all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in value):
+        return None
+
+    return "must be a list of two positive integers"
+
+def read_only(value):
+    """ Lists as tuples and arrays made read-only, recursively """
+
+    if isinstance(value, (list, tuple)):
+        return tuple(read_only(v) for v in value)
+
+    if isinstance(value, np.ndarray):
+        value.flags.writeable = False
+
+    return value
+
+NUMBER = (int, float)
+COLOR = (str, list)
+
+class Config():
+    """
+    Base of the typed configs.
+
+    FIELDS maps each YAML key to (types, check), enum types are looked up by name.
+    Keys are stored as attributes with any "-" replaced by "_".
+
+    Parameters:
+    - raw (dict): Settings as loaded from YAML, a copy is kept in self.raw.
+    - monitor (MonitorConfig): Monitor the derived values are computed for, None for the monitor itself.
+    - source (str): Name of the config in error messages, usually its file name.
+    """
+    __slots__ = ("raw", "source", "frozen")
+
+    FIELDS = {}
+
+    def __init__(self, raw, monitor=None, source="config"):
+
+        self.source = source
+
+        if not isinstance(raw, dict):
+            raise ConfigError(f"{source}: expected a mapping of settings, got {type(raw).__name__}")
+
+        self.raw = copy.deepcopy(raw)
+
+        self.validate(raw)
+        self.compile(monitor)
+        self.freeze()
+
+    def freeze(self):
+        """ Make every setting and derived value read-only, later assignments raise AttributeError """
+
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if name not in ("raw", "source", "frozen") and hasattr(self, name):
+                    setattr(self, name, read_only(getattr(self, name)))
+
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+
+        if getattr(self, "frozen", False):
+            raise AttributeError(f"{self!r} is read-only, copy {name} to change it")
+
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+
+        if getattr(self, "frozen", False):
+            raise AttributeError(f"{self!r} is read-only, {name} can't be deleted")
+
+        object.__delattr__(self, name)
+
+    def error(self, message, key=None):
+
+        return ConfigError(f"{self.source}: {message}" if key is None else f"{self.source}: {key} {message}")
+
+    def validate(self, raw):
+        """ Check every key and value, storing the values as attributes """
+
+        for key in raw:
+            if key not in self.FIELDS:
+
+                suggestion = difflib.get_close_matches(key, self.FIELDS, n=1)
+                hint = f", did you mean {suggestion[0]}?" if suggestion else ""
+
+                raise self.error(f"is not a known setting{hint}", key)
+
+        for key, (kind, check) in self.FIELDS.items():
+
+            if key not in raw:
+                raise self.error("is missing", key)
+
+            value = self.parse(key, raw[key], kind)
+
+            if check is not None:
+
+                message = check(value)
+
+                if message is not None:
+                    raise self.error(f"{message}, got {raw[key]!r}", key)
+
+            setattr(self, key.replace("-", "_"), value)
+
+    def parse(self, key, value, kind):
+
+        if isinstance(kind, type) and issubclass(kind, Enum):
+
+            if value not in kind.__members__:
+                raise self.error(f"must be one of {', '.join(kind.__members__)}, got {value!r}", key)
+
+            return kind[value]
+
+        kinds = kind if isinstance(kind, tuple) else (kind,)
+
+        # bools are ints in python, only accept them where a bool is expected
+        if isinstance(value, bool) and bool not in kinds:
+            raise self.error(f"must be {' or '.join(k.__name__ for k in kinds)}, got {value!r}", key)
+
+        if not isinstance(value, kinds):
+            raise self.error(f"must be {' or '.join(k.__name__ for k in kinds)}, got {value!r}", key)
+
+        return value
+
+    def compile(self, monitor):
+        """ Precompute the values derived from the settings """
+
+        pass
+
+    def __repr__(self):
+
+        return f"{type(self).__name__}({self.source})"
+
+class MonitorConfig(Config):
+
+    __slots__ = ("resolution", "frame_rate", "screen_width", "viewing_distance", "screen_number", "ratio_stimulus_screen",
+                 "viewing_angle", "resolution_ratio", "screen_diagonal", "stim_size")
+
+    FIELDS = {"resolution": (list, is_size),
+              "frame_rate": (NUMBER, positive),
+              "screen_width": (NUMBER, positive),
+              "viewing_distance": (NUMBER, positive),
+              "screen_number": (int, non_negative),
+              "ratio_stimulus-screen": (NUMBER, positive)}
+
+    def compile(self, monitor):
+
+        self.resolution = tuple(self.resolution)
+        self.viewing_angle = get_viewing_angle(self.screen_width, self.viewing_distance)
+        self.resolution_ratio = self.resolution[1]/self.resolution[0]
+        self.screen_diagonal = math.hypot(self.resolution[0], self.resolution[1])
+        self.stim_size = (self.resolution[0]/self.ratio_stimulus_screen, self.resolution[1]/self.ratio_stimulus_screen)
+
+class KalatskyConfig(Config):
+
+    __slots__ = ("behavior", "stimulus_type", "lag", "cached", "engine", "background_color", "initial_colors", "velocity",
+                 "cycles", "flip_frequency", "number_of_checks", "starting_position", "direction",
+                 "cycle_period", "phase_advance", "flip_period", "frames_per_flip", "lag_frames",
+                 "check_height", "check_width", "stim_width", "check_size", "loop_change", "start_centre")
+
+    FIELDS = {"behavior": (EdgeBehavior, None),
+              "stimulus_type": (StimType, None),
+              "lag": (NUMBER, non_negative),
+              "cached": (bool, None),
+              "engine": (KalatskyEngine, None),
+              "background_color": (COLOR, is_color),
+              "initial_colors": (list, lambda colors: None if len(colors) == 2 and all(is_color(c) is None for c in colors) else "must be a list of two colours"),
+              "velocity": (NUMBER, positive),
+              "cycles": (int, positive),
+              "flip_frequency": (NUMBER, positive),
+              "number_of_checks": (int, positive),
+              "starting_position": (NUMBER, between(-1, 1)),
+              "direction": (int, one_of(-1, 1))}
+
+    def compile(self, monitor):
+
+        # force direction if at an end location
+        if self.starting_position == 1:
+            self.direction = -1
+        elif self.starting_position == -1:
+            self.direction = 1
+
+        # time variables, all timing is counted in frames
+        self.cycle_period = monitor.viewing_angle/self.velocity
+        self.phase_advance = monitor.resolution_ratio * (2/(self.cycle_period*monitor.frame_rate)) * self.direction
+        self.flip_period = 1/self.flip_frequency
+        self.frames_per_flip = max(int(round(self.flip_period*monitor.frame_rate)), 1)
+        self.lag_frames = int(round(self.lag*monitor.frame_rate))
+
+        # size variables
+        self.check_height = 2/self.number_of_checks
+        self.check_width = self.check_height * monitor.resolution_ratio
+        self.stim_width = self.check_width*monitor.viewing_angle
+        self.check_size = self.stim_width/2
+        self.loop_change = (2*self.check_width) + 2
+
+        # true starting position (weighted to ensure 1/-1 is offscreen)
+        self.start_centre = self.starting_position * (1+self.check_width)
+
+class SingleDotConfig(Config):
+
+    __slots__ = ("behavior", "lag", "cached", "background_color", "dot_color", "dot_radius", "path_y", "velocity",
+                 "cycles", "start_x", "direction",
+                 "dot_width", "dot_height", "cycle_period", "phase_advance", "loop_change", "lag_frames", "start_dot_x")
+
+    FIELDS = {"behavior": (EdgeBehavior, None),
+              "lag": (NUMBER, non_negative),
+              "cached": (bool, None),
+              "background_color": (COLOR, is_color),
+              "dot_color": (COLOR, is_color),
+              "dot_radius": (NUMBER, positive),
+              "path_y": (NUMBER, between(-1, 1)),
+              "velocity": (NUMBER, positive),
+              "cycles": (int, positive),
+              "start_x": (NUMBER, between(-1, 1)),
+              "direction": (int, one_of(-1, 1))}
+
+    def compile(self, monitor):
+
+        # force direction if at an end location
+        if self.start_x == 1:
+            self.direction = -1
+        elif self.start_x == -1:
+            self.direction = 1
+
+        self.dot_width = self.dot_radius
+        self.dot_height = self.dot_width/monitor.resolution_ratio
+
+        # time variables, all timing is counted in frames
+        self.cycle_period = monitor.viewing_angle/self.velocity
+        self.phase_advance = monitor.resolution_ratio * (2/(self.cycle_period*monitor.frame_rate)) * self.direction
+        self.loop_change = (2*self.dot_radius) + 2
+        self.lag_frames = int(round(self.lag*monitor.frame_rate))
+
+        # true starting position (weighted to ensure 1/-1 is offscreen)
+        self.start_dot_x = self.start_x * (1+self.dot_radius)
+
+class DotsConfig(Config):
+
+    __slots__ = ("background_color", "color", "dot_velocity", "dot_radius_pix", "spawn_frequency", "angle", "num_spawn_loc", "engine",
+                 "phase_advance", "spawn_period", "max_dots", "angle_rad", "x_increment", "y_increment",
+                 "screen_circle_radius", "spawn_exclusion_width", "spawn_exclusion", "spawn_candidates", "spawn_linspace")
+
+    FIELDS = {"background_color": (COLOR, is_color),
+              "color": (COLOR, is_color),
+              "dot_velocity": (NUMBER, positive),
+              "dot_radius_pix": (NUMBER, positive),
+              "spawn_frequency": (NUMBER, positive),
+              "angle": (NUMBER, None),
+              "num_spawn_loc": (int, positive),
+              "engine": (DotEngine, None)}
+
+    def compile(self, monitor):
+
+        # time variables
+        self.phase_advance = -(monitor.resolution_ratio * self.dot_velocity * 100)/monitor.frame_rate
+        self.spawn_period = 1/self.spawn_frequency
+
+        self.max_dots = 50*(self.spawn_frequency/self.dot_velocity)
+
+        self.angle_rad = math.radians(self.angle)
+        self.x_increment = np.cos(self.angle_rad) * self.phase_advance
+        self.y_increment = np.sin(self.angle_rad) * self.phase_advance
+
+        self.screen_circle_radius = monitor.screen_diagonal*0.55
+        self.spawn_exclusion_width = int(round(self.num_spawn_loc*self.dot_radius_pix/monitor.screen_diagonal))
+
+        # which spawn locations are blocked after spawning at each location
+        spawn_index = np.arange(self.num_spawn_loc)
+        self.spawn_exclusion = np.abs(spawn_index[:, None] - spawn_index[None, :]) <= self.spawn_exclusion_width
+        self.spawn_candidates = [np.flatnonzero(~excluded) if not excluded.all() else spawn_index
+                                 for excluded in self.spawn_exclusion]
+
+        genx, geny = tangent_linspace(theta=self.angle_rad,
+                                      radius=self.screen_circle_radius,
+                                      length=monitor.screen_diagonal,
+                                      N=self.num_spawn_loc)
+
+        self.spawn_linspace = list(zip(genx, geny))
+
+class ParadigmConfig(Config):
+
+    __slots__ = ("name", "behavior", "duration", "spatial_frequency", "orientation", "contrast", "velocity",
+                 "period", "temporal_frequency", "phase_advance", "frames_per_flicker")
+
+    FIELDS = {"name": (str, None),
+              "behavior": (GratBehavior, None),
+              "duration": (NUMBER, positive),
+              "spatial_frequency": (NUMBER, positive),
+              "orientation": (NUMBER, between(0, 360)),
+              "contrast": (NUMBER, between(0, 1)),
+              "velocity": (NUMBER, positive)}
+
+    def compile(self, monitor):
+
+        self.period = 1 / self.velocity
+        self.temporal_frequency = self.velocity * self.spatial_frequency
+        self.phase_advance = self.temporal_frequency / monitor.frame_rate
+        self.frames_per_flicker = max(int(round(self.period * monitor.frame_rate)), 1)
+
+class GratingConfig(Config):
+    """ Global settings are stored as attributes, the paradigm as a list of ParadigmConfig """
+
+    __slots__ = ("iterations", "randomise", "cached", "compiled_timeline", "intro_active", "intro_duration",
+                 "outro_active", "outro_duration", "baseline_duration", "baseline_color", "paradigm")
+
+    FIELDS = {"iterations": (int, positive),
+              "randomise": (bool, None),
+              "cached": (bool, None),
+              "compiled_timeline": (bool, None),
+              "intro_active": (bool, None),
+              "intro_duration": (NUMBER, non_negative),
+              "outro_active": (bool, None),
+              "outro_duration": (NUMBER, non_negative),
+              "baseline_duration": (NUMBER, non_negative),
+              "baseline_color": (COLOR, is_color)}
+
+    def validate(self, raw):
+
+        for key in raw:
+            if key not in ("global", "paradigm"):
+                raise self.error("is not a known section, expected global and paradigm", key)
+
+        if not isinstance(raw.get("global"), dict):
+            raise self.error("must be a mapping of settings", "global")
+
+        if not isinstance(raw.get("paradigm"), list) or not raw["paradigm"]:
+            raise self.error("must be a list of at least one stimulus", "paradigm")
+
+        super().validate(raw["global"])
+
+    def compile(self, monitor):
+
+        source = self.source
+        self.paradigm = tuple(ParadigmConfig(entry, monitor, f"{source} paradigm {i+1}") for i, entry in enumerate(self.raw["paradigm"]))
+
+        # names identify stimuli in the log, so they must be unique
+        names = [stimulus.name for stimulus in self.paradigm]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+
+        if duplicates:
+            raise self.error(f"has duplicate names: {', '.join(duplicates)}", "paradigm")
+
+CONFIGS = {"monitor": MonitorConfig,
+           "kalatsky": KalatskyConfig,
+           "single_dot": SingleDotConfig,
+           "dots": DotsConfig,
+           "grating": GratingConfig}
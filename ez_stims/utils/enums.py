@@ -4,6 +4,8 @@ Enums:
 - EdgeBehavior: An enumeration of kalatsky stimulus behavior modes, BOUNCE or LOOP.
 - GratBehavior: An enumeration of grating stimulus behavior modes, DRIFT or FLICKER.
 - StimType: An enumeration of stimulus types, CHECK or BAR.
+- DotEngine: An enumeration of dots stimulus rendering engines, CIRCLES or ELEMENTS.
+- KalatskyEngine: An enumeration of kalatsky stimulus rendering engines, RECTS, TEXTURE or SPHERICAL.
 """
 from enum import Enum
 
@@ -17,4 +19,13 @@ class GratBehavior(Enum):
 
 class StimType(Enum):
     CHECK = 1
-    BAR = 2
\ No newline at end of file
+    BAR = 2
+
+class DotEngine(Enum):
+    CIRCLES = 1
+    ELEMENTS = 2
+
+class KalatskyEngine(Enum):
+    RECTS = 1
+    TEXTURE = 2
+    SPHERICAL = 3
\ No newline at end of file
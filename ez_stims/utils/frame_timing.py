@@ -0,0 +1,83 @@
+"""
+Frame timing instrumentation for stimulus presentation.
+
+Classes:
+- FrameTimer: Records the timestamp of every window flip and summarises intervals and dropped frames.
+"""
+import time
+import numpy as np
+
+class FrameTimer():
+    """
+    Record flip timestamps into a preallocated buffer.
+
+    Parameters:
+    - frame_rate (float): Refresh rate of the monitor in Hz.
+    - capacity (int): Number of flips the buffer holds before it has to grow.
+    - tolerance (float): Fraction of a frame period an interval may overrun before the frame counts as dropped.
+    """
+    def __init__(self, frame_rate, capacity=3600, tolerance=0.5):
+
+        self.frame_period = 1/frame_rate
+        self.drop_threshold = self.frame_period * (1+tolerance)
+
+        self.timestamps = np.zeros(max(int(capacity), 2))
+        self.num_frames = 0
+
+    def start(self, duration=None):
+        """ Reset the buffer, growing it up front if the epoch duration (seconds) is known """
+
+        if duration is not None:
+
+            expected_frames = int(np.ceil(duration/self.frame_period)) + 2
+
+            if expected_frames > len(self.timestamps):
+                self.timestamps = np.zeros(expected_frames)
+
+        self.num_frames = 0
+
+    def flip(self, window):
+        """ Flip the window and record when the flip landed """
+
+        flip_time = window.flip()
+
+        # flip only returns a time when waiting for blanking
+        if flip_time is None:
+            flip_time = time.perf_counter()
+
+        self.record(flip_time)
+
+        return flip_time
+
+    def record(self, flip_time):
+
+        if self.num_frames == len(self.timestamps):
+            self.timestamps = np.concatenate((self.timestamps, np.zeros(len(self.timestamps))))
+
+        self.timestamps[self.num_frames] = flip_time
+        self.num_frames += 1
+
+    def get_intervals(self):
+
+        return np.diff(self.timestamps[:self.num_frames])
+
+    def summary(self):
+        """
+        Summarise the recorded flips.
+
+        Returns:
+        - summary (dict): frames, mean_interval (ms), p99_interval (ms) and dropped_frames.
+        """
+        intervals = self.get_intervals()
+
+        if intervals.size == 0:
+
+            return {"frames": self.num_frames,
+                    "mean_interval": float("nan"),
+                    "p99_interval": float("nan"),
+                    "dropped_frames": 0}
+
+        return {"frames": self.num_frames,
+                "mean_interval": float(intervals.mean()*1000),
+                "p99_interval": float(np.percentile(intervals, 99)*1000),
+                "dropped_frames": int(np.count_nonzero(intervals > self.drop_threshold))}
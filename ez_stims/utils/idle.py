@@ -0,0 +1,125 @@
+"""
+Low-CPU waiting for intros, outros, baselines and key waits.
+
+Waits sleep coarsely and only spin for the last moment before the deadline,
+key presses are polled at a bounded rate. Every idle period records the CPU
+time it consumed and how far from its deadline it woke up.
+
+Classes:
+- IdleScheduler: Sleeps until deadlines or key presses and reports CPU use and wake-up accuracy.
+"""
+import time
+from rich.table import Table
+from rich.console import Console
+
+class IdleScheduler():
+    """
+    Parameters:
+    - get_keypress (callable): Returns the last key pressed or None, called at most every poll_interval.
+    - spin_margin (float): Seconds before a deadline at which sleeping stops and spinning starts.
+    - poll_interval (float): Seconds between key polls.
+    """
+    def __init__(self, get_keypress=None, spin_margin=0.001, poll_interval=0.01):
+
+        self.get_keypress = get_keypress
+        self.spin_margin = spin_margin
+        self.poll_interval = poll_interval
+        self.periods = []
+
+    def wait(self, duration, name="idle", stop_keys=(), start=None):
+        """
+        Idle until duration seconds after start, or until one of stop_keys is pressed.
+
+        Returns:
+        - key (str): The stop key pressed, or None if the deadline was reached.
+        """
+        start = time.perf_counter() if start is None else start
+        deadline = start + duration
+        cpu_start = time.process_time()
+
+        polling = bool(stop_keys) and self.get_keypress is not None
+        next_poll = time.perf_counter()
+        key = None
+
+        while True:
+
+            now = time.perf_counter()
+
+            if now >= deadline:
+                break
+
+            if polling and now >= next_poll:
+
+                pressed = self.get_keypress()
+                next_poll = now + self.poll_interval
+
+                if pressed in stop_keys:
+                    key = pressed
+                    break
+
+            # sleep coarsely, waking for the next poll or the final spin
+            sleep_time = deadline - now - self.spin_margin
+
+            if polling:
+                sleep_time = min(sleep_time, next_poll - now)
+
+            if sleep_time > 0:
+                time.sleep(sleep_time)
+
+        self.record(name, start, deadline if key is None else None, cpu_start)
+
+        return key
+
+    def wait_for_key(self, key, name="wait"):
+        """ Idle until key is pressed, polling at the bounded rate """
+
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+
+        while self.get_keypress() != key:
+            time.sleep(self.poll_interval)
+
+        self.record(name, start, None, cpu_start)
+
+    def record(self, name, start, deadline, cpu_start):
+
+        end = time.perf_counter()
+
+        self.periods.append({"name": name,
+                             "duration": end - start,
+                             "cpu_time": time.process_time() - cpu_start,
+                             "wake_error": (end - deadline) if deadline is not None else None})
+
+    def get_report(self):
+
+        return self.periods
+
+    def print_report(self):
+
+        table = Table(title="Idle Periods")
+
+        table.add_column("period", style="cyan")
+        table.add_column("count", justify="right", style="magenta")
+        table.add_column("duration (s)", justify="right", style="magenta")
+        table.add_column("cpu (%)", justify="right", style="yellow")
+        table.add_column("mean wake error (ms)", justify="right", style="yellow")
+        table.add_column("max wake error (ms)", justify="right", style="yellow")
+
+        names = list(dict.fromkeys(period["name"] for period in self.periods))
+
+        for name in names:
+
+            periods = [period for period in self.periods if period["name"] == name]
+            duration = sum(period["duration"] for period in periods)
+            cpu_time = sum(period["cpu_time"] for period in periods)
+            wake_errors = [period["wake_error"]*1000 for period in periods if period["wake_error"] is not None]
+
+            table.add_row(name,
+                          "{:d}".format(len(periods)),
+                          "{:.2f}".format(duration),
+                          "{:.1f}".format(100*cpu_time/duration) if duration > 0 else "--",
+                          "{:.3f}".format(sum(wake_errors)/len(wake_errors)) if wake_errors else "--",
+                          "{:.3f}".format(max(wake_errors)) if wake_errors else "--")
+
+        console = Console()
+        console.print(table)
@@ -1,10 +1,25 @@
 import os
 import csv
+import json
+import time
+import queue
+import atexit
+import threading
 from datetime import datetime
 
 class Log():
-
-    def __init__(self):
+    """
+    Append-only stimulus log, written to disk as the session runs.
+    
+    Rows are handed to a writer thread, so add_stim never waits on the disk. Each row is written as one
+    complete line, readers can ignore an unterminated last line and read the log while it is written.
+    The log is closed when the interpreter exits, so an aborted session keeps every finished trial.
+    
+    Parameters:
+    - log_format (str): "csv" or "jsonl" (one json object per line).
+    - flush_interval (float): Seconds between flushes to disk, None to flush after every row.
+    """
+    def __init__(self, log_format="csv", flush_interval=None):
         
         self.log = []
         now = datetime.now()
@@ -14,25 +29,105 @@ class Log():
             
             os.mkdir("logs")
             
-        self.log_name = "logs/log_{}.csv".format(self.time_str)
+        self.log_format = log_format
+        self.flush_interval = flush_interval
+        self.log_name = "logs/log_{}.{}".format(self.time_str, log_format)
+        
+        self.log_file = open(self.log_name, 'w', newline='')
+        self.log_writer = csv.writer(self.log_file, delimiter=',')
+        
+        if self.log_format == "csv":
+            self.log_writer.writerow(self.get_header())
+            
+        self.sync()
+        
+        self.rows = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        
+        atexit.register(self.write_log)
     
-    def add_stim(self, name, iteration, start, end):
+    def get_header(self):
+        
+        return ['Stimulus', 'Iteration', 'Start time', 'End time',
+                'Frames', 'Mean interval (ms)', 'P99 interval (ms)', 'Dropped frames']
+    
+    def add_stim(self, name, iteration, start, end, timing=None):
         
         entry = [name, iteration, start, end]
         
+        # frame timing summary from FrameTimer, blank if not recorded
+        if timing is not None:
+            entry += [timing["frames"],
+                      "{:.3f}".format(timing["mean_interval"]),
+                      "{:.3f}".format(timing["p99_interval"]),
+                      timing["dropped_frames"]]
+        else:
+            entry += ["", "", "", ""]
+        
         self.log.append(entry)
         
+        if self.thread.is_alive():
+            self.rows.put(entry)
+        
     def print_log(self):
         
         print(self.log)
     
         
+    def write_row(self, entry):
+        
+        if self.log_format == "jsonl":
+            self.log_file.write(json.dumps(dict(zip(self.get_header(), entry))) + "\n")
+        else:
+            self.log_writer.writerow(entry)
+            
+    def sync(self):
+        
+        # flushed to the os and then to disk, so the rows survive a crash of the process or the machine
+        self.log_file.flush()
+        os.fsync(self.log_file.fileno())
+            
+    def run(self):
+        
+        last_sync = time.perf_counter()
+        unsynced = False
+        
+        while True:
+            
+            # wake up in time for the next interval flush, or block until a row arrives
+            timeout = None
+            
+            if unsynced and self.flush_interval is not None:
+                timeout = max(last_sync + self.flush_interval - time.perf_counter(), 0)
+            
+            try:
+                
+                entry = self.rows.get(timeout=timeout)
+                
+                if entry is None:
+                    break
+                
+                self.write_row(entry)
+                unsynced = True
+                
+            except queue.Empty:
+                pass
+                
+            if unsynced and (self.flush_interval is None or time.perf_counter() - last_sync >= self.flush_interval):
+                self.sync()
+                last_sync = time.perf_counter()
+                unsynced = False
+                
+        self.sync()
+        
     def write_log(self):
         
-        with open(self.log_name, 'w', newline='') as csv_file:
-            log_writer = csv.writer(csv_file, delimiter=',')
+        # every row is written by the writer thread, closing waits for it and marks the log as complete
+        if self.thread.is_alive():
             
-            log_writer.writerow(['Stimulus', 'Iteration', 'Start time', 'End time'])
+            self.rows.put(None)
+            self.thread.join()
             
-            for row in self.log:
-                log_writer.writerow(row)
\ No newline at end of file
+        if not self.log_file.closed:
+            self.log_file.close()
\ No newline at end of file
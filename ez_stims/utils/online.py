@@ -0,0 +1,189 @@
+"""
+Segmentation while a scan is still being acquired.
+
+The growing ScanImage tiff and the stimulus log, which is written row by row,
+are polled together. A trial is written out as soon as acquired frames cover
+its end time, so the segmented data is ready when the session ends. The last
+page of the scan and an unterminated last log row are treated as still being
+written and only read on a later poll.
+
+Each poll only parses the pages added since the last one: the scan is
+reopened so the grown file is seen, but the IFD chain is followed on from
+the last page already read, and trial frames are read at their page offsets.
+
+Classes:
+- OnlineSegmenter: Tails a scan and its log and writes every trial once it has been acquired.
+"""
+import os
+import time
+import struct
+import tifffile
+import numpy as np
+from rich.table import Table
+from rich.console import Console
+
+from ez_stims.utils import segmenting
+
+class OnlineSegmenter():
+    """
+    Parameters:
+    - scan_filename (str): ScanImage tiff being acquired.
+    - log_filename (str): Stimulus log (csv or jsonl) being written by Log.
+    - scan_unix_time (int): Scan start time (ms) from the start time file.
+    - output_format: Output format from trial_writers.get_format.
+    - poll_interval (float): Seconds between polls of the scan and log.
+    - idle_timeout (float): Seconds without new frames after which acquisition is taken to have ended.
+    - start_timeout (float): Seconds to wait for the first frames before giving up.
+    """
+    def __init__(self, scan_filename, log_filename, scan_unix_time, output_format, poll_interval=1.0, idle_timeout=30.0, start_timeout=600.0):
+
+        self.scan_filename = scan_filename
+        self.log_filename = log_filename
+        self.scan_unix_time = scan_unix_time
+        self.output_format = output_format
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.start_timeout = start_timeout
+
+        self.timestamps = np.empty(0, dtype=np.int64)
+        self.page_offsets = []
+        self.log = []
+        self.num_segmented = 0
+        self.trials = []
+
+    def poll_log(self):
+        """ Read the complete rows of the log """
+
+        if not os.path.exists(self.log_filename):
+            return
+
+        with open(self.log_filename, mode='r', newline='') as csv_file:
+            text = csv_file.read()
+
+        # the last row may still be being written
+        complete = text[:text.rfind("\n") + 1]
+        self.log = segmenting.parse_log(complete, segmenting.get_log_format(self.log_filename))
+
+    def poll_scan(self, final=False):
+        """ Parse the timestamps of frames acquired since the last poll, returns the number of new frames """
+
+        try:
+
+            # opening only parses the header and first page, so the cost of a poll doesn't grow with the scan
+            with tifffile.TiffFile(self.scan_filename) as tif:
+
+                # carry on along the IFD chain from the last page read
+                start = self.page_offsets[-1] if self.page_offsets else tif.pages.first.offset
+                offsets = list(segmenting.iter_page_offsets(tif, start))[1 if self.page_offsets else 0:]
+
+                if not final:
+                    offsets = offsets[:-1]
+
+                frame_seconds = np.array([segmenting.parse_frame_timestamp(segmenting.read_page(tif, offset).description) for offset in offsets],
+                                         dtype=np.float64)
+
+        # a page caught half written is read again on the next poll
+        except (tifffile.TiffFileError, ValueError, IndexError, OSError, struct.error):
+            return 0
+
+        self.page_offsets.extend(offsets)
+        self.timestamps = np.concatenate((self.timestamps, segmenting.to_msec_array(frame_seconds) + self.scan_unix_time))
+
+        return len(frame_seconds)
+
+    def segment_ready(self, final=False):
+        """ Write every trial whose end time is covered by acquired frames, in log order """
+
+        while self.num_segmented < len(self.log):
+
+            entry = self.log[self.num_segmented]
+            start_time, end_time = segmenting.get_stim_times(entry)
+
+            # wait for a frame after the trial, once acquisition has ended the remaining trials are written as they are
+            if not final and (len(self.timestamps) == 0 or end_time >= self.timestamps[-1]):
+                break
+
+            ready = time.perf_counter()
+
+            start_times, end_times = np.array([start_time]), np.array([end_time])
+            start_frames, end_frames, report = segmenting.map_stim_frames(self.timestamps, start_times, end_times)
+
+            for message in segmenting.get_mapping_warnings([entry], report):
+                print(message)
+
+            start, end = int(start_frames[0]), int(end_frames[0])
+            name = entry["Stimulus"] + segmenting.get_iteration_str(entry)
+
+            if end > start:
+
+                with tifffile.TiffFile(self.scan_filename) as tif:
+                    frames = segmenting.read_pages(tif, self.page_offsets[start:end])
+
+                frames = frames.reshape((end - start,) + frames.shape[-2:])
+
+                writer = self.output_format.open(name, end - start)
+                writer.write(frames)
+                writer.close()
+
+            self.trials.append({"name": name, "frames": end - start, "write_time": time.perf_counter() - ready})
+            self.num_segmented += 1
+
+    def is_finished(self, started, last_frame):
+        """ No new frames for idle_timeout seconds, or no frames at all after start_timeout seconds """
+
+        now = time.perf_counter()
+
+        if len(self.timestamps):
+            return now - last_frame >= self.idle_timeout
+
+        if now - started >= self.start_timeout:
+
+            print("No frames acquired within {:.0f} s, stopping".format(self.start_timeout))
+            return True
+
+        return False
+
+    def run(self):
+        """ Segment until acquisition has ended (see is_finished) or the run is interrupted """
+
+        started = last_frame = time.perf_counter()
+
+        try:
+
+            while not self.is_finished(started, last_frame):
+
+                self.poll_log()
+
+                if self.poll_scan():
+                    last_frame = time.perf_counter()
+
+                self.segment_ready()
+
+                time.sleep(self.poll_interval)
+
+        except KeyboardInterrupt:
+
+            pass
+
+        # acquisition has ended, the last page and trials running past the scan are written too
+        self.poll_log()
+        self.poll_scan(final=True)
+        self.segment_ready(final=True)
+        self.output_format.close()
+
+    def print_report(self):
+
+        table = Table(title="Online Segmentation")
+
+        table.add_column("trial", style="cyan")
+        table.add_column("frames", justify="right", style="magenta")
+        table.add_column("write time (s)", justify="right", style="yellow")
+
+        for trial in self.trials:
+
+            table.add_row(trial["name"],
+                          "{:d}".format(trial["frames"]),
+                          "{:.2f}".format(trial["write_time"]))
+
+        console = Console()
+        console.print(table)
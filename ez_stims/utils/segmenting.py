@@ -1,14 +1,42 @@
+import os
+import re
+import io
 import csv
+import json
+import struct
+import hashlib
 import tifffile
-from ScanImageTiffReader import ScanImageTiffReader
+import numpy as np
 from bisect import bisect
+from concurrent.futures import ProcessPoolExecutor
 
-# csv read
+# matches the value of frameTimestamps_sec in a ScanImage frame description
+FRAME_TIMESTAMP_PATTERN = re.compile(r"frameTimestamps_sec\s*=\s*([-+0-9.eE]+)")
+
+# sidecar index written next to each scan
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.npz"
+FINGERPRINT_BYTES = 65536
+
+# log format from the file extension, csv or line-delimited json
+def get_log_format(filename):
+    
+    return "jsonl" if filename.endswith(".jsonl") else "csv"
+
+# parse the text of a log into a list of entries
+def parse_log(text, log_format="csv"):
+    
+    if log_format == "jsonl":
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    
+    log_reader = csv.DictReader(io.StringIO(text), delimiter=',')
+    return list(log_reader)
+
+# csv or jsonl read
 def read_log(filename):
     
-    with open(filename, mode='r') as csv_file:
-        log_reader = csv.DictReader(csv_file, delimiter=',')
-        return list(log_reader)
+    with open(filename, mode='r', newline='') as log_file:
+        return parse_log(log_file.read(), get_log_format(filename))
     
 # txt read
 def read_start_time(filename):
@@ -27,42 +55,285 @@ def get_stim_times(log_stim):
 # open main scan file
 def open_scan(filename): 
     
+    from ScanImageTiffReader import ScanImageTiffReader
+    
     scan = ScanImageTiffReader(filename);
     return scan
 
-# find numbeer of frames in scan
+# memory-map the frames of an uncompressed scan, None if its pages can't be mapped as one (page, height, width) stack
+def memmap_scan(filename, num_pages):
+    
+    try:
+        frames = tifffile.memmap(filename, mode='r')
+    except ValueError:
+        return None
+    
+    # hyperstacks map as e.g. (T, Z, C, Y, X), slicing their first axis would not select pages
+    if frames.ndim != 3 or frames.shape[0] != num_pages:
+        return None
+    
+    return frames
+
+# arrays are sliced by frame, so they have to be one frame per page
+def check_frame_stack(scan):
+    
+    if scan.ndim != 3:
+        raise ValueError(f"Expected a (frames, height, width) scan, got an array of shape {scan.shape}")
+
+# find numbeer of frames in scan (from the header, without reading any frames)
 def get_num_frames(scan):
     
-    num_frames = scan.data().shape[0]
+    if isinstance(scan, np.ndarray):
+        check_frame_stack(scan)
+    
+    if isinstance(scan, (np.ndarray, ScanPages)):
+        return len(scan)
+    
+    num_frames = scan.shape()[0]
     return num_frames
 
+# read a block of frames without loading the whole scan (a zero-copy view for a memory-mapped scan)
+def read_frames(scan, start, end):
+    
+    if isinstance(scan, np.ndarray):
+        check_frame_stack(scan)
+        return scan[start:end]
+    
+    if isinstance(scan, ScanPages):
+        return scan.read(start, end)
+    
+    frames = scan.data(beg=start, end=end)
+    return frames
+
 # change timestamp from seconds to milliseconds
 def to_msec(timestamp_sec):
     
     timestamp_msec = int(round(float(timestamp_sec) * 1000))
     return timestamp_msec
 
+# change an array of timestamps from seconds to milliseconds
+def to_msec_array(timestamps_sec):
+    
+    timestamps_msec = np.rint(np.asarray(timestamps_sec, dtype=np.float64) * 1000).astype(np.int64)
+    return timestamps_msec
+
+# parse only the frame timestamp (seconds) out of a frame description
+def parse_frame_timestamp(frame_info):
+    
+    match = FRAME_TIMESTAMP_PATTERN.search(frame_info)
+    
+    if match is None:
+        raise ValueError("frameTimestamps_sec not found in frame description")
+    
+    return float(match.group(1))
+
+# frame timestamps (seconds) for frames [start, end) of an open scan
+def get_frame_seconds(scan, start, end):
+    
+    frame_seconds = np.fromiter((parse_frame_timestamp(scan.description(i)) for i in range(start, end)),
+                                dtype=np.float64, 
+                                count=end-start)
+    return frame_seconds
+
+# worker for parallel reading, each process opens its own reader
+def read_frame_seconds(filename, start, end):
+    
+    from ScanImageTiffReader import ScanImageTiffReader
+    
+    with ScanImageTiffReader(filename) as scan:
+        return get_frame_seconds(scan, start, end)
+
 # get the timestamp from the scan frame
 def get_frame_timestamps(scan, num_frames, scan_unix_time):
     
-    frame_timestamps = []
+    frame_timestamps = to_msec_array(get_frame_seconds(scan, 0, num_frames)) + scan_unix_time
+    return frame_timestamps
+
+# frame timestamps (seconds) of every frame, reading descriptions in parallel blocks
+def read_all_frame_seconds(filename, num_frames, workers=1):
+    
+    if workers <= 1:
+        return read_frame_seconds(filename, 0, num_frames)
+    
+    bounds = np.linspace(0, num_frames, workers + 1).astype(int)
     
-    for i in range(num_frames):
-        frame_info = scan.description(i)
-        info_list = frame_info.split()
-        info_list = [i for i in info_list if i != "="]
-        time_index = info_list.index("frameTimestamps_sec") + 1
-        frame_time = (to_msec(info_list[time_index])) + scan_unix_time
-        frame_timestamps.append(frame_time)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        blocks = pool.map(read_frame_seconds, [filename]*workers, bounds[:-1], bounds[1:])
+        frame_seconds = np.concatenate(list(blocks))
+        
+    return frame_seconds
+
+# get the unix timestamp (ms, int64) of every frame
+def read_frame_timestamps(filename, num_frames, scan_unix_time, workers=1):
     
+    frame_timestamps = to_msec_array(read_all_frame_seconds(filename, num_frames, workers)) + scan_unix_time
+    return frame_timestamps
+
+# offsets of the page (IFD) at offset and of every page chained after it, read from the IFD headers only
+def iter_page_offsets(tif, offset):
+    
+    tiff = tif.tiff
+    fh = tif.filehandle
+    
+    while offset:
+        
+        yield offset
+        
+        fh.seek(offset)
+        num_tags = struct.unpack(tiff.tagnoformat, fh.read(tiff.tagnosize))[0]
+        fh.seek(offset + tiff.tagnosize + num_tags * tiff.tagsize)
+        offset = struct.unpack(tiff.offsetformat, fh.read(tiff.offsetsize))[0]
+
+# byte offset of every page (IFD) in the tiff
+def read_page_offsets(filename):
+    
+    with tifffile.TiffFile(filename) as tif:
+        page_offsets = np.fromiter(iter_page_offsets(tif, tif.pages.first.offset), dtype=np.int64)
+        
+    return page_offsets
+
+# parse the page at a known IFD offset, without walking the IFD chain up to it
+def read_page(tif, offset, index=0):
+    
+    tif.filehandle.seek(int(offset))
+    page = tifffile.TiffPage(tif, index=index)
+    return page
+
+# frames of the pages at the given offsets, stacked
+def read_pages(tif, page_offsets):
+    
+    frames = np.stack([read_page(tif, offset, i).asarray() for i, offset in enumerate(page_offsets)])
+    return frames
+
+# a scan read page by page at the offsets in its index, for scans that can't be memory-mapped
+class ScanPages():
+    
+    def __init__(self, filename, page_offsets):
+        
+        self.tif = tifffile.TiffFile(filename)
+        self.page_offsets = page_offsets
+        
+    def __len__(self):
+        
+        return len(self.page_offsets)
+    
+    def read(self, start, end):
+        
+        return read_pages(self.tif, self.page_offsets[start:end])
+    
+    def close(self):
+        
+        self.tif.close()
+
+# size, modification time and a hash of the header, used to check an index still matches its scan
+def get_scan_fingerprint(filename):
+    
+    stat = os.stat(filename)
+    
+    with open(filename, mode='rb') as file:
+        header_hash = hashlib.sha1(file.read(FINGERPRINT_BYTES)).hexdigest()
+        
+    return stat.st_size, stat.st_mtime_ns, header_hash
+
+# path of the sidecar index for a scan
+def get_index_path(filename):
+    
+    return filename + INDEX_SUFFIX
+
+# build the frame timestamp and page offset index of a scan
+def build_scan_index(filename, num_frames, workers=1):
+    
+    size, mtime_ns, header_hash = get_scan_fingerprint(filename)
+    page_offsets = read_page_offsets(filename)
+    
+    # frames are read by page offset, so every frame needs exactly one page
+    if len(page_offsets) != num_frames:
+        raise ValueError(f"{filename} has {len(page_offsets)} pages but {num_frames} frames, expected one page per frame")
+    
+    index = {"version": INDEX_VERSION,
+             "size": size,
+             "mtime_ns": mtime_ns,
+             "header_hash": header_hash,
+             "frame_seconds": read_all_frame_seconds(filename, num_frames, workers),
+             "page_offsets": page_offsets}
+    
+    return index
+
+# write the index next to the scan, renamed into place once complete
+def write_scan_index(filename, index):
+    
+    index_path = get_index_path(filename)
+    
+    try:
+        
+        with open(index_path + ".tmp", mode='wb') as file:
+            np.savez(file, **index)
+            
+        os.replace(index_path + ".tmp", index_path)
+        
+    except OSError:
+        
+        # don't leave a partial index behind
+        if os.path.exists(index_path + ".tmp"):
+            os.remove(index_path + ".tmp")
+            
+        raise
+
+# load the index of a scan, None if there is none or the scan has changed since it was written
+def load_scan_index(filename):
+    
+    index_path = get_index_path(filename)
+    
+    if not os.path.exists(index_path):
+        return None
+    
+    with np.load(index_path) as data:
+        index = {key: data[key] for key in data.files}
+        
+    size, mtime_ns, header_hash = get_scan_fingerprint(filename)
+    
+    if (int(index["version"]) != INDEX_VERSION or int(index["size"]) != size 
+        or int(index["mtime_ns"]) != mtime_ns or str(index["header_hash"]) != header_hash):
+        return None
+    
+    return index
+
+# load the scan index, building and writing it first if missing or stale
+def get_scan_index(filename, num_frames, workers=1):
+    
+    index = load_scan_index(filename)
+    
+    if index is None or len(index["frame_seconds"]) != num_frames or len(index["page_offsets"]) != num_frames:
+        
+        index = build_scan_index(filename, num_frames, workers)
+        
+        # scans on read-only shares or archives are segmented with the index kept in memory
+        try:
+            write_scan_index(filename, index)
+        except OSError as error:
+            print(f"Warning: could not write the scan index of {filename}, it will be rebuilt next time ({error})")
+        
+    return index
+
+# unix timestamps (ms, int64) of every frame from the scan index
+def get_index_timestamps(index, scan_unix_time):
+    
+    frame_timestamps = to_msec_array(index["frame_seconds"]) + scan_unix_time
     return frame_timestamps
     
 # change frame times to unix time
 def normalise_frame_timestamps(frame_times, scan_unix_time):
     
-    frame_unix_times = [frame_time + scan_unix_time for frame_time in frame_times]
+    frame_unix_times = np.asarray(frame_times, dtype=np.int64) + scan_unix_time
     return frame_unix_times
 
+# start and end times of every log entry as int64 arrays
+def get_log_times(log):
+    
+    start_times = np.fromiter((int(entry["Start time"]) for entry in log), dtype=np.int64, count=len(log))
+    end_times = np.fromiter((int(entry["End time"]) for entry in log), dtype=np.int64, count=len(log))
+    return start_times, end_times
+
 # get timestamps for all frames
 def get_stim_frames(frame_times, start_time, end_time):
     
@@ -70,6 +341,68 @@ def get_stim_frames(frame_times, start_time, end_time):
     end_frame = bisect(frame_times, end_time)
     return start_frame, end_frame
 
+# frame windows of every stimulus at once, same bounds as get_stim_frames
+def map_stim_frames(frame_times, start_times, end_times):
+    
+    frame_times = np.asarray(frame_times)
+    num_frames = len(frame_times)
+    
+    # no frames, every entry lies outside the scan and gets an empty window
+    if num_frames == 0:
+        
+        empty = np.zeros(len(start_times), dtype=np.int64)
+        report = {"outside": np.arange(len(start_times)),
+                  "truncated": np.empty(0, dtype=np.int64),
+                  "overlapping": np.empty(0, dtype=np.int64),
+                  "num_frames": 0}
+        
+        return empty, empty.copy(), report
+    
+    # one searchsorted call for all starts and ends (bisect is bisect_right)
+    bounds = np.searchsorted(frame_times, np.concatenate((start_times, end_times)), side='right')
+    start_frames = bounds[:len(start_times)] - 1
+    end_frames = bounds[len(start_times):]
+    
+    # entries entirely outside the scan, or only partly covered by it
+    outside = (end_times < frame_times[0]) | (start_times > frame_times[-1])
+    truncated = ~outside & ((start_times < frame_times[0]) | (end_times > frame_times[-1]))
+    
+    # entries whose frame window overlaps an earlier starting entry, entries outside the scan have no frames to share
+    order = np.argsort(start_frames, kind='stable')
+    sorted_ends = end_frames[order]
+    previous_end = np.concatenate(([np.iinfo(np.int64).min], np.maximum.accumulate(sorted_ends)[:-1]))
+    overlapping = np.zeros(len(start_times), dtype=bool)
+    overlapping[order] = start_frames[order] < previous_end
+    overlapping &= ~outside
+    
+    report = {"outside": np.flatnonzero(outside),
+              "truncated": np.flatnonzero(truncated),
+              "overlapping": np.flatnonzero(overlapping),
+              "num_frames": num_frames}
+    
+    start_frames = np.clip(start_frames, 0, num_frames)
+    end_frames = np.clip(end_frames, 0, num_frames)
+    
+    # entries after the scan would otherwise be clipped to its last frame, every entry outside gets an empty window
+    end_frames[outside] = start_frames[outside]
+    
+    return start_frames, end_frames, report
+
+# readable warnings for the problem entries found by map_stim_frames
+def get_mapping_warnings(log, report):
+    
+    descriptions = {"outside": "lies outside the scan",
+                    "truncated": "is only partly covered by the scan",
+                    "overlapping": "overlaps an earlier stimulus"}
+    
+    warnings = []
+    
+    for problem, description in descriptions.items():
+        for i in report[problem]:
+            warnings.append(f"Warning: {log[i]['Stimulus']}{get_iteration_str(log[i])} {description}")
+            
+    return warnings
+
 # create sub_array
 def get_subscan(scan, start, end):
     
@@ -86,4 +419,143 @@ def get_iteration_str(entry):
 # save video
 def write_subscan(path, subscan):
     
-    tifffile.imwrite(path, subscan)
\ No newline at end of file
+    tifffile.imwrite(path, subscan)
+
+# read the scan in chunks, handing each chunk to the writer of every subscan whose frame window it overlaps
+def stream_subscans(scan, windows, names, pool, chunk_size=256):
+    
+    num_frames = get_num_frames(scan)
+    windows = [(max(start, 0), min(end, num_frames)) for start, end in windows]
+    order = sorted(range(len(windows)), key=lambda k: windows[k][0])
+    
+    open_windows = set()
+    next_window = 0
+    chunk_start = 0
+    
+    try:
+        
+        while chunk_start < num_frames and (open_windows or next_window < len(order)):
+            
+            # skip frames no subscan needs
+            if not open_windows:
+                chunk_start = max(chunk_start, windows[order[next_window]][0])
+                
+            chunk_end = min(chunk_start + chunk_size, num_frames)
+            
+            # open subscans starting in this chunk, empty windows have nothing to write
+            while next_window < len(order) and windows[order[next_window]][0] < chunk_end:
+                
+                k = order[next_window]
+                if windows[k][1] > windows[k][0]:
+                    pool.open(k, names[k], windows[k][1] - windows[k][0])
+                    open_windows.add(k)
+                next_window += 1
+                
+            if not open_windows:
+                chunk_start = chunk_end
+                continue
+            
+            chunk = read_frames(scan, chunk_start, chunk_end)
+            
+            # the pool copies each block out of the chunk and holds back reading while too many wait to be written
+            for k in sorted(open_windows):
+                
+                start, end = windows[k]
+                lo, hi = max(start, chunk_start), min(end, chunk_end)
+                pool.write(k, chunk[lo-chunk_start:hi-chunk_start])
+                    
+                if end <= chunk_end:
+                    pool.close(k)
+                    open_windows.remove(k)
+                    
+            chunk_start = chunk_end
+            
+    finally:
+        
+        for k in open_windows:
+            pool.close(k)
+
+# trials of each stimulus, truncated to its shortest iteration so they can be averaged frame by frame,
+# and the number of iterations of each left out (excluded entries and empty windows)
+def get_trial_groups(windows, names, excluded=()):
+    
+    groups = {}
+    left_out = {}
+    excluded = set(int(k) for k in excluded)
+    
+    for k, (start, end) in enumerate(windows):
+        if end > start and k not in excluded:
+            groups.setdefault(names[k], []).append(k)
+        else:
+            left_out[names[k]] = left_out.get(names[k], 0) + 1
+            
+    lengths = {name: min(windows[k][1] - windows[k][0] for k in trials) for name, trials in groups.items()}
+    
+    return groups, lengths, left_out
+
+# per-stimulus mean and standard deviation stacks across iterations, accumulated while streaming the scan,
+# and the number of iterations of each stimulus left out of its average
+def average_subscans(scan, windows, names, report=None, chunk_size=256):
+    
+    num_frames = get_num_frames(scan)
+    windows = [(max(start, 0), min(end, num_frames)) for start, end in windows]
+    
+    # a trial outside or only partly inside the scan would cut every iteration of its stimulus short
+    excluded = np.concatenate((report["outside"], report["truncated"])) if report is not None else ()
+    groups, lengths, left_out = get_trial_groups(windows, names, excluded)
+    
+    frame_shape = read_frames(scan, 0, 1).shape[-2:]
+    sums = {name: np.zeros((length,) + frame_shape) for name, length in lengths.items()}
+    squares = {name: np.zeros((length,) + frame_shape) for name, length in lengths.items()}
+    
+    # only the frames each trial contributes to its average
+    trials = sorted(((windows[k][0], windows[k][0] + lengths[name], name) for name, ks in groups.items() for k in ks))
+    
+    if not trials:
+        return {}, left_out
+    
+    chunk_start = trials[0][0]
+    last_frame = max(end for _, end, _ in trials)
+    
+    while chunk_start < last_frame:
+        
+        chunk_end = min(chunk_start + chunk_size, last_frame)
+        chunk = None
+        
+        for start, end, name in trials:
+            
+            if start >= chunk_end:
+                break
+            
+            if end <= chunk_start:
+                continue
+            
+            if chunk is None:
+                chunk = read_frames(scan, chunk_start, chunk_end)
+            
+            lo, hi = max(start, chunk_start), min(end, chunk_end)
+            block = chunk[lo-chunk_start:hi-chunk_start].astype(np.float64)
+            
+            sums[name][lo-start:hi-start] += block
+            squares[name][lo-start:hi-start] += block * block
+            
+        chunk_start = chunk_end
+        
+    averages = {}
+    
+    for name, trial_ks in groups.items():
+        
+        count = len(trial_ks)
+        mean = sums[name] / count
+        std = np.sqrt(np.maximum(squares[name] / count - mean * mean, 0))
+        averages[name] = (mean.astype(np.float32), std.astype(np.float32), count)
+        
+    return averages, left_out
+
+# save the mean and standard deviation stack of every stimulus
+def write_averages(output_folder, averages):
+    
+    for name, (mean, std, count) in averages.items():
+        
+        write_subscan(os.path.join(output_folder, name + "_mean.tif"), mean)
+        write_subscan(os.path.join(output_folder, name + "_std.tif"), std)
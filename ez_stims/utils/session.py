@@ -0,0 +1,97 @@
+"""
+Several stimuli presented one after another in a single window.
+
+Every stimulus in the playlist is built and prepared before the first one
+starts, so its draw objects (textures, shaders, gratings, cached movies) are
+created up front and presenting it only turns them on. Each is presented in
+the shared window and cleared from it afterwards, so the window and its GL
+context are only created once per session. Pressing return
+stops the running stimulus and ends the session, returning control instead of
+exiting the process.
+
+Classes:
+- Session: Builds and presents a playlist of stimuli in one window.
+"""
+import ez_stims
+from psychopy import event
+
+from ez_stims.utils.idle import IdleScheduler
+from ez_stims.utils import setup
+
+# class names in ez_stims, only the stimuli in the playlist are imported
+STIMULI = {"grating": "GratStim",
+           "kalatsky": "KalatskyStim",
+           "dots": "DotsStim",
+           "single_dot": "SingleDotStim"}
+
+class Session():
+    """
+    Parameters:
+    - session_config (dict): Session config as loaded from a playlist YAML.
+    - monitor_config (MonitorConfig): Monitor config as loaded from monitor.yaml.
+    - log (Log): Log shared by every stimulus in the session.
+    """
+    def __init__(self, session_config, monitor_config, log):
+
+        self.playlist = session_config["playlist"]
+        self.pause = session_config.get("pause", 0)
+        self.monitor_config = monitor_config
+        self.log = log
+
+        self.stimuli = []
+        self.idle = IdleScheduler(self.get_keypress)
+
+    def get_keypress(self):
+        """ Listen for key press """
+
+        keys = event.getKeys()
+        if keys:
+            return keys[0]
+        else:
+            return None
+
+    def add_window(self, window):
+        """ Add the psychopy window every stimulus is presented on """
+
+        self.window = window
+
+    def build(self):
+        """ Create and prepare every stimulus in the playlist before the session starts """
+
+        for entry in self.playlist:
+
+            if entry["stimulus"] not in STIMULI:
+                raise ValueError(f"Unknown stimulus in playlist: {entry['stimulus']}")
+
+            config = setup.load_stim_config(entry["stimulus"], entry["config"], self.monitor_config)
+
+            stim = getattr(ez_stims, STIMULI[entry["stimulus"]])(config, self.monitor_config, self.log)
+            stim.add_window(self.window)
+            stim.prepare()
+
+            self.stimuli.append((entry, stim))
+
+    def present(self):
+        """ Present the playlist in order, returns False if it was stopped early """
+
+        for i, (entry, stim) in enumerate(self.stimuli):
+
+            # return during the pause ends the session as it does during a stimulus
+            if i > 0 and self.pause > 0 and self.idle.wait(self.pause, name="pause", stop_keys=("return",)) == "return":
+                return False
+
+            stim.background()
+
+            if entry.get("wait", False):
+                stim.wait()
+
+            stim.start_timer()
+            stim.present()
+            stim.clear()
+
+            if stim.stopped:
+                return False
+
+        self.idle.print_report()
+
+        return True
@@ -1,13 +1,108 @@
+import os
+import re
+import json
 import yaml
+import hashlib
 from psychopy import visual, monitors
 
-def load_config(config_file):
+from ez_stims.utils.config import CONFIGS, MonitorConfig
+
+# the libyaml loader is much faster, fall back to the pure python one if it isn't built
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+def load_config(config_file, config_dir="config", cache_dir=".cache"):
+    """
+    Load a YAML config from the config folder.
+
+    The parsed config is cached as JSON under the file name and the hash of
+    its contents, so later launches skip parsing until the file is edited, and
+    the entry of the previous contents is removed when it is. Only parsing is
+    cached, the Config classes still validate the settings on every load. JSON
+    is only ever read back as plain data, unlike a pickle it can not run code.
+
+    Parameters:
+    - config_file (str): File name within the config folder.
+    - config_dir (str): Folder the config files are in.
+    - cache_dir (str): Folder the parsed configs are cached in, relative to config_dir, None to always parse.
+
+    Returns:
+    - config (dict): Settings as loaded from the file.
+    """
+    config_path = os.path.join(config_dir, config_file)
+
+    with open(config_path, mode="rb") as config:
+        text = config.read()
+    
+    if cache_dir is None:
+        return yaml.load(text, Loader=YAML_LOADER)
+    
+    # next to the configs whatever the working directory
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(config_path)), cache_dir)
+    name = config_file.replace(os.sep, "_")
+    key = hashlib.sha256(text).hexdigest()[:32]
+    path = os.path.join(cache_dir, f"{name}.{key}.json")
     
-    with open(f"config/{config_file}") as config:
-        config = yaml.load(config.read(), Loader=yaml.Loader)
+    if os.path.exists(path):
+        
+        try:
+            with open(path, mode="r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            pass
+    
+    config = yaml.load(text, Loader=YAML_LOADER)
+    
+    try:
+        encoded = json.dumps(config)
+    except (TypeError, ValueError):
+        encoded = None
+    
+    # configs JSON can't hold as they are (dates, non-string keys) are parsed every time
+    if encoded is None or json.loads(encoded) != config:
+        return config
+    
+    os.makedirs(cache_dir, exist_ok=True)
+    
+    # renamed into place once complete, so a crash never leaves a partial cache file
+    with open(path + ".tmp", mode="w") as file:
+        file.write(encoded)
+        
+    os.replace(path + ".tmp", path)
+    
+    # one entry per config file, drop the ones of its earlier contents
+    stale = re.compile(re.escape(name) + r"\.[0-9a-f]{32}\.json")
+    
+    for entry in os.listdir(cache_dir):
+        if stale.fullmatch(entry) and entry != os.path.basename(path):
+            try:
+                os.remove(os.path.join(cache_dir, entry))
+            except OSError:
+                pass
         
     return config
 
+def load_monitor_config(config_file="monitor.yaml"):
+    """ Load and validate the monitor config """
+    
+    return MonitorConfig(load_config(config_file), source=config_file)
+
+def load_stim_config(stimulus, config_file, monitor_config):
+    """
+    Load and validate a stimulus config, with its derived values computed for the monitor.
+
+    Parameters:
+    - stimulus (str): kalatsky, single_dot, dots or grating.
+    - config_file (str): File name within the config folder.
+    - monitor_config (MonitorConfig): Monitor the stimulus is presented on.
+
+    Returns:
+    - config (Config): KalatskyConfig, SingleDotConfig, DotsConfig or GratingConfig.
+    """
+    if stimulus not in CONFIGS or stimulus == "monitor":
+        raise ValueError(f"Unknown stimulus: {stimulus}")
+    
+    return CONFIGS[stimulus](load_config(config_file), monitor_config, config_file)
+
 def setup_monitor(resolution, screen_width, viewing_distance, **kwargs):
     """ 
     Setup a Psychopy monitor object with specified settings.
@@ -0,0 +1,206 @@
+"""
+Output formats for segmented trials.
+
+Every format opens one writer per trial, named after its stimulus and
+iteration, which is handed (frames, y, x) blocks in order and closed once the
+trial is complete. Writers are used from the threads of a WriterPool, formats
+writing to one shared file are marked as shared so the pool keeps them on a
+single thread.
+
+Classes:
+- TiffFormat: One tiff per trial, optionally tiled and compressed.
+- HDF5Format: One chunked, compressed dataset per trial in a single HDF5 file.
+- NpyFormat: One raw .npy per trial, written through a memory map.
+
+Functions:
+- get_format(name, output_folder, **options): Create the output format called name.
+"""
+import os
+import tifffile
+import numpy as np
+
+class TiffFormat():
+    """
+    Parameters:
+    - output_folder (str): Folder the trial files are written to.
+    - compression (str): Tiff compression (e.g. "zlib", "zstd", "lzma"), None for uncompressed.
+    - level (int): Compression level.
+    - tile (tuple): (height, width) of tiles, multiples of 16, None for strips.
+    """
+    shared = False
+
+    def __init__(self, output_folder, compression=None, level=6, tile=None):
+
+        self.output_folder = output_folder
+        self.compression = compression
+        self.level = level
+        self.tile = tile
+
+    def open(self, name, num_frames):
+
+        return TiffWriter(os.path.join(self.output_folder, name + ".tif"), self.compression, self.level, self.tile)
+
+    def close(self):
+
+        pass
+
+class TiffWriter():
+
+    def __init__(self, path, compression, level, tile):
+
+        self.path = path
+        self.writer = tifffile.TiffWriter(path)
+
+        # contiguous pages can't be compressed or tiled, those are written as plain pages that read back as one series
+        if compression is None and tile is None:
+            self.options = {"contiguous": True}
+        else:
+            self.options = {"tile": tile, "metadata": None}
+
+        if compression is not None:
+            self.options.update(compression=compression, compressionargs={"level": level})
+
+    def write(self, frames):
+
+        # frames are appended one page at a time so the file reads back as one (frames, y, x) series
+        for frame in frames:
+            self.writer.write(frame, photometric="minisblack", **self.options)
+
+    def close(self):
+
+        self.writer.close()
+
+class HDF5Format():
+    """
+    Parameters:
+    - path (str): HDF5 file holding every trial.
+    - complib (str): PyTables compression library (e.g. "blosc2:zstd", "zlib").
+    - level (int): Compression level, 0 for uncompressed.
+    - chunk_frames (int): Frames per chunk, so single frames and trials are read without the whole file.
+    """
+    shared = True
+
+    def __init__(self, path, complib="blosc2:zstd", level=5, chunk_frames=16):
+
+        # only needed for this format
+        import tables
+
+        self.file = tables.open_file(path, mode="w")
+        self.filters = tables.Filters(complevel=level, complib=complib, shuffle=True)
+        self.chunk_frames = chunk_frames
+
+    def open(self, name, num_frames):
+
+        return HDF5Writer(self, name, num_frames)
+
+    def close(self):
+
+        self.file.close()
+
+class HDF5Writer():
+
+    def __init__(self, store, name, num_frames):
+
+        self.store = store
+        self.name = name
+        self.num_frames = num_frames
+        self.array = None
+        self.offset = 0
+
+    def write(self, frames):
+
+        import tables
+
+        # the frame shape and type are only known from the first block
+        if self.array is None:
+
+            self.array = self.store.file.create_carray("/",
+                                                       self.name,
+                                                       atom=tables.Atom.from_dtype(frames.dtype),
+                                                       shape=(self.num_frames,) + frames.shape[1:],
+                                                       chunkshape=(min(self.store.chunk_frames, self.num_frames),) + frames.shape[1:],
+                                                       filters=self.store.filters)
+
+        self.array[self.offset:self.offset+len(frames)] = frames
+        self.offset += len(frames)
+
+    def close(self):
+
+        if self.array is not None:
+            self.array.flush()
+
+class NpyFormat():
+    """
+    Parameters:
+    - output_folder (str): Folder the trial files are written to.
+    """
+    shared = False
+
+    def __init__(self, output_folder):
+
+        self.output_folder = output_folder
+
+    def open(self, name, num_frames):
+
+        return NpyWriter(os.path.join(self.output_folder, name + ".npy"), num_frames)
+
+    def close(self):
+
+        pass
+
+class NpyWriter():
+
+    def __init__(self, path, num_frames):
+
+        self.path = path
+        self.num_frames = num_frames
+        self.array = None
+        self.offset = 0
+
+    def write(self, frames):
+
+        # the frame shape and type are only known from the first block
+        if self.array is None:
+            self.array = np.lib.format.open_memmap(self.path,
+                                                   mode="w+",
+                                                   dtype=frames.dtype,
+                                                   shape=(self.num_frames,) + frames.shape[1:])
+
+        self.array[self.offset:self.offset+len(frames)] = frames
+        self.offset += len(frames)
+
+    def close(self):
+
+        if self.array is not None:
+
+            self.array.flush()
+            self.array = None
+
+def get_format(name, output_folder, compression=None, level=6, tile=None, chunk_frames=16):
+    """
+    Create an output format.
+
+    Parameters:
+    - name (str): "tiff", "hdf5" or "npy".
+    - output_folder (str): Folder the output is written to.
+    - compression (str): Tiff compression or PyTables complib, None for uncompressed.
+    - level (int): Compression level.
+    - tile (tuple): Tiff tile (height, width).
+    - chunk_frames (int): Frames per HDF5 chunk.
+
+    Returns:
+    - output_format: Object whose open(name, num_frames) returns a trial writer.
+    """
+    if name == "tiff":
+        return TiffFormat(output_folder, compression, level, tile)
+
+    if name == "hdf5":
+        return HDF5Format(os.path.join(output_folder, "subscans.h5"),
+                          compression if compression is not None else "blosc2:zstd",
+                          level,
+                          chunk_frames)
+
+    if name == "npy":
+        return NpyFormat(output_folder)
+
+    raise ValueError(f"Unknown output format: {name}")
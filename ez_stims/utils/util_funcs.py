@@ -10,11 +10,13 @@ Module Functions:
 
 import numpy as np
 import os
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename
 
 def get_filenames():
     
+    # imported here so headless machines without Tk can use the rest of this module
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
+    
     Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
     video_filename = askopenfilename(filetypes=[("Scanimage files","*.tif")], title="Select scan") # show an "Open" dialog box and return the path to the selected file
     log_filename = askopenfilename(filetypes=[("CSV log files","*.csv")], title="Select stimulus log") # show an "Open" dialog box and return the path to the selected file
@@ -43,20 +45,11 @@ def get_viewing_angle(screen_width, viewing_distance):
                       
     return theta
 
-def set_stimulus_size(monitor_config):
-    
-    resolution = monitor_config["resolution"]
-    ratio = monitor_config["ratio_stimulus-screen"]
-
-    stim_size = (resolution[0]/ratio, resolution[1]/ratio)
-    
-    return stim_size
-
-# create output folder
+# create output folder, reusing it if it already exists so runs can be resumed
 def create_output_folder(name, parent_folder):
     
     folder_path = os.path.join(parent_folder, name)
     
-    os.mkdir(folder_path)
+    os.makedirs(folder_path, exist_ok=True)
     
     return folder_path
\ No newline at end of file
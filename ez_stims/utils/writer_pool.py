@@ -0,0 +1,205 @@
+"""
+Parallel subscan writing with a bounded memory budget.
+
+Each subscan is owned by one worker thread, so frames of a subscan are
+written in order while different subscans are written at the same time.
+Output formats sharing one file keep all their subscans on one thread. Blocks
+are copied when submitted and count against a memory budget until written,
+and submitting blocks waits while the budget is used up, so a slow disk holds
+back reading the scan instead of filling memory. Every subscan records the
+bytes, frames and time spent writing it.
+
+Classes:
+- WriterPool: Writes frame blocks to many subscans at once and reports per-subscan throughput.
+"""
+import time
+import queue
+import threading
+import numpy as np
+from rich.table import Table
+from rich.console import Console
+
+class WriterPool():
+    """
+    Parameters:
+    - output_format: Output format from trial_writers.get_format, closed on shutdown.
+    - workers (int): Number of writer threads.
+    - memory_budget (int): Bytes of frame blocks allowed to wait for writing.
+    """
+    def __init__(self, output_format, workers=4, memory_budget=512*1024**2):
+
+        self.output_format = output_format
+        self.workers = max(int(workers), 1)
+        self.memory_budget = memory_budget
+
+        self.pending = 0
+        self.budget = threading.Condition()
+        self.error = None
+        self.files = {}
+
+        self.queues = [queue.Queue() for _ in range(self.workers)]
+        self.threads = [threading.Thread(target=self.run, args=(tasks,), daemon=True) for tasks in self.queues]
+
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.shutdown(raise_errors=exc_type is None)
+
+    def open(self, key, name, num_frames):
+        """ Start a new subscan of num_frames frames, later blocks for key are appended to it """
+
+        self.check_error()
+        self.files[key] = {"name": name, "frames": 0, "bytes": 0, "write_time": 0.0, "start": time.perf_counter(), "end": None}
+        self.get_queue(key).put(("open", key, (name, num_frames)))
+
+    def write(self, key, frames):
+        """ Queue a copy of a (frames, y, x) block for key, waiting while the memory budget is used up """
+
+        self.check_error()
+
+        # a view would keep its whole chunk (or the pages of a memory-mapped scan) alive while it waits,
+        # a copy holds exactly the bytes counted against the budget and lets the chunk be freed
+        frames = np.array(frames, order="C")
+        nbytes = frames.nbytes
+
+        # a block larger than the whole budget is still let through once nothing else is waiting
+        with self.budget:
+
+            while self.pending and self.pending + nbytes > self.memory_budget and self.error is None:
+                self.budget.wait()
+
+            self.pending += nbytes
+
+        self.get_queue(key).put(("write", key, frames))
+
+    def close(self, key):
+
+        self.get_queue(key).put(("close", key, None))
+
+    def shutdown(self, raise_errors=True):
+        """ Finish all queued writes and stop the workers """
+
+        for tasks in self.queues:
+            tasks.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.output_format.close()
+
+        if raise_errors:
+            self.check_error()
+
+    def get_queue(self, key):
+
+        if self.output_format.shared:
+            return self.queues[0]
+
+        return self.queues[hash(key) % self.workers]
+
+    def check_error(self):
+
+        if self.error is not None:
+            raise self.error
+
+    def run(self, tasks):
+
+        writers = {}
+
+        while True:
+
+            task = tasks.get()
+
+            if task is None:
+                break
+
+            action, key, data = task
+
+            try:
+
+                # after an error only the budget is released, so the producer never waits forever
+                if self.error is None:
+
+                    if action == "open":
+                        writers[key] = self.output_format.open(*data)
+
+                    elif action == "write":
+
+                        start = time.perf_counter()
+
+                        writers[key].write(data)
+                        self.files[key]["write_time"] += time.perf_counter() - start
+                        self.files[key]["frames"] += len(data)
+                        self.files[key]["bytes"] += data.nbytes
+
+                    elif action == "close":
+
+                        writers.pop(key).close()
+                        self.files[key]["end"] = time.perf_counter()
+
+            except Exception as error:
+
+                self.error = error
+
+            if action == "write":
+
+                with self.budget:
+
+                    self.pending -= data.nbytes
+                    self.budget.notify_all()
+
+        for writer in writers.values():
+            writer.close()
+
+    def get_report(self):
+
+        return list(self.files.values())
+
+    def print_report(self):
+
+        table = Table(title="Subscan Writes")
+
+        table.add_column("subscan", style="cyan")
+        table.add_column("frames", justify="right", style="magenta")
+        table.add_column("size (MB)", justify="right", style="magenta")
+        table.add_column("write time (s)", justify="right", style="yellow")
+        table.add_column("throughput (MB/s)", justify="right", style="yellow")
+
+        total_bytes = 0
+        total_frames = 0
+
+        for file in self.files.values():
+
+            megabytes = file["bytes"]/1024**2
+            total_bytes += file["bytes"]
+            total_frames += file["frames"]
+
+            table.add_row(file["name"],
+                          "{:d}".format(file["frames"]),
+                          "{:.1f}".format(megabytes),
+                          "{:.2f}".format(file["write_time"]),
+                          "{:.1f}".format(megabytes/file["write_time"]) if file["write_time"] > 0 else "--")
+
+        # overall throughput is over wall time, so it shows what the workers achieved together
+        starts = [file["start"] for file in self.files.values()]
+        ends = [file["end"] for file in self.files.values() if file["end"] is not None]
+
+        if starts and ends:
+
+            wall_time = max(ends) - min(starts)
+
+            table.add_row("total",
+                          "{:d}".format(total_frames),
+                          "{:.1f}".format(total_bytes/1024**2),
+                          "{:.2f}".format(wall_time),
+                          "{:.1f}".format(total_bytes/1024**2/wall_time) if wall_time > 0 else "--",
+                          style="bold")
+
+        console = Console()
+        console.print(table)
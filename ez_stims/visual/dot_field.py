@@ -0,0 +1,106 @@
+import numpy as np
+
+class DotField():
+    """
+    A field of identical dots held in a single position array and drawn in one batched call.
+
+    Parameters:
+    - window (psychopy.visual.Window): Window the field is drawn on, None to only track positions.
+      The field is not drawn until set_auto_draw(True).
+    - capacity (int): Maximum number of dots alive at once.
+    - radius (float): Radius of each dot in the given units.
+    - color (str or list): Fill colour of the dots.
+    - units (str): Psychopy units of positions and radius.
+    """
+    def __init__(self, window, capacity, radius, color, units="pix"):
+
+        self.capacity = max(int(np.ceil(capacity)), 1)
+
+        # every slot exists up front, dead slots are simply invisible
+        self.xys = np.zeros((self.capacity, 2))
+        self.alive = np.zeros(self.capacity, dtype=bool)
+        self.opacities = np.zeros(self.capacity)
+        
+        # free-list of dead slot indices, used as a stack
+        self.free = np.arange(self.capacity)[::-1].copy()
+        self.num_free = self.capacity
+
+        self.elements = None
+
+        if window is None:
+            return
+
+        # only imported when drawing, so positions can be tracked without psychopy
+        from psychopy import visual
+
+        self.elements = visual.ElementArrayStim(window,
+                                                units=units,
+                                                nElements=self.capacity,
+                                                xys=self.xys,
+                                                sizes=radius*2,
+                                                colors=color,
+                                                elementTex=None,
+                                                elementMask="circle",
+                                                opacities=self.opacities,
+                                                autoLog=False,
+                                                autoDraw=False)
+
+    def count(self):
+        """ Return number of live dots """
+
+        return self.capacity - self.num_free
+
+    def is_full(self):
+
+        return self.num_free == 0
+
+    def spawn(self, position):
+        """ Bring a dead slot to life at position, returns False if the field is full """
+
+        if self.num_free == 0:
+            return False
+
+        self.num_free -= 1
+        i = self.free[self.num_free]
+        
+        self.xys[i] = position
+        self.alive[i] = True
+        self.opacities[i] = 1
+
+        if self.elements is not None:
+            self.elements.opacities = self.opacities
+
+        return True
+
+    def advance(self, increment):
+        """ Move every dot by the same (x, y) increment """
+
+        self.xys += increment
+
+        if self.elements is not None:
+            self.elements.xys = self.xys
+
+    def cull(self, limit):
+        """ Kill every live dot whose x or y position is beyond +/- limit """
+
+        expired = np.flatnonzero(self.alive & (np.abs(self.xys) > limit).any(axis=1))
+        num_expired = expired.size
+
+        if num_expired:
+            
+            self.alive[expired] = False
+            self.opacities[expired] = 0
+
+            if self.elements is not None:
+                self.elements.opacities = self.opacities
+            
+            # return slots to the free-list
+            self.free[self.num_free:self.num_free+num_expired] = expired
+            self.num_free += num_expired
+
+        return num_expired
+
+    def set_auto_draw(self, value):
+
+        if self.elements is not None:
+            self.elements.autoDraw = value
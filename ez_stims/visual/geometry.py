@@ -1,6 +1,5 @@
 import math
 import numpy as np
-import matplotlib.pyplot as plt
 
 def tangent_linspace(theta, radius, length, N):
 
@@ -16,6 +15,9 @@ def tangent_linspace(theta, radius, length, N):
     return xn, yn
 
 def plot_circle_and_tangent(R, xn, yn):
+    # matplotlib is only needed for this debug plot, so it isn't imported with the module
+    import matplotlib.pyplot as plt
+
     # Generate points for the circle
     circle_theta = np.linspace(0, 2*np.pi, 100)
     circle_x = R * np.cos(circle_theta)
@@ -0,0 +1,251 @@
+"""
+Full-screen stimuli drawn straight with OpenGL into a psychopy window.
+
+psychopy's ImageStim takes float images in the range -1 to 1 and rebuilds its
+texture on every image assignment, which costs a full-resolution conversion
+and upload per frame. These stimuli instead allocate one texture when they are
+created and only stream new pixels into it, so the per-frame cost is a single
+glTexSubImage2D of the frame's bytes.
+
+They are drawn explicitly before each flip rather than with autoDraw, so any
+autoDrawn stimulus (e.g. a background Rect) is drawn over them and has to be
+turned off while they are shown.
+
+Classes:
+- FrameStream: Plays uint8 RGB frames through one persistent texture.
+- WarpedBarShader: Draws the spherically corrected bar on the GPU from the warp maps.
+
+Functions:
+- draw_textured_quad(GL, texture_id, program=0): Draw a texture over the whole window.
+"""
+import ctypes
+import numpy as np
+
+class FrameStream():
+    """
+    Parameters:
+    - window (psychopy.visual.Window): Window the frames are drawn on, its GL context must be current.
+    - width, height (int): Size of the frames in pixels, stretched over the whole window.
+    """
+    def __init__(self, window, width, height):
+
+        # psychopy draws through pyglet's GL bindings whatever its window backend
+        import pyglet.gl as GL
+
+        self.GL = GL
+        self.window = window
+        self.width = width
+        self.height = height
+
+        self.texture_id = GL.GLuint()
+        GL.glGenTextures(1, ctypes.byref(self.texture_id))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture_id)
+
+        # one texel per frame pixel, no filtering or mipmaps
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+
+        # allocated once, frames are only copied into it
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGB8, width, height, 0, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, None)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+    def update(self, frame):
+        """
+        Stream a frame into the texture.
+
+        Parameters:
+        - frame (numpy.ndarray): (height, width, 3) uint8 RGB, top row first, e.g. a memory-mapped movie frame.
+        """
+        GL = self.GL
+
+        if frame.shape != (self.height, self.width, 3) or frame.dtype != np.uint8:
+            raise ValueError(f"Expected a ({self.height}, {self.width}, 3) uint8 frame, got {frame.shape} {frame.dtype}")
+
+        # memory-mapped frames are already contiguous, so this does not copy them
+        frame = np.ascontiguousarray(frame)
+
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture_id)
+
+        # rows of 3 byte pixels are not padded to 4 bytes
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 1)
+        GL.glTexSubImage2D(GL.GL_TEXTURE_2D, 0, 0, 0, self.width, self.height, GL.GL_RGB, GL.GL_UNSIGNED_BYTE, frame.ctypes)
+        GL.glPixelStorei(GL.GL_UNPACK_ALIGNMENT, 4)
+
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+    def draw(self):
+        """ Draw the last streamed frame over the whole window """
+
+        draw_textured_quad(self.GL, self.texture_id)
+
+    def release(self):
+        """ Free the texture, the stream can not be drawn afterwards """
+
+        if self.texture_id is not None:
+            self.GL.glDeleteTextures(1, ctypes.byref(self.texture_id))
+            self.texture_id = None
+
+# the warp maps are sampled per pixel, the bar is coloured exactly as WarpedBar.render colours it
+WARPED_BAR_VERTEX = """
+#version 120
+
+void main() {
+    gl_TexCoord[0] = gl_MultiTexCoord0;
+    gl_Position = ftransform();
+}
+"""
+
+WARPED_BAR_FRAGMENT = """
+#version 120
+
+uniform sampler2D maps;
+uniform float position;
+uniform float checkSize;
+uniform float flipped;
+uniform vec3 color0;
+uniform vec3 color1;
+uniform vec3 background;
+
+void main() {
+    vec2 map = texture2D(maps, gl_TexCoord[0].st).rg;
+    float offset = map.r - position;
+
+    if (abs(offset) >= checkSize) {
+        gl_FragColor = vec4(background, 1.0);
+        return;
+    }
+
+    // row parity xor right check xor flipped, as a sum mod 2 since GLSL 1.20 has no bitwise operators
+    float index = mod(map.g + step(0.0, offset) + flipped, 2.0);
+    gl_FragColor = vec4(mix(color0, color1, index), 1.0);
+}
+"""
+
+class WarpedBarShader():
+    """
+    A bar of two columns of checks sweeping in azimuth, drawn by a fragment shader.
+
+    The warp maps are uploaded once as a float texture and the bar position and
+    flip are uniforms, so a frame costs two uniform updates and one draw whatever
+    the resolution. Takes the same inputs as WarpedBar, which draws the same
+    pixels on the CPU for headless rendering.
+
+    Parameters:
+    - window (psychopy.visual.Window): Window the bar is drawn on, its GL context must be current.
+    - azimuth, altitude (numpy.ndarray): Warp maps from get_warp_maps.
+    - check_size (float): Width and height of a check in degrees.
+    - palette (numpy.ndarray): (2, 3) uint8 colours of the checks.
+    - background (numpy.ndarray): (3,) uint8 background colour.
+    - checkered (bool): Alternate colours between rows of checks, False for plain bars.
+    """
+    def __init__(self, window, azimuth, altitude, check_size, palette, background, checkered=True):
+
+        import pyglet.gl as GL
+        from psychopy.visual.shaders import compileProgram
+
+        self.GL = GL
+        self.window = window
+
+        height, width = azimuth.shape
+
+        # azimuth and row parity per pixel, top row first
+        maps = np.zeros((height, width, 3), dtype=np.float32)
+        maps[..., 0] = azimuth
+
+        if checkered:
+            maps[..., 1] = np.floor(altitude / check_size) % 2
+
+        self.texture_id = GL.GLuint()
+        GL.glGenTextures(1, ctypes.byref(self.texture_id))
+        GL.glBindTexture(GL.GL_TEXTURE_2D, self.texture_id)
+
+        # maps are looked up, never interpolated
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MIN_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_MAG_FILTER, GL.GL_NEAREST)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_S, GL.GL_CLAMP_TO_EDGE)
+        GL.glTexParameteri(GL.GL_TEXTURE_2D, GL.GL_TEXTURE_WRAP_T, GL.GL_CLAMP_TO_EDGE)
+
+        GL.glTexImage2D(GL.GL_TEXTURE_2D, 0, GL.GL_RGB32F_ARB, width, height, 0, GL.GL_RGB, GL.GL_FLOAT, maps.ctypes)
+        GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+
+        self.program = compileProgram(WARPED_BAR_VERTEX, WARPED_BAR_FRAGMENT)
+        self.locations = {name: GL.glGetUniformLocation(self.program, name.encode()) for name in ("maps", "position", "checkSize", "flipped", "color0", "color1", "background")}
+
+        palette = (np.asarray(palette, dtype=float) / 255).tolist()
+        background = (np.asarray(background, dtype=float) / 255).tolist()
+
+        # constant for the stimulus, set once
+        GL.glUseProgram(self.program)
+        GL.glUniform1i(self.locations["maps"], 0)
+        GL.glUniform1f(self.locations["checkSize"], float(check_size))
+        GL.glUniform3f(self.locations["color0"], *palette[0])
+        GL.glUniform3f(self.locations["color1"], *palette[1])
+        GL.glUniform3f(self.locations["background"], *background)
+        GL.glUseProgram(0)
+
+        self.position = 0.0
+        self.flipped = False
+
+    def update(self, position, flipped):
+        """ Move the bar to position (degrees azimuth) with colours swapped if flipped, applied on the next draw """
+
+        self.position = position
+        self.flipped = flipped
+
+    def draw(self):
+        """ Draw the bar over the whole window """
+
+        GL = self.GL
+
+        GL.glUseProgram(self.program)
+        GL.glUniform1f(self.locations["position"], float(self.position))
+        GL.glUniform1f(self.locations["flipped"], 1.0 if self.flipped else 0.0)
+
+        draw_textured_quad(GL, self.texture_id, self.program)
+
+    def release(self):
+        """ Free the maps texture, the bar can not be drawn afterwards """
+
+        if self.texture_id is not None:
+            self.GL.glDeleteTextures(1, ctypes.byref(self.texture_id))
+            self.texture_id = None
+
+def draw_textured_quad(GL, texture_id, program=0):
+    """ Draw a texture over the whole window, its first row at the top, leaving the window's matrices as they were """
+
+    GL.glUseProgram(program)
+
+    GL.glMatrixMode(GL.GL_PROJECTION)
+    GL.glPushMatrix()
+    GL.glLoadIdentity()
+    GL.glMatrixMode(GL.GL_MODELVIEW)
+    GL.glPushMatrix()
+    GL.glLoadIdentity()
+
+    GL.glActiveTexture(GL.GL_TEXTURE0)
+    GL.glEnable(GL.GL_TEXTURE_2D)
+    GL.glBindTexture(GL.GL_TEXTURE_2D, texture_id)
+    GL.glColor4f(1, 1, 1, 1)
+
+    GL.glBegin(GL.GL_QUADS)
+    GL.glTexCoord2f(0, 1)
+    GL.glVertex2f(-1, -1)
+    GL.glTexCoord2f(1, 1)
+    GL.glVertex2f(1, -1)
+    GL.glTexCoord2f(1, 0)
+    GL.glVertex2f(1, 1)
+    GL.glTexCoord2f(0, 0)
+    GL.glVertex2f(-1, 1)
+    GL.glEnd()
+
+    GL.glBindTexture(GL.GL_TEXTURE_2D, 0)
+    GL.glDisable(GL.GL_TEXTURE_2D)
+
+    GL.glMatrixMode(GL.GL_PROJECTION)
+    GL.glPopMatrix()
+    GL.glMatrixMode(GL.GL_MODELVIEW)
+    GL.glPopMatrix()
+
+    GL.glUseProgram(0)
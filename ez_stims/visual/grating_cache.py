@@ -0,0 +1,55 @@
+"""
+Shared grating objects for paradigms with repeated parameters.
+
+A psychopy GratingStim owns its own GPU texture, so gratings that only differ in
+orientation and phase can share one object and set those per draw.
+
+Classes:
+- GratingCache: Least-recently-used cache of GratingStim objects keyed by (tex, sf, size, units).
+"""
+from collections import OrderedDict
+
+class GratingCache():
+
+    def __init__(self, window, max_size=32):
+
+        self.window = window
+        self.max_size = max_size
+        self.gratings = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tex, sf, size, units):
+        """ Return the grating for these parameters, building it on first use """
+
+        key = (tex, sf, tuple(size), units)
+
+        if key in self.gratings:
+
+            self.hits += 1
+            self.gratings.move_to_end(key)
+
+            return self.gratings[key]
+
+        self.misses += 1
+
+        from psychopy import visual
+
+        grating = visual.GratingStim(self.window,
+                                     tex=tex,
+                                     units=units,
+                                     size=size,
+                                     sf=sf,
+                                     autoLog=False)
+
+        self.gratings[key] = grating
+
+        # drop the least recently used grating and its texture
+        if len(self.gratings) > self.max_size:
+            self.gratings.popitem(last=False)
+
+        return grating
+
+    def __len__(self):
+
+        return len(self.gratings)
@@ -0,0 +1,438 @@
+"""
+Offscreen CPU rendering of stimuli into NumPy frames.
+
+Renderers step a freshly constructed stimulus object (no window added) through
+the same per-frame state as on the rig, and rasterize each frame with NumPy into
+a preallocated uint8 buffer of shape (frames, height, width, 3). No psychopy
+window, GPU or display is needed.
+
+Classes:
+- HeadlessRenderer: Abstract base class handling buffers, batching and throughput measurement.
+- KalatskyRenderer: Renders KalatskyStim bars and checkerboards.
+- SingleDotRenderer: Renders the SingleDotStim dot.
+- DotsRenderer: Renders the DotsStim dot field.
+- GratingRenderer: Renders GratStim paradigms from the compiled timeline.
+
+Functions:
+- get_renderer(stim, resolution=None, batch_size=32): Return the renderer for a stimulus object.
+- to_rgb(color): Convert a psychopy colour name or rgb list to uint8 RGB.
+"""
+import math
+import time
+import random
+import numpy as np
+from abc import ABC, abstractmethod
+
+from ez_stims.visual.dot_field import DotField
+from ez_stims.visual.timeline import Timeline
+
+NAMED_COLORS = {"black": (0, 0, 0),
+                "white": (255, 255, 255),
+                "gray": (128, 128, 128),
+                "grey": (128, 128, 128),
+                "red": (255, 0, 0),
+                "green": (0, 128, 0),
+                "blue": (0, 0, 255)}
+
+def to_rgb(color):
+    """
+    Convert a psychopy colour to uint8 RGB.
+
+    Parameters:
+    - color (str or list): Colour name, or psychopy rgb triplet in the range -1 to 1.
+
+    Returns:
+    - rgb (numpy.ndarray): Array of three uint8 values.
+    """
+    if isinstance(color, str):
+
+        if color.lower() not in NAMED_COLORS:
+            raise ValueError(f"Unsupported colour for headless rendering: {color}")
+
+        return np.array(NAMED_COLORS[color.lower()], dtype=np.uint8)
+
+    rgb = (np.asarray(color, dtype=float) + 1) / 2 * 255
+
+    return np.clip(np.round(rgb), 0, 255).astype(np.uint8)
+
+class HeadlessRenderer(ABC):
+    """
+    Subclasses provide next_states, stepping the stimulus, and rasterize, drawing
+    those states into the buffer, and override is_finished if the stimulus ends.
+
+    Parameters:
+    - stim: Stimulus object to render, must not have been presented.
+    - resolution (tuple): (width, height) of the rendered frames, defaults to the monitor resolution.
+    - batch_size (int): Number of frames preallocated in the buffer.
+    """
+    name = "stimulus"
+
+    def __init__(self, stim, resolution=None, batch_size=32):
+
+        self.stim = stim
+        self.resolution = tuple(resolution) if resolution is not None else tuple(stim.monitor_config.resolution)
+        self.width, self.height = self.resolution
+
+        self.buffer = np.zeros((batch_size, self.height, self.width, 3), dtype=np.uint8)
+        self.frames_rendered = 0
+
+        # pixel centres in norm units, y increasing upwards
+        self.x_norm = (np.arange(self.width) + 0.5) / self.width * 2 - 1
+        self.y_norm = 1 - (np.arange(self.height) + 0.5) / self.height * 2
+
+    def get_buffer(self, num_frames):
+        """ Return a view of the first num_frames buffer frames, growing the buffer if needed """
+
+        if num_frames > len(self.buffer):
+            self.buffer = np.zeros((num_frames, self.height, self.width, 3), dtype=np.uint8)
+
+        return self.buffer[:num_frames]
+
+    def is_finished(self):
+
+        return False
+
+    def get_entries(self):
+        """ Log entries covering the frames rendered so far """
+
+        return [{"name": self.name, "iteration": 1, "start_frame": 0, "end_frame": self.frames_rendered}]
+
+    @abstractmethod
+    def next_states(self, num_frames):
+        """ Advance the stimulus and return per-frame state for up to num_frames frames, an array or a tuple of arrays with one row per frame """
+
+    @abstractmethod
+    def rasterize(self, states, out):
+        """ Draw the frames of states from next_states into out, a (frames, height, width, 3) uint8 view of the buffer """
+
+    def render(self, num_frames=None):
+        """
+        Render the next batch of frames.
+
+        Returns:
+        - frames (numpy.ndarray): View into the preallocated buffer, overwritten by the next call.
+        """
+        num_frames = len(self.buffer) if num_frames is None else num_frames
+
+        states = self.next_states(num_frames)
+        out = self.get_buffer(len(states[0]) if isinstance(states, tuple) else len(states))
+
+        if len(out):
+            self.rasterize(states, out)
+
+        self.frames_rendered += len(out)
+
+        return out
+
+    def frames(self, batch_size=None, max_frames=None):
+        """ Yield batches of frames until the stimulus finishes or max_frames is reached """
+
+        batch_size = len(self.buffer) if batch_size is None else batch_size
+        remaining = max_frames
+
+        while not self.is_finished() and (remaining is None or remaining > 0):
+
+            n = batch_size if remaining is None else min(batch_size, remaining)
+            batch = self.render(n)
+
+            if len(batch) == 0:
+                break
+
+            if remaining is not None:
+                remaining -= len(batch)
+
+            yield batch
+
+    def benchmark(self, num_frames, batch_size=None):
+        """ Render num_frames frames and return throughput in frames per second """
+
+        start = time.perf_counter()
+        rendered = sum(len(batch) for batch in self.frames(batch_size, num_frames))
+        elapsed = time.perf_counter() - start
+
+        return rendered / elapsed if elapsed > 0 else float("inf")
+
+class KalatskyRenderer(HeadlessRenderer):
+
+    name = "kalatsky"
+
+    def __init__(self, stim, resolution=None, batch_size=32):
+
+        super().__init__(stim, resolution, batch_size)
+
+        self.background = to_rgb(stim.config.background_color)
+        self.palette = np.stack([to_rgb(color) for color in stim.config.initial_colors])
+
+        # row of the bar each pixel row falls in, alternating colours for checks
+        rows = np.clip(np.floor((self.y_norm + 1) / stim.config.check_height), 0, stim.config.number_of_checks - 1).astype(int)
+        self.row_parity = rows % 2 if stim.config.stimulus_type.name == "CHECK" else np.zeros(self.height, dtype=int)
+
+        # the spherically corrected bar is drawn from the warp maps, at the rendered resolution
+        self.warped = stim.get_warped_bar(self.resolution) if stim.config.engine.name == "SPHERICAL" else None
+
+    def is_finished(self):
+
+        return self.stim.cycles_complete >= self.stim.config.cycles
+
+    def next_states(self, num_frames):
+
+        centres = []
+        flipped = []
+
+        for _ in range(num_frames):
+
+            if self.is_finished():
+                break
+
+            self.stim.next_frame()
+            centres.append(self.stim.centre)
+            flipped.append(self.stim.flipped)
+            self.stim.frame += 1
+
+        return np.array(centres), np.array(flipped, dtype=bool)
+
+    def rasterize(self, states, out):
+
+        centres, flipped = states
+
+        if self.warped is not None:
+
+            for i in range(len(centres)):
+                out[i] = self.warped.render(centres[i] * self.stim.monitor_config.viewing_angle/2, flipped[i])
+
+            return
+
+        width = self.stim.config.check_width
+        x = self.x_norm[None, :]
+
+        left = (x >= centres[:, None] - width) & (x < centres[:, None])
+        right = (x >= centres[:, None]) & (x < centres[:, None] + width)
+
+        # colour index of the left check per frame and row, right check is the opposite
+        left_index = self.row_parity[None, :] ^ flipped[:, None].astype(int)
+        left_color = self.palette[left_index][:, :, None, :]
+        right_color = self.palette[1 - left_index][:, :, None, :]
+
+        out[:] = self.background
+        np.copyto(out, left_color, where=left[:, None, :, None])
+        np.copyto(out, right_color, where=right[:, None, :, None])
+
+class SingleDotRenderer(HeadlessRenderer):
+
+    name = "single_dot"
+
+    def __init__(self, stim, resolution=None, batch_size=32):
+
+        super().__init__(stim, resolution, batch_size)
+
+        self.background = to_rgb(stim.config.background_color)
+        self.color = to_rgb(stim.config.dot_color)
+
+        self.dy2 = ((self.y_norm - stim.config.path_y) / (stim.config.dot_height/2))**2
+
+    def is_finished(self):
+
+        return self.stim.cycles_complete >= self.stim.config.cycles
+
+    def next_states(self, num_frames):
+
+        xs = []
+
+        for _ in range(num_frames):
+
+            if self.is_finished():
+                break
+
+            self.stim.next_frame()
+            xs.append(self.stim.dot_x)
+            self.stim.frame += 1
+
+        return np.array(xs)
+
+    def rasterize(self, states, out):
+
+        dx2 = ((self.x_norm[None, :] - states[:, None]) / (self.stim.config.dot_width/2))**2
+        inside = (dx2[:, None, :] + self.dy2[None, :, None]) <= 1
+
+        out[:] = self.background
+        np.copyto(out, self.color, where=inside[..., None])
+
+class DotsRenderer(HeadlessRenderer):
+    """ Dots spawn at random, pass seed for reproducible frames """
+
+    name = "dots"
+
+    def __init__(self, stim, resolution=None, batch_size=32, seed=None):
+
+        super().__init__(stim, resolution, batch_size)
+
+        # seed only the stimulus' own generator, never the process-wide one
+        if seed is not None:
+            stim.random = random.Random(seed)
+
+        self.background = to_rgb(stim.config.background_color)
+        self.color = to_rgb(stim.config.color)
+
+        # track positions without a window
+        stim.field = DotField(None, capacity=stim.config.max_dots, radius=stim.config.dot_radius_pix, color=stim.config.color)
+
+        self.frames_per_spawn = max(int(round(stim.config.spawn_period * stim.monitor_config.frame_rate)), 1)
+        self.frame = 0
+
+        # pixel scale between the monitor and the rendered resolution
+        self.scale = self.width / stim.monitor_config.resolution[0]
+        self.radius = stim.config.dot_radius_pix * self.scale
+
+        r = int(math.ceil(self.radius))
+        offsets = np.arange(-r, r + 1)
+        self.stamp = (offsets[None, :]**2 + offsets[:, None]**2) <= self.radius**2
+        self.stamp_radius = r
+
+    def next_states(self, num_frames):
+
+        field = self.stim.field
+        states = np.zeros((num_frames, field.capacity, 2))
+        alive = np.zeros((num_frames, field.capacity), dtype=bool)
+
+        for n in range(num_frames):
+
+            field.advance((self.stim.config.x_increment, self.stim.config.y_increment))
+            states[n] = field.xys
+            alive[n] = field.alive
+
+            # same spawn schedule as the presentation loop, counted in frames
+            self.frame += 1
+            if self.frame % self.frames_per_spawn == 0:
+
+                self.stim.delete_dots()
+
+                if self.stim.dot_count() < self.stim.config.max_dots:
+                    self.stim.spawn_dot()
+
+        return states, alive
+
+    def rasterize(self, states, out):
+
+        xys, alive = states
+        r = self.stamp_radius
+
+        out[:] = self.background
+
+        for n in range(len(out)):
+
+            # pix units have the origin at the centre with y upwards
+            centres_x = np.round(xys[n, alive[n], 0] * self.scale + self.width/2).astype(int)
+            centres_y = np.round(self.height/2 - xys[n, alive[n], 1] * self.scale).astype(int)
+
+            for cx, cy in zip(centres_x, centres_y):
+
+                x0, x1 = max(cx - r, 0), min(cx + r + 1, self.width)
+                y0, y1 = max(cy - r, 0), min(cy + r + 1, self.height)
+
+                if x0 >= x1 or y0 >= y1:
+                    continue
+
+                stamp = self.stamp[y0-(cy-r):y1-(cy-r), x0-(cx-r):x1-(cx-r)]
+                out[n, y0:y1, x0:x1][stamp] = self.color
+
+class GratingRenderer(HeadlessRenderer):
+    """ Renders the compiled timeline of a GratStim, including intro, baselines and outro """
+
+    def __init__(self, stim, resolution=None, batch_size=32):
+
+        super().__init__(stim, resolution, batch_size)
+
+        if not stim.stimuli:
+            stim.build_stimuli()
+
+        self.timeline = stim.build_timeline()
+        self.frame = 0
+
+        self.baseline = to_rgb(stim.config.baseline_color)
+        self.window_color = to_rgb([1, 1, 1])
+
+        # pixel centres in degrees, as psychopy converts deg units without spherical correction
+        deg_per_pix = (stim.monitor_config.screen_width / stim.monitor_config.resolution[0]) / (stim.monitor_config.viewing_distance * 0.017455)
+        scale = stim.monitor_config.resolution[0] / self.width
+        self.x_deg = self.x_norm * self.width/2 * scale * deg_per_pix
+        self.y_deg = self.y_norm * self.height/2 * scale * deg_per_pix
+
+        self.bases = {}
+
+    def get_base(self, index):
+        """ Spatial part of the grating argument in cycles, cached per stimulus """
+
+        if index not in self.bases:
+
+            stimulus = self.stim.stimuli[index]
+            ori = math.radians(stimulus.config.orientation)
+
+            # psychopy orientation is clockwise
+            along = self.x_deg[None, :] * math.cos(ori) - self.y_deg[:, None] * math.sin(ori)
+            inside = (np.abs(self.x_deg)[None, :] <= stimulus.size[0]/2) & (np.abs(self.y_deg)[:, None] <= stimulus.size[1]/2)
+
+            self.bases[index] = (stimulus.config.spatial_frequency * along, inside)
+
+        return self.bases[index]
+
+    def is_finished(self):
+
+        return self.frame >= self.timeline.num_frames
+
+    def get_entries(self):
+
+        return [{"name": self.stim.stimuli[entry["index"]].get_name(),
+                 "iteration": entry["iteration"],
+                 "start_frame": entry["start_frame"],
+                 "end_frame": entry["end_frame"]} for entry in self.timeline.entries]
+
+    def next_states(self, num_frames):
+
+        end = min(self.frame + num_frames, self.timeline.num_frames)
+        states = (self.timeline.stim_index[self.frame:end], self.timeline.phase[self.frame:end])
+        self.frame = end
+
+        return states
+
+    def rasterize(self, states, out):
+
+        indices, phases = states
+
+        for n in range(len(out)):
+
+            index = indices[n]
+
+            if index == Timeline.BASELINE:
+                out[n] = self.baseline
+                continue
+
+            base, inside = self.get_base(index)
+            luminance = np.sin(2 * np.pi * (base + phases[n]))
+            grey = np.round((luminance + 1) / 2 * 255).astype(np.uint8)
+
+            out[n] = self.window_color
+            np.copyto(out[n], grey[..., None], where=inside[..., None])
+
+RENDERERS = {"KalatskyStim": KalatskyRenderer,
+             "SingleDotStim": SingleDotRenderer,
+             "DotsStim": DotsRenderer,
+             "GratStim": GratingRenderer}
+
+def get_renderer(stim, resolution=None, batch_size=32):
+    """
+    Return the headless renderer for a stimulus object.
+
+    Parameters:
+    - stim: KalatskyStim, SingleDotStim, DotsStim or GratStim, constructed but not presented.
+    - resolution (tuple): (width, height) of the rendered frames, defaults to the monitor resolution.
+    - batch_size (int): Number of frames preallocated in the buffer.
+
+    Returns:
+    - renderer (HeadlessRenderer): Renderer producing frames as NumPy arrays.
+    """
+    name = type(stim).__name__
+
+    if name not in RENDERERS:
+        raise ValueError(f"No headless renderer for {name}")
+
+    return RENDERERS[name](stim, resolution, batch_size)
@@ -0,0 +1,198 @@
+"""
+Pre-rendered stimulus movies with memory-mapped playback.
+
+A deterministic stimulus is rendered once by the headless renderer into a raw
+uint8 frame file, keyed by a hash of the stimulus config, monitor config and
+resolution. Later sessions memory-map the frames and only blit them, so no
+geometry is computed during presentation and every rig shows identical pixels.
+
+Classes:
+- MovieCache: Renders, stores and memory-maps cached stimulus movies.
+
+Functions:
+- config_hash(config, monitor_config, resolution): Return the cache key for a stimulus.
+- prepare_cached(stim): Render the movie of a stimulus ahead of presenting it, if it isn't cached yet.
+- present_cached(stim): Present a stimulus from its cached movie.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+from ez_stims.visual.headless import get_renderer
+from ez_stims.visual.gl_stims import FrameStream
+
+CACHE_VERSION = 1
+
+def config_hash(config, monitor_config, resolution):
+    """
+    Return the cache key for a stimulus.
+
+    Parameters:
+    - config (dict): Stimulus config as loaded from YAML.
+    - monitor_config (dict): Monitor config as loaded from monitor.yaml.
+    - resolution (tuple): (width, height) of the movie.
+
+    Returns:
+    - key (str): Hex digest identifying the movie.
+    """
+    description = {"version": CACHE_VERSION,
+                   "config": config,
+                   "monitor": monitor_config,
+                   "resolution": list(resolution)}
+
+    encoded = json.dumps(description, sort_keys=True, default=str).encode()
+
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+class MovieCache():
+
+    def __init__(self, cache_dir="movies"):
+
+        self.cache_dir = cache_dir
+
+        if not os.path.exists(self.cache_dir):
+
+            os.mkdir(self.cache_dir)
+
+    def get_paths(self, key):
+
+        frames_path = os.path.join(self.cache_dir, f"{key}.frames")
+        meta_path = os.path.join(self.cache_dir, f"{key}.json")
+
+        return frames_path, meta_path
+
+    def render(self, stim, key, batch_size=32):
+        """ Render a fresh (never presented) stimulus object into the cache """
+
+        frames_path, meta_path = self.get_paths(key)
+        renderer = get_renderer(stim, batch_size=batch_size)
+
+        # write to temporary files and rename once complete, so a crash never leaves a partial movie
+        with open(frames_path + ".tmp", "wb") as frames_file:
+
+            for batch in renderer.frames():
+                frames_file.write(batch.tobytes())
+
+        meta = {"num_frames": renderer.frames_rendered,
+                "height": renderer.height,
+                "width": renderer.width,
+                "frame_rate": stim.monitor_config.frame_rate,
+                "entries": renderer.get_entries()}
+
+        with open(meta_path + ".tmp", "w") as meta_file:
+            json.dump(meta, meta_file)
+
+        os.replace(frames_path + ".tmp", frames_path)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def load(self, key):
+        """
+        Memory-map a cached movie.
+
+        Returns:
+        - frames (numpy.memmap): Read-only (frames, height, width, 3) uint8 array, or None if not cached.
+        - meta (dict): Frame count, size, frame rate and log entries.
+        """
+        frames_path, meta_path = self.get_paths(key)
+
+        if not (os.path.exists(frames_path) and os.path.exists(meta_path)):
+            return None, None
+
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+
+        frames = np.memmap(frames_path,
+                           dtype=np.uint8,
+                           mode="r",
+                           shape=(meta["num_frames"], meta["height"], meta["width"], 3))
+
+        return frames, meta
+
+    def get(self, stim):
+        """ Load the movie for a stimulus, rendering it first if it is not cached """
+
+        key = config_hash(stim.config.raw, stim.monitor_config.raw, stim.monitor_config.resolution)
+        frames, meta = self.load(key)
+
+        if frames is None:
+
+            # render from a fresh stimulus so the presented one keeps its initial state
+            fresh = type(stim)(stim.config, stim.monitor_config, None)
+            self.render(fresh, key)
+            frames, meta = self.load(key)
+
+        return frames, meta
+
+def prepare_cached(stim, cache_dir="movies"):
+    """ Render the movie of a stimulus if it isn't cached yet, so presenting it only has to map the file """
+
+    MovieCache(cache_dir).get(stim)
+
+def present_cached(stim, cache_dir="movies"):
+    """
+    Present a stimulus by blitting its cached movie, one flip per frame.
+
+    Each memory-mapped uint8 frame is streamed as is into one persistent
+    texture, so playback never converts or reallocates a frame.
+
+    The stimulus needs a window (add_window) and is logged and timed like its live presentation.
+    Pressing return stops playback and sets stim.stopped.
+    """
+    frames, meta = MovieCache(cache_dir).get(stim)
+    entries = meta["entries"]
+
+    stream = FrameStream(stim.window, meta["width"], meta["height"])
+
+    # autoDrawn stimuli are drawn over explicit draws, the movie covers the whole window anyway
+    background = getattr(stim, "background_rect", None)
+    background_shown = background is not None and background.autoDraw
+
+    if background is not None:
+        background.autoDraw = False
+
+    exp_start_time = stim.get_timestamp()
+    stim.allocation.attach()
+    k = 0
+
+    for frame in range(meta["num_frames"]):
+
+        if k < len(entries) and frame == entries[k]["start_frame"]:
+
+            stim.frame_timer.start((entries[k]["end_frame"] - frame) / meta["frame_rate"])
+            stim.allocation.start_epoch(entries[k]["name"])
+
+        stream.update(frames[frame])
+        stream.draw()
+        stim.frame_timer.flip(stim.window)
+
+        if k < len(entries) and frame == entries[k]["start_frame"]:
+            stim_init_time = stim.get_timestamp()
+
+        if k < len(entries) and frame == entries[k]["end_frame"] - 1:
+
+            stim_end_time = stim.get_timestamp()
+            stim.allocation.end_epoch()
+
+            if stim.log is not None:
+                stim.log.add_stim(entries[k]["name"], entries[k]["iteration"], stim_init_time, stim_end_time, stim.frame_timer.summary())
+
+            stim.allocation.collect()
+            k += 1
+
+        # stop, handing control back to the caller
+        if stim.get_keypress() == "return":
+
+            stim.allocation.end_epoch()
+            stim.stopped = True
+            break
+
+    stream.release()
+
+    # left on screen as the stimulus' background until it is cleared
+    if background is not None:
+        background.autoDraw = background_shown
+
+    print(f"Cached movie [{meta['num_frames']} frames, {round((stim.get_timestamp()-exp_start_time)/1000, 1)} s]")
+    stim.allocation.detach()
+    stim.allocation.print_report()
@@ -1,61 +1,99 @@
-from psychopy import core, visual
+import numpy as np
 
-from ez_stims.utils.enums import GratBehavior
 from ez_stims.utils.util_funcs import *
+from ez_stims.visual.grating_cache import GratingCache
 
 class Stimulus:
-    def __init__(self, window, monitor_config, stimulus_config, size):
+    def __init__(self, window, stimulus_config, size, cache=None):
         
         self.window = window
-        self.frame_rate = monitor_config["frame_rate"]
         
-        for name, value in stimulus_config.items():
-            setattr(self, name, value)
-            
-        self.behavior = GratBehavior[self.behavior]
-            
+        # validated paradigm entry, its phase advance and flicker period are precomputed for the monitor
+        self.config = stimulus_config
         self.size = size            
+
+        # grating is built lazily and shared with stimuli of identical texture
+        self.cache = cache if cache is not None else GratingCache(self.window)
+        self.tex = "sin"
+        self.units = "deg"
+        self.phase = 0
+        self.grating = None
+    
+    def prepare(self):
+        """ Build (or fetch) the grating ahead of the first frame and keep it for every draw, orienting it for this stimulus """
         
-        self.period = 1 / self.velocity
+        # fetched once, the reference keeps it alive even if the cache drops it
+        if self.grating is None:
+            self.grating = self.cache.get(self.tex, self.config.spatial_frequency, self.size, self.units)
             
-        self.temporal_frequency = self.velocity * self.spatial_frequency
-        self.phase_advance = self.temporal_frequency / self.frame_rate
-
-        # create stimulus
-        self.grating = visual.GratingStim(self.window, 
-                                          tex="sin", 
-                                          units="deg", 
-                                          size=self.size, 
-                                          sf=self.spatial_frequency,
-                                          ori=self.orientation)
+        self.set_orientation()
+        
+    def set_orientation(self):
+        
+        # the grating may be shared with a stimulus of another orientation, and setting ori
+        # makes psychopy rebuild its vertices, so only set it when it actually changes
+        if self.grating.ori != self.config.orientation:
+            self.grating.ori = self.config.orientation
+        
+    def get_grating(self):
+        
+        if self.grating is None:
+            self.prepare()
+        
+        return self.grating
     
     def advance(self):
         
-        if self.behavior.name == "FLICKER":
+        if self.config.behavior.name == "FLICKER":
             
             self.flicker()
             
-        elif self.behavior.name == "DRIFT":
+        elif self.config.behavior.name == "DRIFT":
             
             self.drift()
           
     def drift(self):
         
-        self.grating.setPhase(self.phase_advance, '+')
-        self.grating.draw()
+        self.draw_at((self.phase + self.config.phase_advance) % 1)
         
     def flicker(self):
         
-        self.grating.setPhase(0.5, '+')
-        self.grating.draw()
-        core.wait(self.period)
+        from psychopy import core
+        
+        self.draw_at((self.phase + 0.5) % 1)
+        core.wait(self.config.period)
+        
+    def get_phases(self, num_frames, start_phase=0):
+        """ Return the phase of each of the next num_frames frames """
+        
+        frames = np.arange(1, num_frames+1)
+        
+        if self.config.behavior.name == "FLICKER":
+            
+            # half a cycle jump, held for one flicker period
+            phases = start_phase + 0.5 * ((frames-1)//self.config.frames_per_flicker + 1)
+            
+        elif self.config.behavior.name == "DRIFT":
+            
+            phases = start_phase + self.config.phase_advance * frames
+            
+        return np.mod(phases, 1)
+    
+    def draw_at(self, phase):
+        
+        self.phase = phase
+        
+        # orientation is set once in prepare, which runs before each presentation of the stimulus
+        grating = self.get_grating()
+        grating.phase = phase
+        grating.draw()
         
     def get_duration(self):
         
-        return self.duration
+        return self.config.duration
     
     def get_name(self):
         
-        return self.name
+        return self.config.name
         
         
\ No newline at end of file
@@ -0,0 +1,81 @@
+"""
+Frame-exact schedule for grating paradigms.
+
+A Timeline is built once from the intro, baseline, stimulus and outro durations
+and compiled into one entry per frame, so the presenter only has to walk it.
+
+Classes:
+- Timeline: Per-frame schedule of which stimulus is shown, its phase and its log entries.
+"""
+import numpy as np
+
+class Timeline():
+
+    BASELINE = -1
+
+    def __init__(self, frame_rate):
+
+        self.frame_rate = frame_rate
+        self.blocks = []
+        self.entries = []
+        self.num_frames = 0
+
+    def to_frames(self, duration):
+        """ Convert seconds to a whole number of frames """
+
+        return int(round(duration*self.frame_rate))
+
+    def add_baseline(self, duration):
+
+        num_frames = self.to_frames(duration)
+        self.blocks.append((self.BASELINE, num_frames))
+        self.num_frames += num_frames
+
+    def add_stimulus(self, index, iteration, duration):
+
+        # every logged stimulus is shown for at least one frame
+        num_frames = max(self.to_frames(duration), 1)
+        start_frame = self.num_frames
+
+        self.blocks.append((index, num_frames))
+        self.num_frames += num_frames
+
+        # log entry covers [start_frame, end_frame)
+        self.entries.append({"index": index,
+                             "iteration": iteration,
+                             "start_frame": start_frame,
+                             "end_frame": self.num_frames})
+
+    def compile(self, stimuli):
+        """
+        Fill the per-frame stimulus index and phase arrays.
+
+        Parameters:
+        - stimuli (list): Stimulus objects referenced by index in the blocks.
+        """
+        self.stim_index = np.full(self.num_frames, self.BASELINE, dtype=np.int32)
+        self.phase = np.zeros(self.num_frames)
+
+        # phase carries over between iterations of the same stimulus
+        last_phase = np.zeros(len(stimuli))
+        frame = 0
+
+        for index, num_frames in self.blocks:
+
+            if index != self.BASELINE:
+
+                phases = stimuli[index].get_phases(num_frames, last_phase[index])
+
+                self.stim_index[frame:frame+num_frames] = index
+                self.phase[frame:frame+num_frames] = phases
+
+                if num_frames > 0:
+                    last_phase[index] = phases[-1]
+
+            frame += num_frames
+
+        return self
+
+    def get_duration(self):
+
+        return self.num_frames/self.frame_rate
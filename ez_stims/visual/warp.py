@@ -0,0 +1,152 @@
+"""
+Spherical correction of periodic stimuli on a flat monitor.
+
+The azimuth and altitude seen by the eye at every pixel are computed once from
+the monitor geometry, with the eye facing the screen centre at the viewing
+distance, and cached on disk. Frames are then drawn by looking up these maps,
+so a bar of constant angular width sweeps at constant angular speed and its
+checks are square in visual angle.
+
+Classes:
+- WarpedBar: Draws a spherically corrected bar or checkerboard bar from the warp maps.
+
+Functions:
+- compute_warp_maps(resolution, screen_width, viewing_distance): Return the azimuth and altitude of every pixel.
+- get_warp_maps(monitor_config, resolution=None, cache_dir="warps"): Load the warp maps, computing and caching them first if needed.
+"""
+import os
+import json
+import hashlib
+import numpy as np
+
+WARP_VERSION = 1
+
+def compute_warp_maps(resolution, screen_width, viewing_distance):
+    """
+    Return the azimuth and altitude of every pixel.
+
+    Parameters:
+    - resolution (tuple): (width, height) of the screen in pixels, pixels are taken to be square.
+    - screen_width (float): Physical width of the screen.
+    - viewing_distance (float): Distance from the eye to the screen centre, same units as screen_width.
+
+    Returns:
+    - azimuth (numpy.ndarray): (height, width) float32 degrees, increasing to the right, top row first.
+    - altitude (numpy.ndarray): (height, width) float32 degrees, increasing upwards, top row first.
+    """
+    width, height = resolution
+    screen_height = screen_width * height / width
+
+    # pixel centres on the screen relative to its centre
+    x = ((np.arange(width) + 0.5) / width - 0.5) * screen_width
+    z = (0.5 - (np.arange(height) + 0.5) / height) * screen_height
+    x, z = np.meshgrid(x, z)
+
+    azimuth = np.degrees(np.arctan2(x, viewing_distance))
+    altitude = np.degrees(np.arctan2(z, np.hypot(viewing_distance, x)))
+
+    return azimuth.astype(np.float32), altitude.astype(np.float32)
+
+def get_warp_maps(monitor_config, resolution=None, cache_dir="warps"):
+    """
+    Load the warp maps for a monitor, computing and caching them first if needed.
+
+    Parameters:
+    - monitor_config (MonitorConfig): Monitor config as loaded from monitor.yaml.
+    - resolution (tuple): (width, height) of the maps, defaults to the monitor resolution.
+    - cache_dir (str): Folder the maps are cached in.
+
+    Returns:
+    - azimuth, altitude (numpy.ndarray): See compute_warp_maps.
+    """
+    resolution = tuple(resolution) if resolution is not None else tuple(monitor_config.resolution)
+
+    geometry = {"version": WARP_VERSION,
+                "resolution": list(resolution),
+                "screen_width": monitor_config.screen_width,
+                "viewing_distance": monitor_config.viewing_distance}
+
+    key = hashlib.sha256(json.dumps(geometry, sort_keys=True).encode()).hexdigest()[:32]
+    path = os.path.join(cache_dir, f"{key}.npz")
+
+    if os.path.exists(path):
+
+        with np.load(path) as maps:
+            return maps["azimuth"], maps["altitude"]
+
+    azimuth, altitude = compute_warp_maps(resolution, monitor_config.screen_width, monitor_config.viewing_distance)
+
+    if not os.path.exists(cache_dir):
+        os.mkdir(cache_dir)
+
+    # renamed into place once complete, so a crash never leaves partial maps
+    with open(path + ".tmp", mode="wb") as file:
+        np.savez(file, azimuth=azimuth, altitude=altitude)
+
+    os.replace(path + ".tmp", path)
+
+    return azimuth, altitude
+
+class WarpedBar():
+    """
+    A bar of two columns of checks sweeping in azimuth, drawn into an RGB frame.
+
+    Parameters:
+    - azimuth, altitude (numpy.ndarray): Warp maps from get_warp_maps.
+    - check_size (float): Width and height of a check in degrees.
+    - palette (numpy.ndarray): (2, 3) uint8 colours of the checks.
+    - background (numpy.ndarray): (3,) uint8 background colour.
+    - checkered (bool): Alternate colours between rows of checks, False for plain bars.
+    """
+    def __init__(self, azimuth, altitude, check_size, palette, background, checkered=True):
+
+        self.azimuth = azimuth
+        self.check_size = check_size
+        self.background = np.asarray(background, dtype=np.uint8)
+
+        # colour table per channel, 0 is the background and 1 and 2 the check colours
+        self.colors = np.concatenate((self.background[None, :], np.asarray(palette, dtype=np.uint8))).T.copy()
+
+        rows = np.floor(altitude / check_size).astype(np.int64)
+        self.row_parity = (rows % 2).astype(bool) if checkered else np.zeros(altitude.shape, dtype=bool)
+
+        # azimuth range of every column, so only the columns the bar covers are drawn
+        self.column_min = azimuth.min(axis=0)
+        self.column_max = azimuth.max(axis=0)
+
+        self.frame = np.empty(azimuth.shape + (3,), dtype=np.uint8)
+        self.frame[:] = self.background
+        self.columns = (0, 0)
+
+    def render(self, position, flipped):
+        """
+        Draw the bar centred at position (degrees azimuth) with colours swapped if flipped.
+
+        Returns:
+        - frame (numpy.ndarray): (height, width, 3) uint8 frame, top row first, reused between calls.
+        """
+        lo = np.searchsorted(self.column_max, position - self.check_size)
+        hi = np.searchsorted(self.column_min, position + self.check_size)
+
+        # clear the columns of the previous bar that this one doesn't cover
+        previous_lo, previous_hi = self.columns
+
+        for start, end in [(previous_lo, min(previous_hi, lo)), (max(previous_lo, hi), previous_hi)]:
+            if end > start:
+                self.frame[:, start:end] = self.background
+
+        if hi > lo:
+
+            offset = self.azimuth[:, lo:hi] - position
+
+            # left check takes the first colour in even rows, the right check the other, both swapped when flipped
+            index = self.row_parity[:, lo:hi] ^ (offset >= 0) ^ bool(flipped)
+            code = np.where(np.abs(offset) < self.check_size, index + np.uint8(1), np.uint8(0))
+
+            # one table lookup per channel is much cheaper than indexing rgb triplets
+            for channel in range(3):
+                self.frame[:, lo:hi, channel] = self.colors[channel][code]
+
+        self.columns = (lo, hi)
+
+        return self.frame
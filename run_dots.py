@@ -29,19 +29,20 @@ reproducability.
 """
 from psychopy import logging
 
-from ez_stims import DotsStim, setup
+from ez_stims import DotsStim, Log, setup
 
 def run():
     
-    dots_config = setup.load_config('dots.yaml')
-    monitor_config = setup.load_config('monitor.yaml')
+    monitor_config = setup.load_monitor_config('monitor.yaml')
+    dots_config = setup.load_stim_config('dots', 'dots.yaml', monitor_config)
     
     logging.console.setLevel(logging.CRITICAL)
     
-    monitor = setup.setup_monitor(**monitor_config)
-    window = setup.setup_window(monitor, **monitor_config)
+    monitor = setup.setup_monitor(**monitor_config.raw)
+    window = setup.setup_window(monitor, **monitor_config.raw)
+    log = Log()
 
-    dots = DotsStim(dots_config, monitor_config)
+    dots = DotsStim(dots_config, monitor_config, log)
     dots.add_window(window)
     
     dots.print_settings()
@@ -53,6 +54,9 @@ def run():
     # dots.start_timer()
     
     dots.present()
+    
+    log.write_log()
+    window.close()
 
 if __name__ == '__main__':
     run()
\ No newline at end of file
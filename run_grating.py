@@ -4,11 +4,11 @@ from ez_stims import GratStim, Log, setup
 
 def run():
     
-    grating_config = setup.load_config('grating.yaml')
-    monitor_config = setup.load_config('monitor.yaml')
+    monitor_config = setup.load_monitor_config('monitor.yaml')
+    grating_config = setup.load_stim_config('grating', 'grating.yaml', monitor_config)
 
-    monitor = setup.setup_monitor(**monitor_config)
-    window = setup.setup_window(monitor, **monitor_config)
+    monitor = setup.setup_monitor(**monitor_config.raw)
+    window = setup.setup_window(monitor, **monitor_config.raw)
     log = Log()
     
     logging.console.setLevel(logging.CRITICAL)
@@ -27,6 +27,7 @@ def run():
     gstim.present()
 
     log.write_log()
+    window.close()
 
 if __name__ == '__main__':
     run()
@@ -29,19 +29,20 @@ reproducability.
 """
 from psychopy import logging
 
-from ez_stims import KalatskyStim, setup
+from ez_stims import KalatskyStim, Log, setup
 
 def run():
     
-    kalatsky_config = setup.load_config('kalatsky.yaml')
-    monitor_config = setup.load_config('monitor.yaml')
+    monitor_config = setup.load_monitor_config('monitor.yaml')
+    kalatsky_config = setup.load_stim_config('kalatsky', 'kalatsky.yaml', monitor_config)
     
     logging.console.setLevel(logging.CRITICAL)
     
-    monitor = setup.setup_monitor(**monitor_config)
-    window = setup.setup_window(monitor, **monitor_config)
+    monitor = setup.setup_monitor(**monitor_config.raw)
+    window = setup.setup_window(monitor, **monitor_config.raw)
+    log = Log()
 
-    kalatsky = KalatskyStim(kalatsky_config, monitor_config)
+    kalatsky = KalatskyStim(kalatsky_config, monitor_config, log)
     kalatsky.add_window(window)
     
     kalatsky.print_settings()
@@ -53,6 +54,9 @@ def run():
     kalatsky.start_timer()
     
     kalatsky.present()
+    
+    log.write_log()
+    window.close()
 
 if __name__ == '__main__':
     run()
\ No newline at end of file
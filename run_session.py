@@ -0,0 +1,51 @@
+"""Presentation of a session of several stimuli.
+
+This script presents the stimuli listed in the playlist of
+config/session.yaml one after another in a single window, so
+the window is only created once for the whole session.
+
+Example
+-------
+Simply type::
+
+    $ python run_session.py
+    
+Pressing return stops the running stimulus and ends the session,
+the log of every completed stimulus is kept.
+
+Attributes
+----------
+There are no command line attributes for this program. 
+Instead the playlist in config/session.yaml should be edited, each
+entry names a stimulus type and the config file it is built from.
+"""
+from psychopy import logging
+
+from ez_stims import Log, setup
+from ez_stims.utils.session import Session
+
+def run():
+    
+    session_config = setup.load_config('session.yaml')
+    monitor_config = setup.load_monitor_config('monitor.yaml')
+    
+    logging.console.setLevel(logging.CRITICAL)
+    
+    monitor = setup.setup_monitor(**monitor_config.raw)
+    window = setup.setup_window(monitor, **monitor_config.raw)
+    log = Log()
+    
+    session = Session(session_config, monitor_config, log)
+    session.add_window(window)
+    session.build()
+    
+    completed = session.present()
+    
+    if not completed:
+        print("Session stopped")
+    
+    log.write_log()
+    window.close()
+
+if __name__ == '__main__':
+    run()
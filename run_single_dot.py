@@ -29,19 +29,20 @@ reproducability.
 """
 from psychopy import logging
 
-from ez_stims import SingleDotStim, setup
+from ez_stims import SingleDotStim, Log, setup
 
 def run():
     
-    single_dot_config = setup.load_config('single_dot.yaml')
-    monitor_config = setup.load_config('monitor.yaml')
+    monitor_config = setup.load_monitor_config('monitor.yaml')
+    single_dot_config = setup.load_stim_config('single_dot', 'single_dot.yaml', monitor_config)
     
     logging.console.setLevel(logging.CRITICAL)
     
-    monitor = setup.setup_monitor(**monitor_config)
-    window = setup.setup_window(monitor, **monitor_config)
+    monitor = setup.setup_monitor(**monitor_config.raw)
+    window = setup.setup_window(monitor, **monitor_config.raw)
+    log = Log()
 
-    single_dot = SingleDotStim(single_dot_config, monitor_config)
+    single_dot = SingleDotStim(single_dot_config, monitor_config, log)
     single_dot.add_window(window)
     
     single_dot.print_settings()
@@ -53,6 +54,9 @@ def run():
     single_dot.start_timer()
     
     single_dot.present()
+    
+    log.write_log()
+    window.close()
 
 if __name__ == '__main__':
     run()
\ No newline at end of file
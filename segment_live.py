@@ -0,0 +1,54 @@
+import os
+import argparse
+from ez_stims import segmenting
+from ez_stims.utils.online import OnlineSegmenter
+from ez_stims.utils.trial_writers import get_format
+from ez_stims.utils.util_funcs import *
+
+POLL_INTERVAL = 1.0 # seconds between polls of the scan and log
+IDLE_TIMEOUT = 30.0 # seconds without new frames after which the session is over
+START_TIMEOUT = 600.0 # seconds to wait for the scan to start before giving up
+OUTPUT_FORMAT = "tiff" # "tiff", "hdf5" (one dataset per trial in subscans.h5) or "npy"
+COMPRESSION = None # tiff compression ("zlib", "zstd", "lzma") or hdf5 complib ("blosc2:zstd", "zlib"), None for uncompressed
+COMPRESSION_LEVEL = 6
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Segment a scan into subscans while it is being acquired.")
+
+    parser.add_argument("--scan", required=True, help="ScanImage tif being acquired")
+    parser.add_argument("--log", required=True, help="stimulus log csv being written")
+    parser.add_argument("--time", required=True, help="scan start time txt")
+    parser.add_argument("--format", default=OUTPUT_FORMAT, choices=["tiff", "hdf5", "npy"])
+    parser.add_argument("--compression", default=COMPRESSION)
+    parser.add_argument("--level", type=int, default=COMPRESSION_LEVEL)
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL)
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT)
+    parser.add_argument("--start-timeout", type=float, default=START_TIMEOUT)
+
+    return parser.parse_args()
+
+def run():
+
+    args = parse_args()
+
+    output_folder = create_output_folder("subscans", os.path.split(args.scan)[0])
+    output_format = get_format(args.format, output_folder, compression=args.compression, level=args.level)
+
+    scan_unix_time = segmenting.read_start_time(args.time)
+
+    segmenter = OnlineSegmenter(args.scan,
+                                args.log,
+                                scan_unix_time,
+                                output_format,
+                                poll_interval=args.poll,
+                                idle_timeout=args.idle_timeout,
+                                start_timeout=args.start_timeout)
+
+    print("Segmenting, stops after {:.0f} s without new frames (Ctrl+C to stop now)".format(args.idle_timeout))
+
+    segmenter.run()
+    segmenter.print_report()
+
+if __name__ == "__main__":
+    run()
@@ -1,34 +1,249 @@
 import os
+import glob
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from rich.table import Table
+from rich.console import Console
 from ez_stims import segmenting
+from ez_stims.utils.writer_pool import WriterPool
+from ez_stims.utils.trial_writers import get_format
 from ez_stims.utils.util_funcs import *
 
-def run():
+CHUNK_SIZE = 256 # frames read from the scan at a time
+TIMESTAMP_WORKERS = os.cpu_count() or 1 # processes parsing frame descriptions
+WRITE_WORKERS = 8 # threads writing subscans at once
+WRITE_BUDGET = 1024**3 # bytes of frames allowed to wait for writing
+OUTPUT_FORMAT = "tiff" # "tiff", "hdf5" (one dataset per trial in subscans.h5) or "npy"
+COMPRESSION = None # tiff compression ("zlib", "zstd", "lzma") or hdf5 complib ("blosc2:zstd", "zlib"), None for uncompressed
+COMPRESSION_LEVEL = 6
+TILE = None # (height, width) of tiff tiles, multiples of 16
+CHUNK_FRAMES = 16 # frames per hdf5 chunk
+AVERAGE_TRIALS = False # write one mean and std stack per stimulus instead of every trial
+
+# files of a session folder and the patterns they are found by, the log is written as csv or jsonl
+SESSION_FILES = [("scan", ["*.tif"]),
+                 ("log", ["*.csv", "*.jsonl"]),
+                 ("start time", ["*.txt"])]
+
+def segment_session(video_filename, log_filename, time_filename, parent_folder,
+                    output_format=OUTPUT_FORMAT,
+                    compression=COMPRESSION,
+                    level=COMPRESSION_LEVEL,
+                    average_trials=AVERAGE_TRIALS,
+                    chunk_size=CHUNK_SIZE,
+                    timestamp_workers=TIMESTAMP_WORKERS,
+                    write_workers=WRITE_WORKERS):
+
+    start = time.perf_counter()
 
-    video_filename, log_filename, time_filename, parent_folder = get_filenames()
-    
     output_folder = create_output_folder("subscans", parent_folder)
-    
+
     log = segmenting.read_log(log_filename)
-    scan_reader = segmenting.open_scan(video_filename)
     scan_unix_time = segmenting.read_start_time(time_filename)
-    
-    num_frames = segmenting.get_num_frames(scan_reader)
-    
-    timestamps = segmenting.get_frame_timestamps(scan_reader, num_frames, scan_unix_time)
-    
-    scan = scan_reader.data()
-    
-    for entry in log:
-        
-        start_time, end_time = segmenting.get_stim_times(entry)
-        start_frame, end_frame = segmenting.get_stim_frames(timestamps, start_time, end_time)
-        
-        subscan = segmenting.get_subscan(scan, start_frame, end_frame)
-        
-        name = entry["Stimulus"] + segmenting.get_iteration_str(entry) + ".tif"
-        path = os.path.join(output_folder, name)
-  
-        segmenting.write_subscan(path, subscan)
-    
+
+    # the reader is only needed for the frame count, frames are read from the memory map or by page offset
+    with segmenting.open_scan(video_filename) as scan_reader:
+        num_frames = segmenting.get_num_frames(scan_reader)
+
+    # timestamps come from the sidecar index, only parsed from the scan on the first run
+    index = segmenting.get_scan_index(video_filename, num_frames, workers=timestamp_workers)
+    timestamps = segmenting.get_index_timestamps(index, scan_unix_time)
+
+    # map every log entry to its frame window in one pass
+    start_times, end_times = segmenting.get_log_times(log)
+    start_frames, end_frames, report = segmenting.map_stim_frames(timestamps, start_times, end_times)
+
+    for message in segmenting.get_mapping_warnings(log, report):
+        print(message)
+
+    windows = list(zip(start_frames, end_frames))
+
+    # uncompressed scans are memory-mapped, so chunks are views of the file instead of copies,
+    # others are read page by page at the offsets in the index
+    frames = segmenting.memmap_scan(video_filename, num_frames)
+    source = segmenting.ScanPages(video_filename, index["page_offsets"]) if frames is None else frames
+
+    try:
+
+        if average_trials:
+
+            # trials outside or only partly inside the scan are left out of the averages
+            averages, excluded = segmenting.average_subscans(source, windows, [entry["Stimulus"] for entry in log], report, chunk_size=chunk_size)
+            segmenting.write_averages(output_folder, averages)
+
+            for name in dict.fromkeys(entry["Stimulus"] for entry in log):
+
+                if name in averages:
+                    print(f"{name}: {averages[name][2]} iterations, {len(averages[name][0])} frames, {excluded.get(name, 0)} excluded")
+                else:
+                    print(f"{name}: no iterations inside the scan, {excluded.get(name, 0)} excluded")
+
+        else:
+
+            names = [entry["Stimulus"] + segmenting.get_iteration_str(entry) for entry in log]
+            trial_format = get_format(output_format,
+                                      output_folder,
+                                      compression=compression,
+                                      level=level,
+                                      tile=TILE,
+                                      chunk_frames=CHUNK_FRAMES)
+
+            # stream the scan so memory depends on chunk size and write budget, not scan length
+            with WriterPool(trial_format, workers=write_workers, memory_budget=WRITE_BUDGET) as pool:
+                segmenting.stream_subscans(source, windows, names, pool, chunk_size=chunk_size)
+
+            pool.print_report()
+
+    finally:
+
+        if frames is None:
+            source.close()
+
+    return {"session": parent_folder, "frames": num_frames, "seconds": time.perf_counter() - start}
+
+# scan, log and start time file of a session folder
+def find_session_files(folder):
+
+    files = []
+
+    for kind, patterns in SESSION_FILES:
+
+        matches = [match for pattern in patterns for match in glob.glob(os.path.join(folder, pattern))]
+
+        if len(matches) != 1:
+            raise ValueError(f"Expected one {kind} file ({' or '.join(patterns)}), found {len(matches)}")
+
+        files.append(matches[0])
+
+    return files
+
+# session folders matching a glob, with the folders whose files couldn't be found kept apart so the rest still run
+def find_sessions(pattern):
+
+    sessions = []
+    errors = []
+
+    for folder in sorted(glob.glob(pattern)):
+
+        if not os.path.isdir(folder):
+            continue
+
+        try:
+            sessions.append(find_session_files(folder) + [folder])
+        except ValueError as error:
+            errors.append({"session": folder, "error": str(error)})
+
+    return sessions, errors
+
+# summary row of a session that failed, its folder is the last of its files
+def get_session_error(session, error):
+
+    message = f"{type(error).__name__}: {error}".strip().splitlines()[0]
+    print(f"Error: {session[-1]} failed, {message}")
+
+    return {"session": session[-1], "error": message}
+
+# one row per segmented session, then the folders that were skipped, then the total over the batch
+def print_summary(results, errors=(), seconds=None):
+
+    table = Table(title="Segmented Sessions")
+
+    table.add_column("session", style="cyan")
+    table.add_column("frames", justify="right", style="magenta")
+    table.add_column("time (s)", justify="right", style="magenta")
+    table.add_column("frames/s", justify="right", style="yellow")
+    table.add_column("skipped", style="red")
+
+    total = {"session": "total",
+             "frames": sum(result["frames"] for result in results),
+             "seconds": seconds if seconds is not None else sum(result["seconds"] for result in results)}
+
+    for result in list(results) + list(errors) + [total]:
+
+        if "error" in result:
+            table.add_row(result["session"], "--", "--", "--", result["error"])
+            continue
+
+        table.add_row(result["session"],
+                      "{:d}".format(result["frames"]),
+                      "{:.1f}".format(result["seconds"]),
+                      "{:.1f}".format(result["frames"]/result["seconds"]) if result["seconds"] > 0 else "--",
+                      "")
+
+    console = Console()
+    console.print(table)
+
+def parse_args():
+
+    parser = argparse.ArgumentParser(description="Segment scans into one subscan per stimulus presentation.")
+
+    parser.add_argument("--scan", help="ScanImage tif of a single session")
+    parser.add_argument("--log", help="stimulus log csv or jsonl of a single session")
+    parser.add_argument("--time", help="scan start time txt of a single session")
+    parser.add_argument("--sessions", help="glob of session folders, each holding one tif, csv or jsonl and txt")
+    parser.add_argument("--workers", type=int, default=1, help="sessions segmented at once")
+    parser.add_argument("--format", default=OUTPUT_FORMAT, choices=["tiff", "hdf5", "npy"])
+    parser.add_argument("--compression", default=COMPRESSION)
+    parser.add_argument("--level", type=int, default=COMPRESSION_LEVEL)
+    parser.add_argument("--average", action="store_true", default=AVERAGE_TRIALS, help="write per-stimulus mean and std stacks")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    args = parser.parse_args()
+
+    if args.scan and not (args.log and args.time):
+        parser.error("--scan needs --log and --time")
+
+    return args
+
+def run():
+
+    args = parse_args()
+
+    errors = []
+
+    # without paths the files are picked in dialogs as before
+    if args.sessions:
+        sessions, errors = find_sessions(args.sessions)
+    elif args.scan:
+        sessions = [[args.scan, args.log, args.time, os.path.split(args.scan)[0]]]
+    else:
+        sessions = [list(get_filenames())]
+
+    # sessions running at once share the cores for timestamp parsing
+    workers = max(min(args.workers, len(sessions)), 1)
+    options = {"output_format": args.format,
+               "compression": args.compression,
+               "level": args.level,
+               "average_trials": args.average,
+               "chunk_size": args.chunk_size,
+               "timestamp_workers": max(TIMESTAMP_WORKERS // workers, 1)}
+
+    start = time.perf_counter()
+    results = []
+
+    # a session that fails (e.g. a corrupt scan or log) is listed as skipped and the rest still run
+    if workers == 1:
+
+        for session in sessions:
+            try:
+                results.append(segment_session(*session, **options))
+            except Exception as error:
+                errors.append(get_session_error(session, error))
+
+    else:
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+
+            futures = [pool.submit(segment_session, *session, **options) for session in sessions]
+
+            for session, future in zip(sessions, futures):
+                try:
+                    results.append(future.result())
+                except Exception as error:
+                    errors.append(get_session_error(session, error))
+
+    print_summary(results, errors, time.perf_counter() - start)
+
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    run()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the package is run from the repository root rather than installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
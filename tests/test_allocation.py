@@ -0,0 +1,25 @@
+import gc
+
+from ez_stims.utils.allocation import AllocationPolicy
+
+def test_collect_outside_presentation_leaves_callbacks():
+
+    policy = AllocationPolicy()
+    policy.collect()
+
+    assert policy.on_gc not in gc.callbacks
+    assert policy.idle["scheduled_collections"] == 1
+
+def test_detach_removes_callback_and_closes_epoch():
+
+    policy = AllocationPolicy()
+    policy.attach()
+    policy.start_epoch("stimulus")
+
+    assert policy.on_gc in gc.callbacks
+
+    policy.detach()
+
+    assert policy.on_gc not in gc.callbacks
+    assert gc.isenabled()
+    assert [epoch["name"] for epoch in policy.get_report()] == ["stimulus", "idle"]
@@ -0,0 +1,80 @@
+"""
+Validation and immutability of the typed configs.
+"""
+import numpy as np
+import pytest
+
+from ez_stims.utils.config import ConfigError, MonitorConfig, KalatskyConfig, DotsConfig
+
+MONITOR = {"resolution": [160, 90],
+           "frame_rate": 60,
+           "screen_width": 34.56,
+           "viewing_distance": 45,
+           "screen_number": 0,
+           "ratio_stimulus-screen": 10}
+
+DOTS = {"background_color": [-1, -1, -1],
+        "color": "white",
+        "dot_velocity": 8,
+        "dot_radius_pix": 6,
+        "spawn_frequency": 10,
+        "angle": 45,
+        "num_spawn_loc": 25,
+        "engine": "ELEMENTS"}
+
+def test_unknown_keys_are_named():
+
+    with pytest.raises(ConfigError, match="frame_rat is not a known setting, did you mean frame_rate"):
+        MonitorConfig(dict(MONITOR, frame_rat=60))
+
+def test_configs_are_read_only():
+
+    monitor = MonitorConfig(MONITOR)
+    dots = DotsConfig(DOTS, monitor)
+
+    with pytest.raises(AttributeError):
+        monitor.frame_rate = 30
+
+    with pytest.raises(AttributeError):
+        del dots.color
+
+    # lists are stored as tuples and arrays can't be written to
+    assert monitor.resolution == (160, 90)
+    assert dots.background_color == (-1, -1, -1)
+    assert isinstance(dots.spawn_linspace, tuple) and isinstance(dots.spawn_candidates, tuple)
+
+    with pytest.raises(ValueError):
+        dots.spawn_exclusion[0, 0] = False
+
+def test_raw_settings_are_copied():
+
+    raw = {"behavior": "LOOP", "stimulus_type": "CHECK", "lag": 0, "cached": False, "engine": "TEXTURE",
+           "background_color": "gray", "initial_colors": ["black", "white"], "velocity": 20, "cycles": 1,
+           "flip_frequency": 5, "number_of_checks": 16, "starting_position": 1, "direction": 1}
+
+    config = KalatskyConfig(raw, MonitorConfig(MONITOR))
+    raw["initial_colors"].append("red")
+
+    assert config.initial_colors == ("black", "white")
+    assert config.raw["initial_colors"] == ["black", "white"]
+
+    # forced inwards when starting at an edge
+    assert config.direction == -1
+
+def test_config_cache_keeps_one_entry_per_file(tmp_path):
+
+    pytest.importorskip("psychopy")
+    from ez_stims.utils import setup
+
+    config = tmp_path / "dots.yaml"
+    cache = tmp_path / ".cache"
+
+    for velocity in (8, 9, 10):
+
+        config.write_text(f"dot_velocity: {velocity}\n")
+
+        assert setup.load_config("dots.yaml", config_dir=str(tmp_path)) == {"dot_velocity": velocity}
+        assert len(list(cache.iterdir())) == 1
+
+    # read back from the cache
+    assert setup.load_config("dots.yaml", config_dir=str(tmp_path)) == {"dot_velocity": 10}
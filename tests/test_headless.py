@@ -0,0 +1,159 @@
+"""
+Golden-frame tests of the headless renderers.
+
+Every renderer draws a small, fixed config for a few seconds and sampled
+frames are compared against the frames stored in tests/golden. After an
+intended change to how a stimulus looks, regenerate them with:
+
+    $ UPDATE_GOLDEN=1 python -m pytest tests/test_headless.py
+"""
+import os
+import numpy as np
+import pytest
+
+from ez_stims import KalatskyStim, SingleDotStim, DotsStim, GratStim
+from ez_stims.utils.config import MonitorConfig, KalatskyConfig, SingleDotConfig, DotsConfig, GratingConfig
+from ez_stims.visual.headless import get_renderer, DotsRenderer
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+UPDATE = os.environ.get("UPDATE_GOLDEN") == "1"
+
+NUM_FRAMES = 240
+SAMPLE_EVERY = 20
+
+# fraction of pixels allowed to differ, for rounding differences between numpy builds
+TOLERANCE = 0.001
+
+MONITOR = {"resolution": [160, 90],
+           "frame_rate": 60,
+           "screen_width": 34.56,
+           "viewing_distance": 45,
+           "screen_number": 0,
+           "ratio_stimulus-screen": 10}
+
+KALATSKY = {"behavior": "BOUNCE",
+            "stimulus_type": "CHECK",
+            "lag": 0.5,
+            "cached": False,
+            "engine": "TEXTURE",
+            "background_color": "gray",
+            "initial_colors": ["black", "white"],
+            "velocity": 60,
+            "cycles": 2,
+            "flip_frequency": 5,
+            "number_of_checks": 8,
+            "starting_position": 0.5,
+            "direction": 1}
+
+SINGLE_DOT = {"behavior": "BOUNCE",
+              "lag": 0.5,
+              "cached": False,
+              "background_color": "black",
+              "dot_color": "red",
+              "dot_radius": 0.1,
+              "path_y": 0.5,
+              "velocity": 80,
+              "cycles": 2,
+              "start_x": 0.3,
+              "direction": -1}
+
+DOTS = {"background_color": "black",
+        "color": "white",
+        "dot_velocity": 8,
+        "dot_radius_pix": 6,
+        "spawn_frequency": 10,
+        "angle": 45,
+        "num_spawn_loc": 25,
+        "engine": "ELEMENTS"}
+
+GRATING = {"global": {"iterations": 1,
+                      "randomise": False,
+                      "cached": False,
+                      "compiled_timeline": True,
+                      "intro_active": True,
+                      "intro_duration": 0.5,
+                      "outro_active": True,
+                      "outro_duration": 0.5,
+                      "baseline_duration": 0.5,
+                      "baseline_color": [0.5, 0.5, 0.5]},
+           "paradigm": [{"name": "flicker", "behavior": "FLICKER", "duration": 1, "spatial_frequency": 0.1,
+                         "orientation": 0.0, "contrast": 1.0, "velocity": 2},
+                        {"name": "drift", "behavior": "DRIFT", "duration": 1, "spatial_frequency": 0.3,
+                         "orientation": 90.0, "contrast": 1.0, "velocity": 5}]}
+
+@pytest.fixture
+def monitor():
+
+    return MonitorConfig(MONITOR)
+
+def render(renderer):
+    """ Every SAMPLE_EVERY-th frame of the first NUM_FRAMES, copied out of the renderer's buffer """
+
+    frames = np.concatenate([batch.copy() for batch in renderer.frames(batch_size=SAMPLE_EVERY, max_frames=NUM_FRAMES)])
+
+    return frames[::SAMPLE_EVERY]
+
+def check_golden(name, frames):
+
+    path = os.path.join(GOLDEN_DIR, f"{name}.npz")
+
+    if UPDATE:
+        os.makedirs(GOLDEN_DIR, exist_ok=True)
+        np.savez_compressed(path, frames=frames)
+
+    if not os.path.exists(path):
+        pytest.fail(f"No golden frames for {name}, generate them with UPDATE_GOLDEN=1")
+
+    golden = np.load(path)["frames"]
+
+    assert frames.shape == golden.shape
+
+    for i, (frame, expected) in enumerate(zip(frames, golden)):
+
+        differing = np.count_nonzero(np.any(frame != expected, axis=-1))
+
+        assert differing <= TOLERANCE * frame.shape[0] * frame.shape[1], f"{name}: frame {i*SAMPLE_EVERY} differs in {differing} pixels"
+
+def test_kalatsky(monitor):
+
+    stim = KalatskyStim(KalatskyConfig(KALATSKY, monitor), monitor, None)
+
+    check_golden("kalatsky", render(get_renderer(stim)))
+
+def test_kalatsky_bar(monitor):
+
+    stim = KalatskyStim(KalatskyConfig(dict(KALATSKY, stimulus_type="BAR"), monitor), monitor, None)
+
+    check_golden("kalatsky_bar", render(get_renderer(stim)))
+
+def test_single_dot(monitor):
+
+    stim = SingleDotStim(SingleDotConfig(SINGLE_DOT, monitor), monitor, None)
+
+    check_golden("single_dot", render(get_renderer(stim)))
+
+def test_dots(monitor):
+
+    stim = DotsStim(DotsConfig(DOTS, monitor), monitor, None)
+
+    check_golden("dots", render(DotsRenderer(stim, seed=1)))
+
+def test_dots_seed_is_private(monitor):
+    """ Seeding the renderer must not touch the process-wide generator """
+
+    import random
+
+    random.seed(0)
+    expected = random.random()
+
+    random.seed(0)
+    stim = DotsStim(DotsConfig(DOTS, monitor), monitor, None)
+    render(DotsRenderer(stim, seed=1))
+
+    assert random.random() == expected
+
+def test_grating(monitor):
+
+    stim = GratStim(GratingConfig(GRATING, monitor), monitor, None)
+
+    check_golden("grating", render(get_renderer(stim)))
@@ -0,0 +1,72 @@
+"""
+Segmentation of a scan while it is still being written.
+"""
+import os
+import numpy as np
+import tifffile
+
+from ez_stims.utils.online import OnlineSegmenter
+from ez_stims.utils.trial_writers import get_format
+
+SCAN_UNIX_TIME = 1_000_000
+
+def append_frames(path, frames, first):
+    """ Append pages the way an acquisition does, one frame description per page """
+
+    for i, frame in enumerate(frames):
+        with tifffile.TiffWriter(path, append=True) as tif:
+            tif.write(frame, description=f"frameTimestamps_sec = {(first + i) * 0.1:.6f}")
+
+def write_log(path, rows):
+
+    with open(path, mode="w") as file:
+        file.write("Stimulus,Iteration,Start time,End time\n")
+        for name, iteration, start, end in rows:
+            file.write(f"{name},{iteration},{SCAN_UNIX_TIME + start},{SCAN_UNIX_TIME + end}\n")
+
+def test_polls_only_new_pages_and_writes_trials(tmp_path):
+
+    scan = str(tmp_path / "scan.tif")
+    log = str(tmp_path / "log.csv")
+    frames = np.arange(30*4*5, dtype=np.uint16).reshape(30, 4, 5)
+
+    write_log(log, [("A", 1, 200, 700), ("B", 1, 1500, 2500)])
+    segmenter = OnlineSegmenter(scan, log, SCAN_UNIX_TIME, get_format("npy", str(tmp_path)))
+
+    # nothing acquired yet
+    assert segmenter.poll_scan() == 0
+
+    append_frames(scan, frames[:12], 0)
+    segmenter.poll_log()
+
+    # the newest page is held back in case it is still being written
+    assert segmenter.poll_scan() == 11
+    segmenter.segment_ready()
+    assert [trial["name"] for trial in segmenter.trials] == ["A_Iteration-1"]
+
+    append_frames(scan, frames[12:], 12)
+
+    assert segmenter.poll_scan() == 18
+    assert segmenter.poll_scan(final=True) == 1
+    assert segmenter.timestamps.tolist() == [SCAN_UNIX_TIME + 100*i for i in range(30)]
+
+    with tifffile.TiffFile(scan) as tif:
+        assert segmenter.page_offsets == [page.offset for page in tif.pages]
+
+    segmenter.segment_ready(final=True)
+    segmenter.output_format.close()
+
+    assert [(trial["name"], trial["frames"]) for trial in segmenter.trials] == [("A_Iteration-1", 6), ("B_Iteration-1", 11)]
+    assert np.array_equal(np.load(os.path.join(tmp_path, "B_Iteration-1.npy")), frames[15:26])
+
+def test_run_stops_if_the_scan_never_starts(tmp_path):
+
+    log = str(tmp_path / "log.csv")
+    write_log(log, [("A", 1, 200, 700)])
+
+    segmenter = OnlineSegmenter(str(tmp_path / "scan.tif"), log, SCAN_UNIX_TIME, get_format("npy", str(tmp_path)),
+                                poll_interval=0.01, start_timeout=0.05)
+    segmenter.run()
+
+    # the trial is still reported, with no frames
+    assert [(trial["name"], trial["frames"]) for trial in segmenter.trials] == [("A_Iteration-1", 0)]
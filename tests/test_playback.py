@@ -0,0 +1,113 @@
+"""
+Drawing of the GL stimuli in a real window.
+
+A frame streamed through FrameStream must land on screen pixel for pixel as
+the headless renderer drew it, and the shader-drawn warped bar must match
+WarpedBar. Needs psychopy, pyglet and a display, and is skipped without them.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("psychopy")
+pytest.importorskip("pyglet")
+
+from psychopy import visual
+
+from ez_stims import KalatskyStim
+from ez_stims.utils.config import MonitorConfig, KalatskyConfig
+from ez_stims.visual.headless import get_renderer
+from ez_stims.visual.headless import to_rgb
+from ez_stims.visual.warp import WarpedBar, compute_warp_maps
+from ez_stims.visual.gl_stims import FrameStream, WarpedBarShader
+
+SIZE = (160, 90)
+
+MONITOR = {"resolution": list(SIZE),
+           "frame_rate": 60,
+           "screen_width": 34.56,
+           "viewing_distance": 45,
+           "screen_number": 0,
+           "ratio_stimulus-screen": 10}
+
+KALATSKY = {"behavior": "LOOP",
+            "stimulus_type": "CHECK",
+            "lag": 0,
+            "cached": False,
+            "engine": "TEXTURE",
+            "background_color": "gray",
+            "initial_colors": ["black", "white"],
+            "velocity": 60,
+            "cycles": 1,
+            "flip_frequency": 5,
+            "number_of_checks": 8,
+            "starting_position": 0,
+            "direction": 1}
+
+@pytest.fixture
+def window():
+
+    try:
+        window = visual.Window(size=SIZE, units="norm", fullscr=False, useFBO=False, allowGUI=False)
+    except Exception as error:
+        pytest.skip(f"No window could be opened: {error}")
+
+    if tuple(window.size) != SIZE:
+        window.close()
+        pytest.skip(f"Window opened at {tuple(window.size)} instead of {SIZE}")
+
+    yield window
+
+    window.close()
+
+def test_stream_matches_headless(window):
+
+    monitor = MonitorConfig(MONITOR)
+    stim = KalatskyStim(KalatskyConfig(KALATSKY, monitor), monitor, None)
+    frames = get_renderer(stim).render(40)
+
+    stream = FrameStream(window, *SIZE)
+
+    for frame in (frames[0], frames[-1]):
+
+        stream.update(frame)
+        stream.draw()
+
+        drawn = np.asarray(window.getMovieFrame(buffer="back"))[..., :3]
+        window.flip()
+
+        assert np.array_equal(drawn, frame)
+
+    stream.release()
+
+def test_stream_rejects_float_frames(window):
+
+    stream = FrameStream(window, *SIZE)
+
+    with pytest.raises(ValueError):
+        stream.update(np.zeros((SIZE[1], SIZE[0], 3)))
+
+    stream.release()
+
+def test_warped_shader_matches_cpu(window):
+
+    azimuth, altitude = compute_warp_maps(SIZE, MONITOR["screen_width"], MONITOR["viewing_distance"])
+    palette = np.stack([to_rgb("black"), to_rgb("white")])
+    background = to_rgb("gray")
+
+    cpu = WarpedBar(azimuth, altitude, 5.0, palette, background)
+    shader = WarpedBarShader(window, azimuth, altitude, 5.0, palette, background)
+
+    for position, flipped in [(-20.0, False), (0.0, True), (12.5, False)]:
+
+        shader.update(position, flipped)
+        shader.draw()
+
+        drawn = np.asarray(window.getMovieFrame(buffer="back"))[..., :3]
+        window.flip()
+
+        # float32 rounding can move a bar or check edge by a pixel
+        differing = np.count_nonzero(np.any(drawn != cpu.render(position, flipped), axis=-1))
+
+        assert differing <= 0.005 * SIZE[0] * SIZE[1]
+
+    shader.release()
@@ -0,0 +1,142 @@
+"""
+Frame reads and frame mapping of the offline segmentation.
+"""
+import numpy as np
+import pytest
+import tifffile
+
+from ez_stims.utils import segmenting
+
+def write_scan(path, frames, **kwargs):
+    """ One page per frame with a ScanImage-like frame description """
+
+    with tifffile.TiffWriter(path) as tif:
+        for i, frame in enumerate(frames):
+            tif.write(frame, description=f"frameTimestamps_sec = {i/30:.6f}", **kwargs)
+
+@pytest.fixture
+def frames():
+
+    return np.arange(12*6*8, dtype=np.uint16).reshape(12, 6, 8)
+
+def test_page_offsets_match_tifffile(tmp_path, frames):
+
+    path = str(tmp_path / "scan.tif")
+    write_scan(path, frames, compression="zlib")
+
+    with tifffile.TiffFile(path) as tif:
+        expected = [page.offset for page in tif.pages]
+
+    assert segmenting.read_page_offsets(path).tolist() == expected
+
+def test_scan_pages_reads_by_offset(tmp_path, frames):
+
+    path = str(tmp_path / "scan.tif")
+    write_scan(path, frames, compression="zlib")
+
+    scan = segmenting.ScanPages(path, segmenting.read_page_offsets(path))
+
+    assert segmenting.get_num_frames(scan) == len(frames)
+    assert np.array_equal(segmenting.read_frames(scan, 3, 9), frames[3:9])
+
+    scan.close()
+
+def test_scan_index_kept_in_memory_when_not_writable(tmp_path, frames, monkeypatch, capsys):
+
+    path = str(tmp_path / "scan.tif")
+    write_scan(path, frames)
+
+    def read_only(src, dst):
+        raise PermissionError(13, "Permission denied", dst)
+
+    # timestamps are parsed with ScanImageTiffReader, only the page offsets matter here
+    monkeypatch.setattr(segmenting, "read_all_frame_seconds", lambda filename, num_frames, workers: np.arange(num_frames) / 30)
+    monkeypatch.setattr(segmenting.os, "replace", read_only)
+
+    index = segmenting.get_scan_index(path, len(frames))
+
+    assert len(index["page_offsets"]) == len(frames)
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["scan.tif"]
+    assert capsys.readouterr().out.count("Warning") == 1
+
+def test_memmap_scan_maps_frame_stacks(tmp_path, frames):
+
+    path = str(tmp_path / "scan.tif")
+    tifffile.imwrite(path, frames)
+
+    scan = segmenting.memmap_scan(path, len(frames))
+
+    assert scan is not None
+    assert np.array_equal(segmenting.read_frames(scan, 2, 5), frames[2:5])
+
+def test_memmap_scan_rejects_hyperstacks(tmp_path, frames):
+
+    path = str(tmp_path / "scan.tif")
+    tifffile.imwrite(path, frames.reshape(4, 3, 6, 8), imagej=True)
+
+    assert segmenting.memmap_scan(path, len(frames)) is None
+
+    # read page by page instead, in acquisition order
+    scan = segmenting.ScanPages(path, segmenting.read_page_offsets(path))
+    assert np.array_equal(segmenting.read_frames(scan, 0, len(frames)), frames)
+    scan.close()
+
+def test_read_frames_rejects_hyperstack_arrays(frames):
+
+    with pytest.raises(ValueError):
+        segmenting.read_frames(frames.reshape(4, 3, 6, 8), 0, 1)
+
+def test_memmap_scan_rejects_single_page_series(tmp_path, frames):
+
+    # pages written one by one are separate series, only the first would be mapped
+    path = str(tmp_path / "scan.tif")
+    write_scan(path, frames)
+
+    assert segmenting.memmap_scan(path, len(frames)) is None
+
+def test_map_stim_frames_without_frames():
+
+    start_frames, end_frames, report = segmenting.map_stim_frames(np.empty(0, dtype=np.int64), np.array([10, 50]), np.array([40, 90]))
+
+    assert start_frames.tolist() == [0, 0] and end_frames.tolist() == [0, 0]
+    assert report["outside"].tolist() == [0, 1]
+    assert len(report["truncated"]) == 0 and len(report["overlapping"]) == 0
+
+def test_map_stim_frames_matches_get_stim_frames():
+
+    frame_times = np.arange(0, 1000, 33)
+    start_times, end_times = np.array([-50, 100, 400, 990]), np.array([20, 300, 700, 1200])
+
+    start_frames, end_frames, report = segmenting.map_stim_frames(frame_times, start_times, end_times)
+
+    for k in range(len(start_times)):
+        start, end = segmenting.get_stim_frames(frame_times, start_times[k], end_times[k])
+        assert (start_frames[k], end_frames[k]) == (max(start, 0), min(end, len(frame_times)))
+
+    assert report["truncated"].tolist() == [0, 3]
+
+def test_map_stim_frames_after_scan_is_empty():
+
+    frame_times = np.arange(0, 1000, 33)
+
+    start_frames, end_frames, report = segmenting.map_stim_frames(frame_times, np.array([-90, 100, 1100]), np.array([-40, 300, 1400]))
+
+    assert report["outside"].tolist() == [0, 2]
+    assert len(report["overlapping"]) == 0
+    assert start_frames[0] == end_frames[0] and start_frames[2] == end_frames[2]
+    assert end_frames[1] > start_frames[1]
+
+def test_average_subscans_leaves_out_trials_outside_the_scan(frames):
+
+    frame_times = np.arange(len(frames)) * 100
+    start_times, end_times = np.array([0, 400, 1500]), np.array([250, 650, 1750])
+
+    start_frames, end_frames, report = segmenting.map_stim_frames(frame_times, start_times, end_times)
+    windows = list(zip(start_frames, end_frames))
+
+    averages, excluded = segmenting.average_subscans(frames, windows, ["A", "A", "A"], report, chunk_size=4)
+    mean, std, count = averages["A"]
+
+    assert count == 2 and excluded == {"A": 1}
+    assert len(mean) == min(end - start for start, end in windows[:2])
+    assert np.allclose(mean, (frames[windows[0][0]:][:len(mean)] + frames[windows[1][0]:][:len(mean)]) / 2)
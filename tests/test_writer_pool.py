@@ -0,0 +1,50 @@
+"""
+Memory budget of the subscan writer pool.
+"""
+import threading
+import numpy as np
+
+from ez_stims.utils.writer_pool import WriterPool
+
+class SlowFormat():
+    """ Output format whose writers block until released, recording what they were given """
+
+    shared = False
+
+    def __init__(self):
+
+        self.release = threading.Event()
+        self.blocks = []
+
+    def open(self, name, num_frames):
+
+        return self
+
+    def write(self, frames):
+
+        self.release.wait()
+        self.blocks.append(frames)
+
+    def close(self):
+
+        pass
+
+def test_queued_blocks_are_copies_counted_at_their_own_size():
+
+    output_format = SlowFormat()
+    chunk = np.zeros((64, 32, 32), dtype=np.uint16)
+
+    pool = WriterPool(output_format, workers=1, memory_budget=1024**2)
+    pool.open(0, "trial", 4)
+    pool.write(0, chunk[10:14])
+
+    # only the four frames are held, not the chunk they were sliced from
+    assert pool.pending == 4 * 32 * 32 * 2
+
+    output_format.release.set()
+    pool.close(0)
+    pool.shutdown()
+
+    block = output_format.blocks[0]
+    assert not np.shares_memory(block, chunk)
+    assert pool.pending == 0